@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import binascii
+import os
+import random
+import sys
+import timeit
+
+if True:  # to avoid PEP-8 complaints
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from fritzchecksum import crcmath
+
+
+def crc32(data):
+    return binascii.crc32(data) & 0xffffffff
+
+
+def check(rounds, seed):
+    '''Checks the crcmath primitives against binascii.crc32 on random
+    buffers. Returns the number of failed checks'''
+    rnd = random.Random(seed)
+
+    def randbytes(n):
+        return bytes(bytearray(rnd.getrandbits(8) for _ in range(n)))
+
+    failed = 0
+    for _ in range(rounds):
+        a = randbytes(rnd.choice([0, 1, rnd.randrange(1024)]))
+        b = randbytes(rnd.choice([0, 1, rnd.randrange(1 << 14)]))
+        msg = a + b
+
+        checks = [
+            ('combine', crcmath.crc32_combine(crc32(a), crc32(b), len(b)),
+             crc32(msg)),
+            ('combine_op', crcmath.crc32_combine_op(
+                crc32(a), crc32(b), crcmath.crc32_combine_gen(len(b))),
+             crc32(msg)),
+            ('shift', crcmath.crc32_shift(crc32(a), len(b)) ^ crc32(b),
+             crc32(msg)),
+            ('zeros', crcmath.crc32_zeros(len(b)), crc32(b'\0' * len(b))),
+        ]
+
+        if msg:
+            off = rnd.randrange(len(msg))
+            new = randbytes(rnd.randrange(len(msg) - off + 1))
+            patched = msg[:off] + new + msg[off + len(new):]
+            checks.append(
+                ('patch', crcmath.crc32_patch(crc32(msg), len(msg), off,
+                                              msg[off:off + len(new)], new),
+                 crc32(patched)))
+
+        for name, got, expected in checks:
+            if got != expected:
+                failed += 1
+                print('FAILED {}: {:08X} != {:08X} (len a {}, len b {})'
+                      .format(name, got, expected, len(a), len(b)))
+
+    return failed
+
+
+def bench(number):
+    '''Times combining against recomputing the crc of the concatenation'''
+    print('{:>12} {:>14} {:>14} {:>14}'.format(
+        'len2', 'combine (us)', 'shift (us)', 'crc32 (us)'))
+
+    crc1 = crc32(b'fritzchecksum')
+    for exp in (4, 10, 16, 20, 24, 28):
+        len2 = 1 << exp
+        data = b'\xa5' * len2
+        crc2 = crc32(data)
+        tcomb = timeit.timeit(
+            lambda: crcmath.crc32_combine(crc1, crc2, len2), number=number)
+        tshift = timeit.timeit(
+            lambda: crcmath.crc32_shift(crc1, len2), number=number)
+        tcrc = timeit.timeit(
+            lambda: binascii.crc32(data, crc1), number=max(1, number >> exp))
+        tcrc /= max(1, number >> exp)
+        print('{:>12} {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+            len2, tcomb / number * 1e6, tshift / number * 1e6, tcrc * 1e6))
+        del data
+
+    msg = b'\x5a' * (1 << 24)
+    crc = crc32(msg)
+    tpatch = timeit.timeit(
+        lambda: crcmath.crc32_patch(crc, len(msg), 1 << 20, b'\x5a' * 8,
+                                    b'\x00' * 8), number=number)
+    print('patch 8 bytes of 16 MiB: {:.2f} us'.format(tpatch / number * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check and time the crcmath primitives')
+
+    parser.add_argument('--rounds', type=int, default=200,
+                        help='Random buffers to check against binascii')
+
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the random buffers')
+
+    parser.add_argument('--number', type=int, default=2000,
+                        help='Repetitions of each timed operation')
+
+    parser.add_argument('--no-bench', action='store_true',
+                        help='Only run the checks')
+
+    args = parser.parse_args()
+
+    failed = check(args.rounds, args.seed)
+    print('checks: {} rounds, {} failed'.format(args.rounds, failed))
+    if failed:
+        sys.exit(1)
+
+    if not args.no_bench:
+        bench(args.number)
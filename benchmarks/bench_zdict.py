@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import gzip
+import io
+import os
+import sys
+import time
+
+if True:  # to avoid PEP-8 complaints
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from fritzchecksum import model
+    from fritzchecksum import synth
+    from fritzchecksum.store import zdict
+
+
+def corpus(boxes, seed):
+    '''Returns the cfg bodies of the exports of ``boxes`` generated boxes'''
+    bodies = []
+    for box in range(boxes):
+        f = io.BytesIO()
+        synth.generate(f, seed=seed * 100000 + box, mix='cfg', sections=4,
+                       payload=(1024, 8 * 1024))
+        bodies.extend(section.raw.tobytes()
+                      for section in model.Export(f.getvalue()))
+    return bodies
+
+
+def gzip_compress(data, level):
+    bio = io.BytesIO()
+    with gzip.GzipFile(fileobj=bio, mode='wb', compresslevel=level,
+                       mtime=0) as f:
+        f.write(data)
+    return bio.getvalue()
+
+
+def gzip_decompress(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+        return f.read()
+
+
+def run(name, bodies, compress, decompress, total):
+    '''Compresses and decompresses each body on its own, checking the round
+    trip. Prints ratio and throughput, returns the number of failures'''
+    t0 = time.time()
+    blobs = [compress(b) for b in bodies]
+    tc = time.time() - t0
+
+    t0 = time.time()
+    outs = [decompress(b) for b in blobs]
+    td = time.time() - t0
+
+    failed = sum(1 for a, b in zip(bodies, outs) if a != b)
+    size = sum(len(b) for b in blobs)
+    print('{:<16} {:>12} {:>8.2f} {:>12.1f} {:>12.1f} {:>7}'.format(
+        name, size, total / size, total / tc / 1e6, total / td / 1e6,
+        failed))
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=('Compare the preset dictionary compression of the '
+                     'store against plain gzip per section on a generated '
+                     'corpus of cfg files'))
+
+    parser.add_argument('--boxes', type=int, default=500,
+                        help='Boxes in the generated corpus')
+
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated corpus')
+
+    parser.add_argument('--train', type=float, default=0.1,
+                        help='Fraction of the boxes used to train (these '
+                             'are not in the measured set)')
+
+    parser.add_argument('--dict-size', type=int, default=zdict.ZDICT_SIZE,
+                        help='Maximum size of the dictionary')
+
+    parser.add_argument('--level', type=int, default=zdict.LEVEL,
+                        help='Compression level')
+
+    args = parser.parse_args()
+
+    bodies = corpus(args.boxes, args.seed)
+    ntrain = max(1, int(len(bodies) * args.train))
+    sample, bodies = bodies[:ntrain], bodies[ntrain:]
+    total = sum(len(b) for b in bodies)
+
+    t0 = time.time()
+    zd = zdict.ZDict(zdict.train(sample, args.dict_size))
+    ttrain = time.time() - t0
+    print('sections: {} ({} bytes), trained on {} in {:.3f} s, '
+          'dictionary {} ({} bytes)'.format(
+              len(bodies), total, ntrain, ttrain, zd.version, len(zd.data)))
+
+    print('{:<16} {:>12} {:>8} {:>12} {:>12} {:>7}'.format(
+        'method', 'bytes', 'ratio', 'comp MB/s', 'decomp MB/s', 'failed'))
+
+    zdicts = {zd.id: zd}
+    failed = run('gzip', bodies,
+                 lambda b: gzip_compress(b, args.level), gzip_decompress,
+                 total)
+    failed += run('deflate', bodies,
+                  lambda b: zdict.compress(b, None, args.level),
+                  lambda b: zdict.decompress(b, zdicts), total)
+    failed += run('deflate+zdict', bodies,
+                  lambda b: zdict.compress(b, zd, args.level),
+                  lambda b: zdict.decompress(b, zdicts), total)
+
+    if failed:
+        sys.exit(1)
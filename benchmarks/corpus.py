@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import io
+import os
+import sys
+
+if True:  # to avoid PEP-8 complaints
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from fritzchecksum import synth
+
+# Corpus of the benchmarks: exports made by fritzchecksum.synth. Everything
+# is derived from the seed: the same arguments give the same bytes and crc
+
+MIXES = sorted(synth.MIXES)
+VARIANTS = ('crlf', 'escapes')  # variants of the mixed exports
+
+
+def variants(sizes):
+    '''Returns the ``(name, kwargs)`` of the corpus for ``sizes``: each mix
+    plus crlf and escaped backslash variants of the mixed export'''
+    out = []
+    for size in sizes:
+        for mix in MIXES:
+            out.append(('{}-{}'.format(mix, synth.format_size(size)),
+                        dict(size=size, mix=mix)))
+        for flag in VARIANTS:
+            out.append(('mixed-{}-{}'.format(synth.format_size(size), flag),
+                        dict(size=size, mix='mixed', **{flag: True})))
+    return out
+
+
+def build(directory, sizes, seed=0, force=False):
+    '''
+    Generates the corpus of ``variants(sizes)`` into ``directory`` as
+    ``NAME.export``. Existing files are kept (the output of a seed never
+    changes) unless ``force`` is ``True``
+
+    Returns a list of ``(name, path)``
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    out = []
+    for name, kwargs in variants(sizes):
+        path = os.path.join(directory, '{}-s{}.export'.format(name, seed))
+        if force or not os.path.exists(path):
+            tmp = path + '.tmp'
+            with io.open(tmp, 'wb') as f:
+                synth.generate(f, seed=seed, **kwargs)
+            os.rename(tmp, path)
+        out.append((name, path))
+
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate the synthetic export corpus of the benchmarks')
+
+    parser.add_argument('--sizes', nargs='+', default=['10K', '1M'],
+                        help='Sizes of the exports (10K, 1M, 1G, ...)')
+
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated content')
+
+    parser.add_argument('--force', action='store_true',
+                        help='Generate again existing files')
+
+    parser.add_argument('directory', help='Where to generate the corpus')
+
+    args = parser.parse_args()
+
+    for name, path in build(args.directory,
+                            [synth.parse_size(s) for s in args.sizes],
+                            args.seed, args.force):
+        print('{:<28} {:>12} {}'.format(name, os.path.getsize(path), path))
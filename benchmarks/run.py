@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import datetime
+import fnmatch
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+# The package is only imported where needed: the child processes running
+# the command line cases stay small (their peak memory is measured)
+
+RESULTS_VERSION = 1
+
+# command line of the cli without installing the package
+CLI = [sys.executable, '-c',
+       'import sys; sys.path.insert(0, {!r}); '
+       'from fritzchecksum.cli import run; run()'.format(ROOT)]
+
+
+# Library cases: callables taking the path of an export
+def case_calc_crc32(path):
+    from fritzchecksum import checksum
+    with io.open(path, 'r', encoding='utf-8') as f:
+        return checksum.calc_crc32(f)
+
+
+def case_calc_crc32_buffer(path):
+    from fritzchecksum import checksum
+    with io.open(path, 'rb') as f:
+        buf = checksum.map_file(f)
+        try:
+            return checksum.calc_crc32_buffer(buf)
+        finally:
+            if hasattr(buf, 'close'):
+                buf.close()
+
+
+def case_load(path):
+    from fritzchecksum import checksum
+    return checksum.ExportFile().load(path, out=False)
+
+
+def case_transform(path):
+    from fritzchecksum import checksum
+    return checksum.ExportFile().transform(path, os.devnull)
+
+
+LIBRARY_CASES = {
+    'library.calc_crc32': case_calc_crc32,
+    'library.calc_crc32_buffer': case_calc_crc32_buffer,
+    'library.load': case_load,
+    'library.transform': case_transform,
+}
+
+# Process cases: command lines (the inputs are appended)
+STARTUP_CASES = {
+    'startup.python': [sys.executable, '-c', 'pass'],
+    'startup.import': [sys.executable, '-c',
+                       'import sys; sys.path.insert(0, {!r}); '
+                       'import fritzchecksum'.format(ROOT)],
+    'startup.cli': CLI + ['--help'],
+}
+
+
+def peak_rss_kb(who):
+    '''Returns the peak resident memory in KiB of this process
+    (``RUSAGE_SELF``) or of its waited for children'''
+    if resource is None:
+        return None
+
+    if who == resource.RUSAGE_SELF:
+        # ru_maxrss survives exec: it may be the one of the parent process
+        try:
+            with io.open('/proc/self/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except (EnvironmentError, ValueError):
+            pass
+
+    rss = resource.getrusage(who).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # bytes there
+
+
+def child(case, repeat, args):
+    '''
+    Runs ``case`` ``repeat`` times in this process (started only for it, to
+    measure its peak memory on its own) and prints the times as JSON
+    '''
+    times = []
+    if case in LIBRARY_CASES:
+        func = LIBRARY_CASES[case]
+        who = resource and resource.RUSAGE_SELF
+        func(args[0])  # warm up: os caches, lazy imports
+        for _ in range(repeat):
+            t0 = time.time()
+            func(args[0])
+            times.append(time.time() - t0)
+    else:
+        who = resource and resource.RUSAGE_CHILDREN
+        with open(os.devnull, 'w') as devnull:
+            for _ in range(repeat):
+                t0 = time.time()
+                subprocess.check_call(args, stdout=devnull)
+                times.append(time.time() - t0)
+
+    print(json.dumps(dict(times=times, peak_rss_kb=peak_rss_kb(who))))
+
+
+def measure(case, repeat, args):
+    '''Runs ``case`` in a child process and returns its JSON output'''
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', case,
+           '--repeat', str(repeat), '--'] + args
+    out = subprocess.check_output(cmd)
+    return json.loads(out.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return (values[n // 2] + values[(n - 1) // 2]) / 2
+
+
+def result(case, name, nbytes, files, m):
+    '''Returns the result record of a measurement ``m``'''
+    med = median(m['times'])
+    return dict(
+        case=case, input=name, bytes=nbytes, files=files,
+        repeat=len(m['times']), seconds=med, min=min(m['times']),
+        mbps=nbytes / med / 1e6 if nbytes and med else None,
+        latency_ms=med / files * 1e3 if files else med * 1e3,
+        peak_rss_kb=m['peak_rss_kb'])
+
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                          cwd=ROOT, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('ascii').strip()
+
+
+def metadata(args):
+    import fritzchecksum
+    return dict(
+        date=datetime.datetime.utcnow().isoformat() + 'Z',
+        version=fritzchecksum.__version__, commit=git_commit(),
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(), cpus=multiprocessing.cpu_count(),
+        seed=args.seed, sizes=args.sizes, repeat=args.repeat)
+
+
+def selected(case, patterns):
+    return not patterns or any(fnmatch.fnmatch(case, p) for p in patterns)
+
+
+def print_result(r):
+    print('{:<28} {:<22} {:>12} {:>10} {:>12.2f} {:>10}'.format(
+        r['case'], r['input'], r['bytes'],
+        '-' if r['mbps'] is None else '{:.1f}'.format(r['mbps']),
+        r['latency_ms'],
+        '-' if r['peak_rss_kb'] is None else r['peak_rss_kb']))
+
+
+def run(args):
+    import corpus
+    from fritzchecksum import synth
+
+    sizes = [synth.parse_size(s) for s in args.sizes]
+    print('corpus in {} ...'.format(args.corpus), file=sys.stderr)
+    inputs = corpus.build(args.corpus, sizes, args.seed)
+
+    # many small exports for the batch runs
+    batchdir = os.path.join(args.corpus, 'batch-s{}'.format(args.seed))
+    batch = []
+    for i in range(args.batch_files):
+        path = os.path.join(batchdir, 'box{:04d}.export'.format(i))
+        if not os.path.exists(path):
+            if not os.path.isdir(batchdir):
+                os.makedirs(batchdir)
+            with io.open(path, 'wb') as f:
+                synth.generate(f, seed=args.seed * 100000 + i,
+                               size=10 * 1024)
+        batch.append(path)
+
+    print('{:<28} {:<22} {:>12} {:>10} {:>12} {:>10}'.format(
+        'case', 'input', 'bytes', 'MB/s', 'latency ms', 'peak KiB'))
+
+    results = []
+
+    def add(case, name, nbytes, files, repeat, cmdargs):
+        if not selected(case, args.cases):
+            return
+        r = result(case, name, nbytes, files, measure(case, repeat, cmdargs))
+        print_result(r)
+        results.append(r)
+
+    for case, cmd in sorted(STARTUP_CASES.items()):
+        add(case, '-', 0, 1, args.repeat, cmd)
+
+    for name, path in inputs:
+        nbytes = os.path.getsize(path)
+        repeat = max(1, min(args.repeat, args.budget * 1000000 // nbytes))
+        for case in sorted(LIBRARY_CASES):
+            add(case, name, nbytes, 1, repeat, [path])
+        add('cli.single', name, nbytes, 1, repeat, CLI + [path])
+
+    nbytes = sum(os.path.getsize(p) for p in batch)
+    name = 'batch-{}x10K'.format(len(batch))
+    for jobs in sorted(set([1, multiprocessing.cpu_count()])):
+        add('cli.batch.jobs{}'.format(jobs), name, nbytes, len(batch),
+            args.repeat, CLI + ['--jobs', str(jobs), '--format', 'jsonl',
+                                batchdir])
+
+    return results
+
+
+def compare(results, baseline):
+    '''Prints the change of throughput/latency against ``baseline``'''
+    old = dict(((r['case'], r['input']), r) for r in baseline['results'])
+    print('\ncompared to {} ({})'.format(
+        baseline['meta'].get('commit'), baseline['meta'].get('date')))
+    print('{:<28} {:<22} {:>12} {:>12} {:>8}'.format(
+        'case', 'input', 'old ms', 'new ms', 'change'))
+    for r in results:
+        o = old.get((r['case'], r['input']))
+        if o is None:
+            continue
+        change = (r['latency_ms'] - o['latency_ms']) / o['latency_ms']
+        print('{:<28} {:<22} {:>12.2f} {:>12.2f} {:>+7.1%}'.format(
+            r['case'], r['input'], o['latency_ms'], r['latency_ms'],
+            change))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=('Benchmark the library, the command line and batch '
+                     'runs on a generated corpus. Each measurement runs in '
+                     'its own process'))
+
+    parser.add_argument('--sizes', nargs='+', default=['10K', '1M', '16M'],
+                        help='Sizes of the exports (10K ... 1G)')
+
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated corpus')
+
+    parser.add_argument('--corpus',
+                        default=os.path.join(tempfile.gettempdir(),
+                                             'fritzchecksum-corpus'),
+                        help='Directory for the (cached) corpus')
+
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs of each measurement (median reported)')
+
+    parser.add_argument('--budget', type=int, default=256,
+                        help='MB to process per measurement at most: '
+                             'large inputs are run fewer times')
+
+    parser.add_argument('--batch-files', type=int, default=100,
+                        help='Small exports in the batch runs')
+
+    parser.add_argument('--cases', nargs='*', default=[],
+                        help='Only run the cases matching these patterns '
+                             '(library.*, cli.*, startup.*)')
+
+    parser.add_argument('--output', '-o', default=None,
+                        help='Write the results to this JSON file')
+
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run to compare to')
+
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+
+    parser.add_argument('args', nargs='*', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.repeat, args.args)
+        sys.exit(0)
+
+    results = run(args)
+    doc = dict(version=RESULTS_VERSION, meta=metadata(args), results=results)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(doc, indent=2, sort_keys=True))
+
+    if args.compare:
+        with io.open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.loads(f.read()))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bz2
+import gzip
+import io
+import os.path
+import tarfile
+import zipfile
+import zlib
+
+try:
+    import lzma
+except ImportError:  # Python 2
+    lzma = None
+
+
+MEMBER_SEP = '::'  # separates an archive from a member: bundle.tar::x.export
+
+# compressed single files: extension -> function to open them
+COMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.BZ2File,
+}
+if lzma is not None:
+    COMPRESSORS['.xz'] = lzma.open
+
+TAR_EXTS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+            '.txz')
+ZIP_EXTS = ('.zip',)
+
+# exceptions which signal a broken/unreadable input
+ERRORS = (IOError, EOFError, tarfile.TarError, zipfile.BadZipfile,
+          zlib.error)
+if lzma is not None:
+    ERRORS += (lzma.LZMAError,)
+
+
+def split_member(path):
+    '''Returns ``(archive, member)`` for ``archive::member`` paths and
+    ``(path, None)`` for anything else'''
+    archive, sep, member = path.partition(MEMBER_SEP)
+    if not sep:
+        return path, None
+
+    return archive, member
+
+
+def compression(path):
+    '''Returns the extension of ``path`` if it is a compressed file (but not
+    a compressed tar archive) or ``None``'''
+    lpath = path.lower()
+    if lpath.endswith(TAR_EXTS):
+        return None
+
+    ext = os.path.splitext(lpath)[1]
+    return ext if ext in COMPRESSORS else None
+
+
+def is_archive(path):
+    '''Returns ``True`` if ``path`` names a tar or zip archive'''
+    return path.lower().endswith(TAR_EXTS + ZIP_EXTS)
+
+
+def is_special(path):
+    '''Returns ``True`` if ``path`` cannot be read as a plain file: a
+    compressed file or an ``archive::member``'''
+    return split_member(path)[1] is not None or compression(path) is not None
+
+
+def open_input(path):
+    '''
+    Returns a binary file-like object to read ``path``: plain files,
+    compressed files (``.gz``, ``.bz2``, ``.xz``) and members of tar/zip
+    archives (``bundle.tar.gz::box42.export``) are decompressed on the fly
+
+    Raises ``IOError`` if the member is not in the archive
+    '''
+    archive, member = split_member(path)
+    if member is None:
+        ext = compression(path)
+        if ext is None:
+            return io.open(path, 'rb')
+        return COMPRESSORS[ext](path, 'rb')
+
+    if archive.lower().endswith(ZIP_EXTS):
+        zf = zipfile.ZipFile(archive)
+        try:
+            return _Closing(zf.open(member), zf)
+        except KeyError:
+            zf.close()
+            raise IOError('No member {} in {}'.format(member, archive))
+
+    tf = tarfile.open(archive)
+    try:
+        f = tf.extractfile(member)
+    except KeyError:
+        f = None
+
+    if f is None:  # not there or not a regular file
+        tf.close()
+        raise IOError('No member {} in {}'.format(member, archive))
+
+    return _Closing(f, tf)
+
+
+def open_output(path):
+    '''
+    Returns a binary file-like object to write ``path``, compressing on the
+    fly for ``.gz``, ``.bz2`` and ``.xz``. Members of archives cannot be
+    written (``IOError``)
+    '''
+    if split_member(path)[1] is not None:
+        raise IOError('Archive members cannot be written: {}'.format(path))
+
+    ext = compression(path)
+    if ext is None:
+        return io.open(path, 'wb')
+
+    return COMPRESSORS[ext](path, 'wb')
+
+
+def iter_members(path):
+    '''
+    Generator which goes over the tar/zip archive in ``path`` in a single
+    sequential pass (tar archives are read as a stream) and yields ``(name,
+    fileobj)`` for each regular file in it. ``fileobj`` is a binary
+    file-like object which is only valid until the next member is yielded
+    '''
+    if path.lower().endswith(ZIP_EXTS):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if info.filename.endswith('/'):  # directory
+                    continue
+                with zf.open(info) as f:
+                    yield info.filename, f
+        return
+
+    tf = tarfile.open(path, 'r|*')
+    try:
+        for info in tf:
+            if info.isfile():
+                raw = _StreamMember(tf.extractfile(info))
+                yield info.name, io.BufferedReader(raw)
+    finally:
+        tf.close()
+
+
+class _Closing(object):
+    '''Wraps a member file and closes the archive with it'''
+
+    def __init__(self, f, archive):
+        self._f = f
+        self._archive = archive
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._f.close()
+        self._archive.close()
+
+
+class _StreamMember(io.RawIOBase):
+    '''Member of a tar archive read as a stream, which cannot seek'''
+
+    def __init__(self, f):
+        self._f = f
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        data = self._f.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self._pos += n
+        return n
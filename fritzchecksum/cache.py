@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import os
+import sqlite3
+import time
+
+
+# section types whose counts are stored with a result, in column order
+SECTION_TYPES = ('CFGFILE', 'BINFILE', 'B64FILE')
+
+
+class ResultCache(object):
+    '''Persistent cache of CRC results of export files, stored in a sqlite3
+    database at ``path``
+
+    Entries are keyed by the absolute path of the file and are valid as long
+    as its size, modification time and inode have not changed. If they have
+    and ``digest`` is ``True``, the content digest of the file is used to
+    look for a result stored for the same content (a copied or touched file).
+    The file is only hashed on a miss if there are results for files of its
+    size
+
+    The number of sections per type found in the file can be stored along
+    with the crcs
+
+    sqlite3 takes care of concurrent access from several processes. Reads
+    and writes are batched and committed every ``batch`` operations and on
+    ``close``. When there are more than ``maxentries`` entries, the least
+    recently used ones are evicted
+
+    Instances can be used as context managers to ensure ``close`` is called
+    '''
+    DIGEST = hashlib.sha1
+    CHUNKSIZE = 1 << 20
+
+    def __init__(self, path, maxentries=100000, digest=True, batch=256,
+                 timeout=30.0):
+        self.path = path
+        self.maxentries = maxentries
+        self.digest = digest
+        self.batch = batch
+
+        self.db = sqlite3.connect(path, timeout=timeout)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+        except sqlite3.DatabaseError:
+            pass  # filesystem without WAL support, defaults will do
+
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' path TEXT PRIMARY KEY,'
+                ' size INTEGER, mtime INTEGER, inode INTEGER,'
+                ' digest TEXT,'
+                ' oldcrc TEXT, newcrc TEXT, status INTEGER,'
+                ' atime REAL, sections TEXT)')
+            self.db.execute(
+                'CREATE INDEX IF NOT EXISTS results_digest '
+                'ON results (digest)')
+            self.db.execute(
+                'CREATE INDEX IF NOT EXISTS results_size '
+                'ON results (size)')
+
+            cols = [row[1] for row in
+                    self.db.execute('PRAGMA table_info(results)')]
+            if 'sections' not in cols:  # database of a previous version
+                try:
+                    self.db.execute(
+                        'ALTER TABLE results ADD COLUMN sections TEXT')
+                except sqlite3.OperationalError:
+                    pass  # added in the meantime by another process
+
+        self._touched = []  # paths read, pending atime update
+        self._stored = []  # rows pending to be stored
+        self._digests = {}  # path -> (statkey, digest) between get/put
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def statkey(path):
+        '''Returns the tuple (size, mtime, inode) identifying ``path``'''
+        st = os.stat(path)
+        mtime = getattr(st, 'st_mtime_ns', None)
+        if mtime is None:
+            mtime = int(st.st_mtime * 1e9)
+
+        return st.st_size, mtime, st.st_ino
+
+    def filedigest(self, path):
+        '''Returns the hex digest of the content of ``path``'''
+        h = self.DIGEST()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.CHUNKSIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+
+        return h.hexdigest()
+
+    def bufdigest(self, buf):
+        '''Returns the hex digest of ``buf`` (bytes, mmap), the same as
+        ``filedigest`` of a file with that content'''
+        h = self.DIGEST()
+        for pos in range(0, len(buf), self.CHUNKSIZE):
+            h.update(buf[pos:pos + self.CHUNKSIZE])
+
+        return h.hexdigest()
+
+    def get(self, path):
+        '''
+        Returns the cached ``(oldcrc, newcrc, status, sections)`` for
+        ``path`` or ``None`` if there is no valid entry. ``sections`` is a
+        dictionary with the number of sections per type or ``None`` if they
+        were not stored
+        '''
+        path = os.path.abspath(path)
+        try:
+            key = self.statkey(path)
+        except EnvironmentError:
+            return None
+
+        row = self.db.execute(
+            'SELECT size, mtime, inode, oldcrc, newcrc, status, sections '
+            'FROM results WHERE path = ?', (path,)).fetchone()
+
+        if row is not None and tuple(row[:3]) == key:
+            self._touch(path)
+            return row[3], row[4], bool(row[5]), self._sections(row[6])
+
+        if not self.digest:
+            return None
+
+        if self.db.execute(
+                'SELECT 1 FROM results WHERE size = ? AND digest IS NOT NULL '
+                'LIMIT 1', (key[0],)).fetchone() is None:
+            return None  # no content to compare with, do not hash the file
+
+        try:
+            digest = self.filedigest(path)
+        except EnvironmentError:
+            return None
+
+        self._digests[path] = (key, digest)
+        row = self.db.execute(
+            'SELECT oldcrc, newcrc, status, sections FROM results '
+            'WHERE digest = ? AND size = ? LIMIT 1',
+            (digest, key[0])).fetchone()
+
+        if row is None:
+            return None
+
+        # same content seen under another identity, store it for this one
+        sections = self._sections(row[3])
+        self.put(path, row[0], row[1], bool(row[2]), sections)
+        return row[0], row[1], bool(row[2]), sections
+
+    @staticmethod
+    def _sections(value):
+        '''Returns the section counts dictionary stored as ``value``'''
+        if not value:
+            return None
+
+        return dict(zip(SECTION_TYPES, (int(x) for x in value.split(','))))
+
+    def put(self, path, oldcrc, newcrc, status=True, sections=None,
+            digest=None):
+        '''Stores the result ``(oldcrc, newcrc, status)`` for ``path`` and,
+        if given, the dictionary ``sections`` with the number of sections
+        per type
+
+        ``digest`` is the ``bufdigest`` of the content of ``path`` if the
+        caller has it at hand. Else it is taken from ``get`` or computed'''
+        path = os.path.abspath(path)
+        try:
+            key = self.statkey(path)
+        except EnvironmentError:
+            return
+
+        kd = self._digests.pop(path, None)
+        if digest is not None:
+            pass
+        elif kd is not None and kd[0] == key:
+            digest = kd[1]
+        elif self.digest:
+            try:
+                digest = self.filedigest(path)
+            except EnvironmentError:
+                pass
+
+        if sections is not None:
+            sections = ','.join(str(sections.get(t, 0))
+                                for t in SECTION_TYPES)
+
+        self._stored.append(
+            (path, key[0], key[1], key[2], digest, oldcrc, newcrc,
+             int(bool(status)), time.time(), sections))
+
+        if len(self._stored) >= self.batch:
+            self.flush()
+
+    def _touch(self, path):
+        self._touched.append((time.time(), path))
+        if len(self._touched) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        '''Commits the pending operations and evicts old entries'''
+        if not self._stored and not self._touched:
+            return
+
+        with self.db:
+            if self._stored:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO results (path, size, mtime,'
+                    ' inode, digest, oldcrc, newcrc, status, atime,'
+                    ' sections) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    self._stored)
+
+            if self._touched:
+                self.db.executemany(
+                    'UPDATE results SET atime = ? WHERE path = ?',
+                    self._touched)
+
+            if self._stored:
+                self.evict()
+
+        self._stored, self._touched = [], []
+
+    def evict(self):
+        '''Removes the least recently used entries above ``maxentries``'''
+        count = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        if count > self.maxentries:
+            self.db.execute(
+                'DELETE FROM results WHERE path IN '
+                '(SELECT path FROM results ORDER BY atime ASC LIMIT ?)',
+                (count - self.maxentries,))
+
+    def clear(self):
+        '''Removes all entries'''
+        self._stored, self._touched = [], []
+        with self.db:
+            self.db.execute('DELETE FROM results')
+
+    def close(self):
+        '''Commits the pending operations and closes the database'''
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
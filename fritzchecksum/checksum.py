@@ -23,9 +23,20 @@ from __future__ import (absolute_import, division, print_function,
 
 import base64
 import binascii
+import codecs
+import collections
 import io
+import mmap
+import multiprocessing
+import os.path
 import re
+import sys
+import tempfile
+import traceback
 
+from . import archive
+from . import crcmath
+from . import events
 from . import py3
 
 
@@ -34,6 +45,10 @@ class ExportFile(object):
     the CRC value
 
     After loading a file it keeps the loaded content in an internal ``fout``
+
+    ``fout`` is a ``tempfile.SpooledTemporaryFile`` which is kept in memory
+    up to ``spoolsize`` bytes and rolls over to a temporary file on disk
+    beyond that. Saving copies it in chunks of ``chunksize`` bytes
     '''
 
     ST_OK, ST_ERROR = True, False
@@ -45,6 +60,29 @@ class ExportFile(object):
     newcrc = None
 
     fout = None
+    fbinary = False  # fout holds bytes (buffer engine) or text
+
+    spoolsize = 8 << 20  # in-memory limit for fout before spilling to disk
+    chunksize = 1 << 16  # size of the chunks for copying fout when saving
+
+    hooks = None  # events.Hooks instance to pass to the crc engines
+
+    cache = None  # cache.ResultCache for results of files loaded by path
+
+    # keep a sidecar index (index.ExportIndex) next to files loaded by path,
+    # to recompute only the sections which changed since it was written
+    sidecar = False
+    index = None  # sidecar index of the last file (if sidecar is True)
+
+    # threads for the crc of large payloads (parallel.ParallelCRC) when
+    # scanning buffers/files of at least parallel.PAR_MINSIZE bytes
+    # 0: number of cpus, 1: sequential
+    crcjobs = 0
+
+    # statistics of the last operation (None if unknown)
+    nbytes = None  # size of the export (decompressed) in bytes
+    sections = None  # dict with the number of sections per type
+    cached = False  # result taken from the cache
 
     def load(self, fin, out=True):
         '''
@@ -52,7 +90,18 @@ class ExportFile(object):
         ``status``, ``error``, ``oldcrc`` and ``newcrc``
 
         if ``out`` is ``False`` no internal buffering of the loaded input will
-        be made
+        be made. In that case and if ``fin`` is a path, the result is taken
+        from/stored to ``cache`` if one has been set
+
+        If ``sidecar`` is ``True`` and ``fin`` is a path, the sections whose
+        bytes are unchanged since the sidecar index was written are not
+        recomputed: their crcs are combined into the total. The sidecar is
+        then rewritten. With ``out`` set to ``False`` and a sidecar matching
+        the size and mtime of the file, the file is not even read
+
+        Compressed files (``.gz``, ``.bz2``, ``.xz``) and members of tar/zip
+        archives (``bundle.tar.gz::box42.export``) are decompressed on the
+        fly and go through ``load_file``
 
         Returns:
           tuple -> (status, error)
@@ -61,8 +110,26 @@ class ExportFile(object):
           If status is ST_ERROR (False) error will be the raised exception
         '''
         if isinstance(fin, py3.string_types):
+            if archive.is_special(fin):
+                return self._load_special(fin, out)
+
+            if not out and (self._cached(fin) or self._indexed(fin)):
+                return self.status, self.error
+
             try:
-                fin = io.open(fin, 'r')
+                self._spool(out, binary=True)
+                self._stats()
+                res, digest = self._scan_path(fin, self.fout)
+                self._stats(res)
+                self.oldcrc, self.newcrc = res.oldcrc, res.newcrc
+                self.status, self.error = self.ST_OK, None
+
+                if self.cache is not None:
+                    self.cache.put(fin, self.oldcrc, self.newcrc, self.status,
+                                   res.sections, digest)
+
+                return self.status, self.error
+
             except IOError as e:
                 self.status = self.ST_ERROR
                 self.error = e
@@ -70,6 +137,340 @@ class ExportFile(object):
 
         return self.load_file(fin, out)
 
+    def _load_special(self, path, out):
+        '''Loads a compressed file or archive member, decompressing it on the
+        fly'''
+        try:
+            with archive.open_input(path) as f:
+                return self.load_file(io.TextIOWrapper(f, encoding='utf-8'),
+                                      out)
+        except archive.ERRORS as e:
+            self.status = self.ST_ERROR
+            self.error = e
+            return self.status, self.error
+
+    def _scan_path(self, path, fout=None):
+        '''Runs ``scan_buffer`` on the file in ``path`` (writing to ``fout``)
+        going through the sidecar index if ``sidecar`` is ``True``. Returns
+        the ``ScanResult`` and the digest of the file for ``cache`` (hashed
+        while it is mapped) or ``None``'''
+        self.index = index = reuse = None
+        if self.sidecar:
+            from . import index as fcindex  # it imports this module
+
+            stamp = fcindex.file_stamp(path)
+            old = fcindex.read_sidecar(path)
+            if old is not None:
+                reuse = old.reuse_map()
+            index = fcindex.ExportIndex()
+
+        digest = None
+        with io.open(path, 'rb') as f:
+            buf = map_file(f)
+            if index is not None and has_lone_cr(buf):
+                index = reuse = None  # offsets of a normalized copy
+            par = self._parallel(len(buf))
+            try:
+                res = scan_buffer(buf, fout, hooks=self.hooks, index=index,
+                                  reuse=reuse, parallel=par)
+                if self.cache is not None and self.cache.digest:
+                    digest = self.cache.bufdigest(buf)
+            finally:
+                if par is not None:
+                    par.close()
+                close_buffer(buf)
+
+        if index is not None:
+            index.set_result(res, *stamp)
+            fcindex.write_sidecar(path, index)
+            self.index = index
+
+        return res, digest
+
+    def edit(self, src):
+        '''
+        Returns an ``edit.EditSession`` on the export in ``src`` (path,
+        binary file-like or buffer) to stage changes of root variables and
+        sections and stream out the edited export with ``save``. Unchanged
+        sections keep their known crc contributions, only the edited ones
+        are hashed. ``status``, ``error``, ``oldcrc`` and ``newcrc`` are
+        updated when saving
+
+        If ``sidecar`` is ``True`` the crcs of the source are taken from its
+        sidecar index (if up to date) and a sidecar is written for the saved
+        export
+        '''
+        from . import edit  # it imports this module
+
+        return edit.EditSession(src, self)
+
+    def _parallel(self, size):
+        '''Returns a ``parallel.ParallelCRC`` for a scan of ``size`` bytes or
+        ``None`` if it would be sequential anyway'''
+        from . import parallel  # it imports this module
+
+        if size < parallel.PAR_MINSIZE:
+            return None
+
+        jobs = self.crcjobs or multiprocessing.cpu_count()
+        if jobs < 2:
+            return None
+
+        return parallel.ParallelCRC(jobs)
+
+    def _indexed(self, path):
+        '''Updates the results from the sidecar index of ``path`` and returns
+        ``True`` if ``sidecar`` is set and the index matches the file'''
+        if not self.sidecar:
+            return False
+
+        from . import index as fcindex  # it imports this module
+
+        index = fcindex.read_sidecar(path, fresh=True)
+        if index is None:
+            return False
+
+        self._spool(False)
+        self._stats()
+        self.cached, self.nbytes = True, index.filesize
+        self.sections = index.counts()
+        self.oldcrc, self.newcrc = index.oldcrc, index.newcrc
+        self.status, self.error = self.ST_OK, None
+        self.index = index
+        return True
+
+    def _cached(self, path):
+        '''Updates the results from ``cache`` for ``path`` and returns
+        ``True`` if a cached result is available'''
+        if self.cache is None:
+            return False
+
+        cached = self.cache.get(path)
+        if cached is None:
+            return False
+
+        self._spool(False)
+        self._stats()
+        self.cached = True
+        self.oldcrc, self.newcrc, status, self.sections = cached
+        try:
+            self.nbytes = os.path.getsize(path)
+        except EnvironmentError:
+            pass
+        self.status = self.ST_OK if status else self.ST_ERROR
+        self.error = None
+        return True
+
+    def patch(self, path):
+        '''
+        Calculates the CRC of the export file in ``path`` and overwrites the
+        CRC in the ``END OF EXPORT`` line in place, writing only those 8
+        characters. Nothing is written if the CRC is already right.
+
+        If the trailer cannot be patched in place (missing or malformed) or
+        the file is compressed, it is fully rewritten with ``load`` +
+        ``save``. Members of archives cannot be patched
+
+        Updates ``status``, ``error``, ``oldcrc`` and ``newcrc``. No internal
+        buffering of the input is made
+
+        Returns:
+          tuple -> (status, error)
+
+          If status is ST_OK (True) error will be None
+          If status is ST_ERROR (False) error will be the raised exception
+        '''
+        if archive.is_special(path):
+            if archive.split_member(path)[1] is not None:
+                self.status = self.ST_ERROR
+                self.error = IOError('Archive members cannot be patched')
+                return self.status, self.error
+
+            if self.load(path)[0] and self.oldcrc != self.newcrc:
+                self.save(path)
+            self._spool(False)
+            return self.status, self.error
+
+        if (self._cached(path) or self._indexed(path)) and \
+                self.oldcrc == self.newcrc:
+            return self.status, self.error  # known to be right
+
+        self._spool(False)
+        self._stats()
+        try:
+            res, digest = self._scan_path(path)
+            self._stats(res)
+            self.oldcrc, self.newcrc = res.oldcrc, res.newcrc
+            self.status, self.error = self.ST_OK, None
+            if res.oldcrc == res.newcrc:
+                if self.cache is not None:
+                    self.cache.put(path, res.oldcrc, res.newcrc,
+                                   sections=res.sections, digest=digest)
+                return self.status, self.error  # nothing to do
+
+            if res.crcoff == -1:  # cannot patch in place, rewrite
+                self.load(path)
+                return self.save(path)
+
+            with io.open(path, 'r+b') as f:
+                f.seek(res.crcoff)
+                f.write(res.newcrc.encode('ascii'))
+
+            if self.cache is not None:  # file now carries the right crc
+                self.cache.put(path, res.newcrc, res.newcrc,
+                               sections=res.sections)
+
+            if self.index is not None:  # only the trailer crc has changed
+                from . import index as fcindex  # it imports this module
+
+                self.index.oldcrc = res.newcrc
+                self.index.mtime = fcindex.file_stamp(path)[1]
+                fcindex.write_sidecar(path, self.index)
+
+        except IOError as e:
+            self.status = self.ST_ERROR
+            self.error = e
+
+        return self.status, self.error
+
+    def transform(self, src, dst):
+        '''
+        Streams the export in ``src`` (file-like/string) to ``dst``
+        (file-like/string) in a single pass, with the new CRC in the trailer.
+        Only the trailer line is held back until the CRC is known, no
+        internal buffering is made
+
+        Binary sources which can be memory mapped go through ``scan_buffer``.
+        Anything else (text file-likes, pipes, compressed files and archive
+        members given as paths) is read line by line with ``calc_crc32``.
+        Destination paths ending in ``.gz``, ``.bz2`` or ``.xz`` are
+        compressed. If both ``src`` and ``dst`` are paths to the same
+        file, the CRC is patched in place with ``patch``. Else a ``dst`` path
+        is written to a temporary file next to it, which replaces ``dst``
+        only once the export has been completely written
+
+        Updates ``status``, ``error``, ``oldcrc`` and ``newcrc``
+
+        Returns:
+          tuple -> (status, error)
+
+          If status is ST_OK (True) error will be None
+          If status is ST_ERROR (False) error will be the raised exception
+        '''
+        if isinstance(src, py3.string_types) and \
+                isinstance(dst, py3.string_types):
+            try:
+                if os.path.exists(dst) and os.path.samefile(src, dst):
+                    return self.patch(src)
+            except EnvironmentError:
+                pass  # let the opening below report the error
+
+        self._spool(False)
+        self._stats()
+        closing = []
+        stream = False  # src is decompressed on the fly
+        tmp = None  # temporary file for a dst path
+        done = False
+        try:
+            if isinstance(src, py3.string_types):
+                stream = archive.is_special(src)
+                src = archive.open_input(src)
+                closing.append(src)
+
+            if isinstance(dst, py3.string_types):
+                tmp, dstpath = temp_output(dst), dst
+                dst = archive.open_output(tmp)
+                closing.append(dst)
+
+            buf = None
+            tdst = isinstance(dst, io.TextIOBase)
+            if not isinstance(src, io.TextIOBase) and not tdst and \
+                    not stream:
+                buf = mmap_file(src)
+
+            if buf is not None:
+                par = self._parallel(len(buf))
+                try:
+                    res = scan_buffer(buf, dst, hooks=self.hooks,
+                                      parallel=par)
+                finally:
+                    if par is not None:
+                        par.close()
+                    close_buffer(buf)
+
+                self._stats(res)
+                self.oldcrc, self.newcrc = res.oldcrc, res.newcrc
+
+            else:
+                if not isinstance(src, io.TextIOBase):
+                    src = io.TextIOWrapper(src, encoding='utf-8')
+                    closing.append(src)
+                if not tdst:
+                    dst = io.TextIOWrapper(dst, encoding='utf-8', newline='')
+                    closing.append(dst)
+
+                self.oldcrc, self.newcrc = calc_crc32(src, dst,
+                                                      hooks=self.hooks)
+                dst.flush()
+
+            self.status = self.ST_ERROR if self.oldcrc is None else self.ST_OK
+            self.error = None if self.status == self.ST_OK else self.newcrc
+            done = self.status == self.ST_OK
+
+        except archive.ERRORS as e:
+            self.status = self.ST_ERROR
+            self.error = e
+
+        finally:
+            try:
+                for f in reversed(closing):
+                    if isinstance(f, io.TextIOWrapper):
+                        f.detach()  # do not close the wrapped binary file
+                    else:
+                        f.close()
+
+                if done and tmp is not None:
+                    getattr(os, 'replace', os.rename)(tmp, dstpath)
+                    tmp = None
+            finally:
+                if tmp is not None:  # never leave a partial export behind
+                    os.remove(tmp)
+
+        return self.status, self.error
+
+    def load_buffer(self, buf, out=True):
+        '''
+        Loads from an object supporting the buffer protocol ``buf`` (bytes,
+        bytearray, mmap, memoryview) and will update internal ``status``,
+        ``error``, ``oldcrc`` and ``newcrc``
+
+        if ``out`` is ``False`` no internal buffering of the loaded input will
+        be made
+
+        Returns:
+          tuple -> (status, error)
+
+          If status is ST_OK (True) error will be None
+          If status is ST_ERROR (False) error will be the raised exception
+        '''
+        self._spool(out, binary=True)
+        self._stats()
+        par = self._parallel(len(buf))
+        try:
+            res = scan_buffer(buf, self.fout, hooks=self.hooks, parallel=par)
+        except IOError as e:
+            self.oldcrc, self.newcrc = None, e
+        else:
+            self._stats(res)
+            self.oldcrc, self.newcrc = res.oldcrc, res.newcrc
+        finally:
+            if par is not None:
+                par.close()
+
+        self.status = self.ST_ERROR if self.oldcrc is None else self.ST_OK
+        self.error = None if self.status == self.ST_OK else self.newcrc
+        return self.status, self.error
+
     def load_file(self, fin, out=True):
         '''
         Loads from a file-like object ``fin`` and will update internal
@@ -78,24 +479,66 @@ class ExportFile(object):
         if ``out`` is ``False`` no internal buffering of the loaded input will
         be made
 
+        The sections are counted and, if ``fin`` wraps a binary stream which
+        can tell its position (``fin.buffer``), the bytes read are taken as
+        the size
+
         Returns:
           tuple -> (status, error)
 
           If status is ST_OK (True) error will be None
           If status is ST_ERROR (False) error will be the raised exception
         '''
-        if out:
-            self.fout = io.StringIO(newline='')
-        self.oldcrc, self.newcrc = calc_crc32(fin, self.fout)
+        self._spool(out, binary=False)
+        self._stats()
+        hooks = self.hooks if self.hooks is not None else events.Hooks()
+        counter = hooks.subscribe(events.SectionCounter())
+        try:
+            self.oldcrc, self.newcrc = calc_crc32(fin, self.fout,
+                                                  hooks=hooks)
+        finally:
+            hooks.unsubscribe(counter)
+
+        self.sections = dict.fromkeys(SECTION_NAMES.values(), 0)
+        self.sections.update(counter.sections)
+        try:  # bytes read from the binary stream under a text wrapper
+            self.nbytes = fin.buffer.tell()
+        except (EnvironmentError, AttributeError, ValueError):
+            pass  # unknown
 
         self.status = self.ST_ERROR if self.oldcrc is None else self.ST_OK
         self.error = None if self.status == self.ST_OK else self.newcrc
         return self.status, self.error
 
+    def _stats(self, res=None):
+        '''Resets the statistics or takes them from a ``ScanResult``'''
+        self.cached = False
+        if res is None:
+            self.nbytes = self.sections = None
+        else:
+            self.nbytes, self.sections = res.size, res.sections
+
+    def _spool(self, out, binary=False):
+        '''Releases the current internal buffer and creates a new one if
+        ``out`` is ``True``'''
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+
+        self.fbinary = binary
+        if out:
+            if binary:
+                self.fout = tempfile.SpooledTemporaryFile(self.spoolsize)
+            else:
+                self.fout = tempfile.SpooledTemporaryFile(
+                    self.spoolsize, mode='w+', encoding='utf-8', newline='')
+
     def save(self, fout):
         '''
         Writes the internal ``self.fout`` file to a file-like/string ``fout``
 
+        Paths ending in ``.gz``, ``.bz2`` or ``.xz`` are compressed
+
         Returns:
           tuple -> (status, error)
 
@@ -110,13 +553,21 @@ class ExportFile(object):
 
         if isinstance(fout, py3.string_types):
             try:
-                fout = io.open(fout, 'w', newline='')
+                if archive.is_special(fout):  # compressed: always binary
+                    fout = archive.open_output(fout)
+                elif self.fbinary:
+                    fout = io.open(fout, 'wb')
+                else:
+                    fout = io.open(fout, 'w', newline='')
             except IOError as e:
                 self.error = e
                 self.status = self.ST_ERROR
                 return self.status, self.error
 
-            return self.save_file(fout)
+            with fout:
+                return self.save_file(fout)
+
+        return self.save_file(fout)
 
     def save_file(self, fout):
         '''
@@ -136,7 +587,7 @@ class ExportFile(object):
 
         try:
             self.fout.seek(0)
-            fout.write(self.fout.getvalue())
+            copy_chunks(self.fout, fout, self.chunksize)
         except IOError as e:
             self.error = e
             self.status = self.ST_ERROR
@@ -145,10 +596,222 @@ class ExportFile(object):
         return self.status, self.error
 
 
+# Kinds of lines returned by classify_line/iter_tokens
+(TK_DATA, TK_ROOT, TK_ENDROOT, TK_DEFROOT,
+ TK_BINFILE, TK_B64FILE, TK_CFGFILE, TK_ENDFILE) = range(8)
+
+# All marker lines start with '*'. They are told apart with a single pass of
+# an alternation. Lines starting with something else can only be a root
+# variable definition (a=b) or data
+_PAT_MARKER = (
+    r'^\*+(?:'
+    r'\s+END OF EXPORT\s+(?P<endroot>\w+)\s+\*+'
+    r'|\s+(?P<endfile>END OF FILE)\s+\*+'
+    r'|\s+(?P<section>\w*BINFILE|\w*B64FILE|CFGFILE):\s*(?P<name>[\w\.]+)'
+    r'|(?P<root>.+CONFIGURATION EXPORT)'
+    r')'
+)
+_PAT_DEFROOT = r'^(\w+)\s*=\s*([\$\.\w]+)'  # root var def
+_PAT_ENDFILE = r'^\*+\s+END OF FILE\s+\*+'  # for all files
+
+RE_MARKER = re.compile(_PAT_MARKER)
+RE_DEFROOT = re.compile(_PAT_DEFROOT)
+RE_ENDFILE = re.compile(_PAT_ENDFILE)
+
+BRE_MARKER = re.compile(_PAT_MARKER.encode('ascii'))
+BRE_DEFROOT = re.compile(_PAT_DEFROOT.encode('ascii'))
+BRE_ENDFILE = re.compile(_PAT_ENDFILE.encode('ascii'))
+
+# a \r which is not part of \r\n (a line ending on its own in text mode)
+BRE_LONECR = re.compile(br'\r(?!\n)')
+
+
+SECTION_NAMES = {
+    TK_BINFILE: 'BINFILE',
+    TK_B64FILE: 'B64FILE',
+    TK_CFGFILE: 'CFGFILE',
+}
+
+
+def _section_kind(section):
+    if section.endswith(b'BINFILE' if isinstance(section, bytes)
+                        else 'BINFILE'):
+        return TK_BINFILE
+    if section.endswith(b'B64FILE' if isinstance(section, bytes)
+                        else 'B64FILE'):
+        return TK_B64FILE
+    return TK_CFGFILE
+
+
+def classify_line(line):
+    '''
+    Classifies a single (un-escaped) line of an export, which can be a text
+    string or ``bytes``
+
+    Returns:
+      tuple -> (kind, value)
+
+      - TK_ROOT: ``CONFIGURATION EXPORT`` header, value is ``None``
+      - TK_ENDROOT: ``END OF EXPORT`` trailer, value is the crc in the line
+      - TK_DEFROOT: ``a=b`` definition, value is the tuple ``(a, b)``
+      - TK_BINFILE, TK_B64FILE, TK_CFGFILE: section header, value is the
+        name of the section
+      - TK_ENDFILE: ``END OF FILE``, value is ``None``
+      - TK_DATA: anything else, value is ``None``
+    '''
+    if isinstance(line, bytes):
+        try:
+            line.decode('ascii')
+        except UnicodeDecodeError:  # \w has to match as in text mode
+            res = _classify_utf8(line)
+            if res is not None:
+                return res
+
+        rxmarker, rxdef, star = BRE_MARKER, BRE_DEFROOT, b'*'
+    else:
+        rxmarker, rxdef, star = RE_MARKER, RE_DEFROOT, '*'
+
+    if line[:1] == star:
+        m = rxmarker.match(line)
+        if m is None:
+            return TK_DATA, None
+
+        last = m.lastgroup
+        if last == 'name':
+            return _section_kind(m.group('section')), m.group('name')
+        if last == 'endroot':
+            return TK_ENDROOT, m.group('endroot')
+        if last == 'endfile':
+            return TK_ENDFILE, None
+        return TK_ROOT, None
+
+    m = rxdef.match(line)
+    if m is None:
+        return TK_DATA, None
+
+    return TK_DEFROOT, m.groups()
+
+
+def _classify_utf8(line):
+    '''``classify_line`` for a ``bytes`` line with non-ascii characters,
+    classified as text and with the values encoded back to utf-8. Returns
+    ``None`` if the line is not valid utf-8'''
+    try:
+        kind, value = classify_line(line.decode('utf-8'))
+    except UnicodeDecodeError:
+        return None
+
+    if isinstance(value, tuple):
+        value = tuple(v.encode('utf-8') for v in value)
+    elif value is not None:
+        value = value.encode('utf-8')
+
+    return kind, value
+
+
+def iter_tokens(fin):
+    '''
+    Generator which classifies (``classify_line``) the lines of the
+    file-like/iterable ``fin`` after undoing the escaping of ``\\``
+
+    Yields:
+      tuple -> (kind, value, line) with ``line`` being the original line
+    '''
+    for line in fin:
+        if isinstance(line, bytes):
+            l = line.replace(b'\\\\', b'\\')
+        else:
+            l = line.replace('\\\\', '\\')
+
+        kind, value = classify_line(l)
+        yield kind, value, line
+
+
+def probe(fin):
+    '''
+    Returns the root definitions (``a=b``) of the export in ``fin`` (a path
+    or a file-like object) as an ``OrderedDict`` in file order. Firmware
+    version, OEM, country, language and the like are found there
+
+    Only the lines up to the first section header (or the end of the export)
+    are read. Nothing is decoded and no crc is calculated. Compressed files
+    and archive members are decompressed on the fly
+    '''
+    if isinstance(fin, py3.string_types):
+        with archive.open_input(fin) as f:
+            return probe(f)
+
+    rootvars = collections.OrderedDict()
+    troot = False  # root of export seen
+    for kind, value, line in iter_tokens(fin):
+        if not troot:
+            troot = kind == TK_ROOT
+        elif kind == TK_DEFROOT:
+            a, b = value
+            if isinstance(a, bytes):
+                a = a.decode('utf-8', 'replace')
+                b = b.decode('utf-8', 'replace')
+            rootvars[a] = b
+        elif kind == TK_ENDROOT or kind in SECTION_NAMES:
+            break
+
+    return rootvars
+
+
 def log_null(*args, **kwargs):
     pass
 
 
+def copy_chunks(fsrc, fdst, chunksize=1 << 16):
+    '''
+    Copies the file-like ``fsrc`` to the file-like ``fdst`` in chunks of
+    ``chunksize``. If one is binary and the other text, the chunks are
+    converted (utf-8) on the fly
+    '''
+    convert = None
+    while True:
+        chunk = fsrc.read(chunksize)
+        if not chunk:
+            break
+
+        if convert is None:
+            try:
+                fdst.write(chunk)
+                convert = False
+                continue
+            except TypeError:  # binary to text file or vice versa
+                if isinstance(chunk, bytes):
+                    convert = codecs.getincrementaldecoder('utf-8')().decode
+                else:
+                    convert = codecs.getincrementalencoder('utf-8')().encode
+
+        fdst.write(convert(chunk) if convert else chunk)
+
+
+def get_emitter(logcb=log_null, hooks=None):
+    '''
+    Returns a tuple ``(emit, trace)`` for the crc engines
+
+      - emit: ``None`` if nobody listens to the events or else the callable
+        which delivers them
+      - trace: ``True`` if per-line events (``EV_LINE``) have to be generated
+
+    A ``logcb`` other than ``log_null`` is subscribed to a new ``Hooks``
+    instance (if ``hooks`` is ``None``) with ``LEVEL_TRACE``
+    '''
+    if hooks is None:
+        if logcb is log_null:
+            return None, False
+
+        hooks = events.Hooks()
+        hooks.subscribe(events.LogSink(logcb), events.LEVEL_TRACE)
+
+    if hooks.level == events.LEVEL_NONE:
+        return None, False
+
+    return hooks.emit, hooks.level >= events.LEVEL_TRACE
+
+
 def crcize(tocrc, crc):
     '''
     Helper method which updates the passed value and takes care of converting
@@ -163,8 +826,108 @@ def crcize(tocrc, crc):
     return binascii.crc32(tocrc, crc) & 0xffffffff
 
 
+# valid characters of base64 payloads (the fast path takes nothing else)
+B64_CHARS = (b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+             b'0123456789+/=')
 
-def calc_crc32(fin, fout=None, logcb=log_null):
+
+def join_lines(block, multiple=1):
+    '''
+    Returns the bytes of the lines in ``block`` (bytes) without their line
+    endings if all the lines but the last have the same width, a multiple of
+    ``multiple``, and the last one is not wider. Else (or if there are stray
+    ``\\r``) returns ``None``
+
+    All checks and the joining run in C, no line is looked at on its own
+    '''
+    nl = block.find(b'\n')
+    if nl == -1:
+        return block
+
+    crlf = nl > 0 and block[nl - 1:nl] == b'\r'
+    width = nl - crlf
+    if width % multiple:
+        return None
+
+    stride = nl + 1
+    n = len(block) // stride  # lines of full width
+    last = block[n * stride:]  # shorter last line (can be empty)
+    lnl = last.find(b'\n')
+    if lnl != -1 and lnl != len(last) - 1:
+        return None
+
+    if block.count(b'\n') != n + (lnl != -1) or \
+            block[nl:n * stride:stride] != b'\n' * n:
+        return None
+
+    if crlf:
+        if block[nl - 1:n * stride:stride] != b'\r' * n or \
+                (lnl != -1 and last[-2:] != b'\r\n'):
+            return None
+        block = block.replace(b'\r\n', b'')
+    else:
+        block = block.replace(b'\n', b'')
+
+    return None if b'\r' in block else block
+
+
+def decode_block(block, b64=False, name='', lineno=1):
+    '''
+    Decodes a ``block`` of consecutive hex (or base64 if ``b64`` is ``True``)
+    lines from a BINFILE (B64FILE) section, with the same result as decoding
+    the lines one by one. ``block`` can be a text string or a bytes-like
+    object
+
+    Blocks of lines of the same width with nothing but payload characters
+    (and base64 padding only at the very end) are decoded in a single call.
+    Anything else is decoded line by line, which also pinpoints an offending
+    line: a ``binascii.Error`` is raised with the section ``name`` and the
+    line number (``lineno`` is the number of the first line in the block)
+
+    Returns the decoded ``bytes``
+    '''
+    try:
+        if isinstance(block, py3.text_type):
+            data = block.encode('ascii')
+        else:
+            data = bytes(block)  # memoryview, mmap slice, bytearray
+
+        data = join_lines(data, 4 if b64 else 2)
+        if data is not None:
+            if not b64:
+                return binascii.unhexlify(data)
+
+            pad = data.find(b'=')
+            if not data.translate(None, B64_CHARS) and not len(data) % 4 \
+                    and (pad == -1 or
+                         (pad >= len(data) - 2 and
+                          data[pad:] == b'=' * (len(data) - pad))):
+                return binascii.a2b_base64(data)
+
+    except (ValueError, TypeError):  # binascii.Error subclasses ValueError
+        pass
+
+    # Slow path: line by line as calc_crc32 would do it
+    if not isinstance(block, (py3.text_type, bytes)):
+        block = bytes(block)  # memoryview, mmap, bytearray
+
+    decoder = base64.b64decode if b64 else binascii.unhexlify
+    out = []
+    for i, bline in enumerate(block.splitlines()):
+        try:
+            out.append(decoder(bline))
+        except (ValueError, TypeError) as e:
+            raise binascii.Error('{}: line {}: {}'.format(name, lineno + i, e))
+
+    return b''.join(out)
+
+
+# Default number of accumulated payload bytes after which the CRC is updated
+CRC_FLUSHSIZE = 1 << 20
+
+
+def calc_crc32(fin, fout=None, logcb=log_null, flushsize=CRC_FLUSHSIZE,
+               hooks=None):
     '''Calculates the CRC of a Fritz!Box configuration export file and writes
     the new CRC sum to a new configuration file
 
@@ -174,7 +937,17 @@ def calc_crc32(fin, fout=None, logcb=log_null):
       - fout: None or a file-like object. If a file, then the input will be
         written to the output with the new calculated CRC
       - logcb (default: log_null -> empty stub
-        a logger which must a accepts *args (print will work)
+        a logger which must a accepts *args (print will work). It receives
+        the formatted events (see ``hooks``)
+      - flushsize (default: CRC_FLUSHSIZE)
+        the binary payload of the lines is accumulated in a reusable
+        ``bytearray`` and the CRC updated in a single call each time
+        ``flushsize`` bytes have been gathered (and at the end). If ``0``
+        each line updates the CRC on its own
+      - hooks (default: None)
+        an ``events.Hooks`` instance which gets the parsing events. If it
+        has no subscribers (and ``logcb`` is ``log_null``) no event is
+        generated at all
 
     Returns:
 
@@ -226,22 +999,25 @@ def calc_crc32(fin, fout=None, logcb=log_null):
     '''
     NULLCHAR = '\0'  # shorthand for null termi
 
-    # Regular expressions to parse lines
-    RE_ROOT = re.compile(r'^\*+.+CONFIGURATION EXPORT.*')
-    RE_ENDROOT = re.compile(r'^\*+\s+END OF EXPORT\s+(\w+)\s+\*+.*')
-    RE_DEFROOT = re.compile(r'^(\w+)\s*=\s*([\$\.\w]+)\s*.*')  # root var def
-    RE_BINFILE = re.compile(r'^\*+\s+\w*BINFILE:\s*([\w\.]+)\s*.*')
-    RE_B64FILE = re.compile(r'^\*+\s+\w*B64FILE:\s*([\w\.]+)\s*.*')
-    RE_CFGFILE = re.compile(r'^\*+\s+CFGFILE:\s*([\w\.]+)\s*.*')
-    RE_ENDFILE = re.compile(r'^\*+\s+END OF FILE\s+\*+.*')  # for all files
-
     # Statuses for the simple finite state machine
     ST_NONE, ST_ROOT, ST_CFGFILE, ST_BINFILE, ST_B64FILE = range(5)
+    ST_SECTIONS = {
+        TK_BINFILE: ST_BINFILE,
+        TK_B64FILE: ST_B64FILE,
+        TK_CFGFILE: ST_CFGFILE,
+    }
 
     status = ST_NONE
     crc = 0
     oldcrc = '0' * 8  # 8 x 4 -> 32 bits
 
+    # payload accumulator, flushed to the crc in blocks of flushsize
+    acc = bytearray() if flushsize else None
+    blk, blklen, blkline = [], 0, 0  # lines pending block decoding
+    lineno = 0
+
+    emit, trace = get_emitter(logcb, hooks)
+
     line = None
     while True:
         if fout is not None and line is not None:
@@ -258,7 +1034,9 @@ def calc_crc32(fin, fout=None, logcb=log_null):
         except IOError as e:
             return None, e  # error happen, notify it to caller
 
-        logcb('Processing: {}'.format(line.rstrip('\n')))
+        lineno += 1
+        if trace:
+            emit(events.EV_LINE, lineno, line)
 
         # No error/eof -> proceed
         # changin eol is not strictly needed but avoids recalculating the CRC
@@ -267,99 +1045,117 @@ def calc_crc32(fin, fout=None, logcb=log_null):
         l = line.replace('\\\\', '\\')  # undo escaping in the line
 
         if status == ST_NONE:  # main level, nothing seen yet
-            m = RE_ROOT.match(l)
-            if m:
-                logcb('ROOT DETECTED')
+            if l[:1] == '*' and classify_line(l)[0] == TK_ROOT:
+                if emit:
+                    emit(events.EV_ROOT, lineno)
                 status = ST_ROOT  # move to root of export
                 continue
 
         elif status == ST_ROOT:
-            m = RE_ENDROOT.match(l)
-            if m:
-                logcb('ROOT END: {}'.format(m.group(1)))
-                oldcrc = m.group(1)  # end of export - keep oldcrc
+            kind, value = classify_line(l)
+            if kind == TK_DATA or kind == TK_ROOT or kind == TK_ENDFILE:
+                continue  # nothing to do with it
+
+            if kind == TK_ENDROOT:
+                oldcrc = value  # end of export - keep oldcrc
                 break
 
-            m = RE_DEFROOT.match(l)  # variable definitions at root level
-            if m:
-                logcb('ROOT DEF: {}={}'.format(m.group(1), m.group(2)))
+            if kind == TK_DEFROOT:  # variable definitions at root level
+                if emit:
+                    emit(events.EV_ROOTDEF, value[0], value[1])
                 # root variable definition seen, add to crc
                 # a=b -> a + b + '\0'
-                tocrc = m.group(1) + m.group(2) + NULLCHAR
-                crc = crcize(tocrc, crc)
-                continue
-
-            m = RE_BINFILE.match(l)
-            if m:
-                status = ST_BINFILE  # start of binfile
-                tocrc = m.group(1) + NULLCHAR  # add to crc with null term
-                crc = crcize(tocrc, crc)
-                continue
-
-            m = RE_B64FILE.match(l)
-            if m:
-                status = ST_B64FILE  # start of binfile
-                tocrc = m.group(1) + NULLCHAR  # add to crc with null term
+                tocrc = value[0] + value[1] + NULLCHAR
+            else:  # start of a section
+                if emit:
+                    emit(events.EV_SECTION_START, SECTION_NAMES[kind], value)
+                status = ST_SECTIONS[kind]
+                secname = value
+                last_l = None  # initialize single line buffer (cfgfile)
+                tocrc = value + NULLCHAR  # add to crc with null term
+
+            if acc is None:
                 crc = crcize(tocrc, crc)
-                continue
-
-            m = RE_CFGFILE.match(l)
-            if m:
-                logcb('CFGFILE: {}'.format(m.group(1)))
-                status = ST_CFGFILE  # start of cfgfile, change status
-                last_l = None  # initialize single line buffer
-                tocrc = m.group(1) + NULLCHAR  # add to crc with null term
-                crc = crcize(tocrc, crc)
-                continue
-
-        elif status == ST_BINFILE:
-            m = RE_ENDFILE.match(l)
-            if m:
-                logcb('END BINFILE')
-                status = ST_ROOT  # go back to root level
-                continue
-
-            # else ... binary hex line - convert skipping eol
-            logcb('BINFILE: processing line')
-            hexed = binascii.unhexlify(l[:-1])  # convert to binary anc crc
-            crc = crcize(hexed, crc)
+            else:
+                acc += tocrc.encode('utf-8')
             continue
 
-        elif status == ST_B64FILE:
-            m = RE_ENDFILE.match(l)
+        elif status == ST_BINFILE or status == ST_B64FILE:
+            # lines are gathered and decoded as a block at the end of the
+            # section or when flushsize is exceeded
+            m = l[:1] == '*' and RE_ENDFILE.match(l)
+            if not m:
+                if not blk:
+                    blkline = lineno
+                blk.append(l)
+                blklen += len(l)
+                if blklen < flushsize:
+                    continue
+
+            if blk:
+                b64 = status == ST_B64FILE
+                decoded = decode_block(''.join(blk), b64, secname, blkline)
+                del blk[:]
+                blklen = 0
+                if acc is None:
+                    crc = crcize(decoded, crc)
+                else:
+                    acc += decoded
+                    if len(acc) >= flushsize:
+                        crc = binascii.crc32(acc, crc)
+                        del acc[:]
+
             if m:
-                logcb('END B64FILE')
+                if emit:
+                    emit(events.EV_SECTION_END,
+                         'BINFILE' if status == ST_BINFILE else 'B64FILE',
+                         secname)
                 status = ST_ROOT  # go back to root level
-                continue
 
-            # else ... binary hex line - convert skipping eol
-            logcb('B64FILE: processing line')
-            b64ed = base64.b64decode(l[:-1])  # convert to binary anc crc
-            crc = crcize(b64ed, crc)
             continue
 
         elif status == ST_CFGFILE:
             # The last line has to be stripped of eol, '\n'. The only way
             # to do this is by buffering each line once until. When the end
             # of section is seen, the buffered line is the last one
-            m = RE_ENDFILE.match(l)
+            m = l[:1] == '*' and RE_ENDFILE.match(l)
             if m:
-                logcb('END CFGFILE')
+                if emit:
+                    emit(events.EV_SECTION_END, 'CFGFILE', secname)
                 if last_l is not None:  # only operate if on something
                     last_l = last_l[:-1]
 
                 status = ST_ROOT  # back to root level
 
             # crc existing buffered line
-            logcb('CFGFILE: processing line')
             if last_l is not None:  # do only operate on something
-                crc = crcize(last_l, crc)
+                if acc is None:
+                    crc = crcize(last_l, crc)
+                else:
+                    acc += last_l.encode('utf-8')
+                    if len(acc) >= flushsize:
+                        crc = binascii.crc32(acc, crc)
+                        del acc[:]
 
             last_l = l  # buffer the line just seen
             continue
 
+    if blk:  # BINFILE/B64FILE section cut by the end of the file
+        decoded = decode_block(''.join(blk), status == ST_B64FILE, secname,
+                               blkline)
+        if acc is None:
+            crc = crcize(decoded, crc)
+        else:
+            acc += decoded
+
+    if acc:  # pending accumulated payload
+        crc = binascii.crc32(acc, crc)
+
     # replace the CRC in the last line
-    newcrc = format(crc, '08X')
+    newcrc = format(crc & 0xffffffff, '08X')
+    if emit:
+        emit(events.EV_TRAILER, oldcrc, newcrc)
+
     line = line.replace(oldcrc, newcrc)
     if fout is not None:
         try:
@@ -368,3 +1164,499 @@ def calc_crc32(fin, fout=None, logcb=log_null):
             pass
 
     return oldcrc, newcrc  # return old, new crc (str format both)
+
+
+ENDFILE_MARK = b'END OF FILE'
+
+
+def mmap_file(f):
+    '''
+    Returns a read-only ``mmap`` of the binary file-like ``f`` or ``None`` if
+    the file cannot be mapped (empty, pipe, ...)
+    '''
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError,
+            io.UnsupportedOperation):
+        return None
+
+
+def map_file(f):
+    '''
+    Returns a read-only ``mmap`` of the binary file-like ``f`` or, if the file
+    cannot be mapped (empty, pipe, ...), the ``bytes`` read from it
+    '''
+    buf = mmap_file(f)
+    return f.read() if buf is None else buf
+
+
+def temp_output(path):
+    '''
+    Creates an empty temporary file in the directory of ``path`` to write
+    what will replace ``path`` and returns its name. It has the compression
+    extension of ``path`` (for ``archive.open_output``) and the permissions
+    of ``path`` (or those of a new file if it does not exist)
+    '''
+    suffix = '.tmp' + (archive.compression(path) or '')
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               suffix=suffix)
+    os.close(fd)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except EnvironmentError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+
+    os.chmod(tmp, mode)
+    return tmp
+
+
+def close_buffer(buf):
+    '''
+    Closes ``buf`` if it is a ``mmap`` (anything else is left alone)
+
+    While an exception is propagating, its traceback keeps the frames of
+    the decoding functions and with them views of the map, which cannot be
+    closed then (``BufferError``). The frames are cleared first and, if
+    views remain, the map is left to the garbage collector: the caller
+    gets the original exception
+    '''
+    if not isinstance(buf, mmap.mmap):
+        return
+
+    tb = sys.exc_info()[2]
+    if tb is None:
+        buf.close()
+        return
+
+    if hasattr(traceback, 'clear_frames'):  # py3.4+
+        traceback.clear_frames(tb)
+    try:
+        buf.close()
+    except BufferError:
+        pass
+
+
+def close_all(objs):
+    '''Closes the files and maps in ``objs`` in reverse order, the maps with
+    ``close_buffer``'''
+    for f in reversed(objs):
+        if isinstance(f, mmap.mmap):
+            close_buffer(f)
+        else:
+            f.close()
+
+
+def finder(buf):
+    '''
+    Returns a ``find(sub, start, end)`` callable for ``buf``. bytes,
+    bytearray and mmap have a native one, other buffers (memoryview) are
+    searched with a regular expression which works directly on the buffer
+    '''
+    try:
+        return buf.find
+    except AttributeError:
+        pass
+
+    def find(sub, start=0, end=len(buf), _cache={}):
+        try:
+            rx = _cache[sub]
+        except KeyError:
+            rx = _cache[sub] = re.compile(re.escape(sub))
+
+        m = rx.search(buf, start, end)
+        return -1 if m is None else m.start()
+
+    return find
+
+
+def has_lone_cr(buf):
+    '''Returns ``True`` if ``buf`` has a ``\\r`` line ending not followed by
+    ``\\n``, which universal newlines (text mode) take as a line ending'''
+    if finder(buf)(b'\r') == -1:
+        return False
+
+    return BRE_LONECR.search(buf) is not None
+
+
+def find_endfile(buf, pos, find=None):
+    '''
+    Returns the offset of the start of the first ``END OF FILE`` marker line
+    found at/after ``pos`` in ``buf`` or -1 if there is none
+    '''
+    find = find or finder(buf)
+    while True:
+        i = find(ENDFILE_MARK, pos)
+        if i == -1:
+            return -1
+
+        ls = i  # walk back to the start of the line (only '*' and blanks)
+        while ls and buf[ls - 1:ls] in (b'*', b' ', b'\t'):
+            ls -= 1
+
+        if (not ls or buf[ls - 1:ls] == b'\n') and \
+                BRE_ENDFILE.match(bytes(buf[ls:i + len(ENDFILE_MARK) + 8])):
+            return ls
+
+        pos = i + 1
+
+
+class ScanResult(object):
+    '''Outcome of ``scan_buffer``
+
+      - oldcrc, newcrc: crcs in hexadecimal string format
+      - tstart, tend: offsets of the ``END OF EXPORT`` line (both are the
+        size of the buffer if there is no such line)
+      - crcoff: offset of the old crc in the buffer, -1 if it cannot be
+        overwritten in place (missing trailer or crc not 8 chars long)
+      - size: number of bytes scanned
+      - sections: dictionary with the number of sections per type
+        ('CFGFILE', 'BINFILE', 'B64FILE')
+    '''
+    __slots__ = ('oldcrc', 'newcrc', 'tstart', 'tend', 'crcoff', 'size',
+                 'sections')
+
+    def __init__(self, oldcrc, newcrc, tstart, tend, crcoff=-1, size=0,
+                 sections=None):
+        self.oldcrc, self.newcrc = oldcrc, newcrc
+        self.tstart, self.tend = tstart, tend
+        self.crcoff = crcoff
+        self.size = size
+        self.sections = sections or dict.fromkeys(SECTION_NAMES.values(), 0)
+
+
+def iter_blocks(buf, start, stop, blocksize, find=None):
+    '''
+    Yields ``(bstart, bend)`` splitting ``buf[start:stop]`` in blocks of
+    whole lines of at least ``blocksize`` bytes (except the last one)
+    '''
+    find = find or finder(buf)
+    while start < stop:
+        end = find(b'\n', min(start + blocksize, stop) - 1, stop)
+        end = stop if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def calc_crc32_buffer(buf, fout=None, logcb=log_null,
+                      blocksize=CRC_FLUSHSIZE, hooks=None, parallel=None):
+    '''Calculates the CRC of a Fritz!Box configuration export held in ``buf``
+    and writes the new CRC sum to a new configuration file
+
+    This is the bytes counterpart of ``calc_crc32``. The input is never
+    decoded: section markers are located with ``find`` and the payload of the
+    sections is fed to ``binascii.crc32`` as slices of a ``memoryview`` of the
+    input. Only lines which need un-escaping or eol conversion are copied.
+
+    BINFILE/B64FILE bodies are decoded with ``decode_block`` in blocks of
+    whole lines of roughly ``blocksize`` bytes
+
+    ``\\r\\n`` line endings are taken as ``\\n`` to match what ``calc_crc32``
+    sees when reading a file opened in text mode
+
+    Accepts:
+
+      - buf: an object supporting the buffer protocol (bytes, bytearray,
+        mmap, memoryview)
+      - fout: None or a binary file-like object. If a file, then the input
+        will be written to the output with the new calculated CRC
+      - logcb (default: log_null -> empty stub
+        a logger which must a accepts *args (print will work)
+      - blocksize (default: CRC_FLUSHSIZE)
+        approximate size of the blocks in which BINFILE/B64FILE bodies are
+        decoded
+      - hooks (default: None)
+        an ``events.Hooks`` instance, as in ``calc_crc32``. ``EV_LINE`` is
+        only generated for lines outside of sections
+      - parallel (default: None)
+        a ``parallel.ParallelCRC`` to compute the crc of large payloads in
+        chunks with several threads/processes
+
+    Returns:
+
+      (oldcrc, newcrc) -> tuple with the same semantics as in ``calc_crc32``
+    '''
+    try:
+        res = scan_buffer(buf, fout, logcb, blocksize, hooks,
+                          parallel=parallel)
+    except IOError as e:
+        return None, e
+
+    return res.oldcrc, res.newcrc  # return old, new crc (str format both)
+
+
+def scan_buffer(buf, fout=None, logcb=log_null, blocksize=CRC_FLUSHSIZE,
+                hooks=None, index=None, reuse=None, parallel=None):
+    '''
+    Does the work for ``calc_crc32_buffer`` (see it for the arguments),
+    returning a ``ScanResult`` with the crcs and the location of the trailer
+    in ``buf``
+
+    If ``fout`` is not ``None`` the input is written to it as it is being
+    scanned. Only the trailer line is held back until the new crc is known.
+    ``IOError`` exceptions are not caught
+
+    If ``index`` is not ``None`` (an ``index.ExportIndex``) each root
+    definition and section is added to it with its offsets, payload length
+    and own crc contribution
+
+    ``reuse`` is a mapping as returned by ``index.ExportIndex.reuse_map``.
+    Sections found in it (same kind, name and raw bytes) are not decoded:
+    their known crc contribution is combined into the running crc
+
+    ``parallel`` (a ``parallel.ParallelCRC``) computes the crc of payloads
+    of at least ``parallel.minsize`` bytes, combined into the running crc
+
+    A lone ``\\r`` is a line ending in the text mode of ``calc_crc32``. If
+    there is one, a copy of ``buf`` with the line endings normalized to
+    ``\\n`` is scanned (and written to ``fout``). Its offsets are not those
+    of ``buf``: the crc cannot be patched in place (``crcoff`` is -1) and a
+    ``ValueError`` is raised if ``index`` or ``reuse`` are given
+    '''
+    lonecr = False
+    if fout is not None or index is not None or reuse is not None or \
+            get_emitter(logcb, hooks)[0] is not None:
+        # output, offsets and events cannot be taken back: look in advance
+        lonecr = has_lone_cr(buf)
+        if lonecr and (index is not None or reuse is not None):
+            raise ValueError('Lone \\r line endings cannot be indexed')
+
+    if not lonecr:
+        try:
+            return _scan_buffer(buf, fout, logcb, blocksize, hooks, index,
+                                reuse, parallel)
+        except _LoneCR:
+            pass  # seen while scanning, nothing has been output
+
+    mv = memoryview(buf)
+    if mv.format != 'B' or mv.ndim != 1:
+        mv = mv.cast('B')
+
+    norm = mv.tobytes().replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    res = _scan_buffer(norm, fout, logcb, blocksize, hooks,
+                       parallel=parallel)
+    res.crcoff = -1
+    return res
+
+
+class _LoneCR(Exception):
+    '''Raised by ``_scan_buffer`` when it sees a lone ``\\r``'''
+
+
+def _lone_cr_line(line):
+    '''Raises ``_LoneCR`` if the (copied) ``line`` has a lone ``\\r``'''
+    i = line.find(b'\r')
+    if i != -1 and line[i:i + 2] != b'\r\n':
+        raise _LoneCR()
+
+
+def _scan_buffer(buf, fout=None, logcb=log_null, blocksize=CRC_FLUSHSIZE,
+                 hooks=None, index=None, reuse=None, parallel=None):
+    '''``scan_buffer`` for ``buf`` without lone ``\\r`` line endings or
+    raising ``_LoneCR`` when one is seen (before anything is output if
+    ``fout`` is not ``None``)'''
+    mv = memoryview(buf)
+    if mv.format != 'B' or mv.ndim != 1:
+        mv = mv.cast('B')
+
+    find = finder(buf)
+    size = len(mv)
+
+    emit, trace = get_emitter(logcb, hooks)
+
+    crc = 0
+    oldcrc = b'0' * 8
+    troot = False  # root of export seen
+    tstart, tend = size, size  # trailer line (defaults to nothing)
+    lineno = 0  # only kept up to date if events are generated
+    wpos = 0  # input written to fout up to here
+    sections = dict.fromkeys(SECTION_NAMES.values(), 0)
+
+    pos = 0
+    while pos < size:
+        eol = find(b'\n', pos)
+        nxt = size if eol == -1 else eol + 1
+        # only (short) marker/def lines are copied
+        line = bytes(mv[pos:nxt]).replace(b'\\\\', b'\\')
+        _lone_cr_line(line)
+
+        lineno += 1
+        if trace:
+            emit(events.EV_LINE, lineno, line.decode('utf-8', 'replace'))
+
+        if not troot:
+            if line[:1] == b'*' and classify_line(line)[0] == TK_ROOT:
+                if emit:
+                    emit(events.EV_ROOT, lineno)
+                troot = True
+
+            pos = nxt
+            continue
+
+        kind, value = classify_line(line)
+        if kind == TK_ENDROOT:
+            oldcrc = value  # end of export - keep oldcrc
+            tstart, tend = pos, nxt
+            break
+
+        if kind == TK_DEFROOT:
+            if emit:
+                emit(events.EV_ROOTDEF, value[0].decode('utf-8'),
+                     value[1].decode('utf-8'))
+            tocrc = value[0] + value[1] + b'\0'
+            crc = binascii.crc32(tocrc, crc)
+            if index is not None:
+                index.add(kind, value[0].decode('utf-8'), pos, pos, nxt, nxt,
+                          len(value[1]), len(tocrc), binascii.crc32(tocrc),
+                          binascii.crc32(mv[pos:nxt]))
+            pos = nxt
+            continue
+
+        if kind not in SECTION_NAMES:
+            pos = nxt
+            continue
+
+        # start of a section: name (null terminated) and body
+        name = value.decode('utf-8')
+        sections[SECTION_NAMES[kind]] += 1
+        if emit:
+            emit(events.EV_SECTION_START, SECTION_NAMES[kind], name)
+
+        end = find_endfile(buf, nxt, find)
+        stop = size if end == -1 else end
+        if end == -1:
+            xend = size
+        else:
+            xend = find(b'\n', end)
+            xend = size if xend == -1 else xend + 1
+
+        known = None
+        if index is not None or reuse is not None:  # crc of the raw bytes
+            rawcrc = binascii.crc32(mv[pos:xend]) & 0xffffffff
+            if reuse is not None and end != -1:
+                known = reuse.get((kind, name, xend - pos, rawcrc))
+
+        if known is not None:  # unchanged section, combine its contribution
+            ssize, sclen, scrc = known
+            crc = crcmath.crc32_combine(crc, scrc, sclen)
+            if fout is not None:
+                fout.write(mv[wpos:stop])
+                wpos = stop
+
+        else:
+            crc = binascii.crc32(value + b'\0', crc)
+            if index is not None:  # own crc contribution and payload size
+                scrc, ssize = binascii.crc32(value + b'\0'), 0
+
+            if kind == TK_CFGFILE:
+                body = mv[nxt:stop]
+                if end != -1 and stop > nxt:  # strip eol of last line
+                    body = body[:-1]
+                    if len(body) and body[-1] == 0x0d:
+                        body = body[:-1]
+                elif end == -1:  # cut, calc_crc32 drops the buffered line
+                    tail = body.tobytes()
+                    if BRE_LONECR.search(tail):
+                        raise _LoneCR()
+                    body = body[:tail.rfind(b'\n', 0, len(tail) - 1) + 1]
+
+                # copy only if un-escaping or eol conversion is needed
+                if find(b'\\\\', nxt, stop) != -1 or \
+                        find(b'\r', nxt, stop) != -1:
+                    body = body.tobytes()
+                    body = body.replace(b'\r\n', b'\n')
+                    if b'\r' in body:
+                        raise _LoneCR()
+                    body = body.replace(b'\\\\', b'\\')
+
+                if parallel is not None and len(body) >= parallel.minsize:
+                    cs, view = parallel.chunksize, memoryview(body)
+                    bcrc, bsize = parallel.crc(
+                        view[i:i + cs] for i in py3.range(0, len(body), cs))
+                    crc = crcmath.crc32_combine(crc, bcrc, bsize)
+                    if index is not None:
+                        scrc = crcmath.crc32_combine(scrc, bcrc, bsize)
+                        ssize = bsize
+                else:
+                    crc = binascii.crc32(body, crc)
+                    if index is not None:
+                        scrc, ssize = binascii.crc32(body, scrc), len(body)
+
+                if fout is not None:
+                    fout.write(mv[wpos:stop])
+                    wpos = stop
+
+            else:  # decode the body in blocks of whole lines
+                b64 = kind == TK_B64FILE
+                bpos = nxt  # sequential decoding from here on
+                if parallel is not None and stop - nxt >= parallel.minsize:
+                    blocks = iter_blocks(mv, nxt, stop, parallel.chunksize,
+                                         find)
+                    try:
+                        bcrc, bsize = parallel.crc(
+                            (mv[b:e] for b, e in blocks), b64, name)
+                    except binascii.Error:
+                        pass  # decoded below to report the offending line
+                    else:
+                        crc = crcmath.crc32_combine(crc, bcrc, bsize)
+                        if index is not None:
+                            scrc = crcmath.crc32_combine(scrc, bcrc, bsize)
+                            ssize = bsize
+                        if fout is not None:
+                            fout.write(mv[wpos:stop])
+                            wpos = stop
+                        bpos = stop
+
+                for bpos, bnxt in iter_blocks(mv, bpos, stop, blocksize,
+                                              find):
+                    try:
+                        decoded = decode_block(mv[bpos:bnxt], b64, name)
+                    except binascii.Error:  # retry with the real line number
+                        if BRE_LONECR.search(buf, nxt, stop):
+                            raise _LoneCR()  # END OF FILE after it?
+                        blineno = bytes(mv[:bpos]).count(b'\n') + 1
+                        decoded = decode_block(mv[bpos:bnxt], b64, name,
+                                               blineno)
+
+                    crc = binascii.crc32(decoded, crc)
+                    if index is not None:
+                        scrc = binascii.crc32(decoded, scrc)
+                        ssize += len(decoded)
+
+                    if fout is not None:
+                        fout.write(mv[wpos:bnxt])
+                        wpos = bnxt
+
+        if index is not None:
+            if known is None:
+                sclen = len(value) + 1 + ssize
+            index.add(kind, name, pos, nxt, stop, xend, ssize, sclen, scrc,
+                      rawcrc)
+
+        if end == -1:
+            break
+
+        if emit:
+            lineno += bytes(mv[nxt:end]).count(b'\n') + 1
+            emit(events.EV_SECTION_END, SECTION_NAMES[kind], name)
+
+        pos = xend
+
+    crc &= 0xffffffff
+    newcrc = format(crc, '08X')
+    oldcrc = oldcrc.decode('ascii')
+    if emit:
+        emit(events.EV_TRAILER, oldcrc, newcrc)
+
+    tline = bytes(mv[tstart:tend])
+    if fout is not None:
+        fout.write(mv[wpos:tstart])
+        fout.write(tline.replace(oldcrc.encode('ascii'),
+                                 newcrc.encode('ascii')))
+
+    crcoff = -1
+    if tstart < size and len(oldcrc) == 8:
+        crcoff = tstart + tline.find(oldcrc.encode('ascii'))
+
+    return ScanResult(oldcrc, newcrc, tstart, tend, crcoff, tend, sections)
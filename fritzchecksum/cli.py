@@ -23,8 +23,73 @@ from __future__ import (absolute_import, division, print_function,
 
 
 import argparse
+import csv
+import errno
+import glob
+import io
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import time
 
+try:
+    import resource
+except ImportError:  # not available under Windows
+    resource = None
+
+from . import archive
+from . import cache
 from . import checksum
+from . import diff
+from . import events
+from . import extract
+from . import index
+from . import synth
+
+
+REPORT_FORMATS = ('text', 'jsonl', 'csv')
+
+# fields of a report record (the trace is only reported in text/jsonl)
+REPORT_FIELDS = (
+    'path', 'status', 'error', 'oldcrc', 'newcrc', 'saved', 'cached',
+    'bytes', 'cfgfiles', 'binfiles', 'b64files', 'wall', 'procmaxrss',
+)
+
+# fields of a report record with --probe
+PROBE_FIELDS = ('path', 'status', 'error', 'rootvars', 'wall')
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def broken_pipe(e):
+    '''
+    Tells if the ``EnvironmentError`` ``e`` is a broken pipe, i.e. the reader
+    of stdout went away (``| head``). If so, stdout is pointed at
+    ``os.devnull`` so that the rest of the output (and the flush at exit) is
+    quietly discarded
+    '''
+    if getattr(e, 'errno', None) != errno.EPIPE:
+        return False
+
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+    return True
+
+
+def job_count(s):
+    '''argparse type of --jobs/--crc-jobs: an integer >= 0'''
+    try:
+        n = int(s)
+    except ValueError:
+        n = -1
+
+    if n < 0:
+        raise argparse.ArgumentTypeError(
+            'invalid job count: {!r} (0 or more)'.format(s))
+    return n
 
 
 def parse_args(pargs=''):
@@ -46,9 +111,77 @@ def parse_args(pargs=''):
                        default=None,
                        help='Write input to output with new CRC')
 
+    group.add_argument('--probe', '-p',
+                       action='store_true',
+                       required=False,
+                       help=('Only report the root variables (firmware,\n'
+                             'OEM, ...) reading up to the first section'))
+
+    parser.add_argument('--members', '-m',
+                        action='store_true',
+                        required=False,
+                        help=('Check every member of tar/zip inputs in a\n'
+                              'single sequential pass'))
+
+    parser.add_argument('--trace', '-t',
+                        action='store',
+                        type=int,
+                        required=False,
+                        default=0,
+                        metavar='N',
+                        help='Print the last N parsing events')
+
+    parser.add_argument('--cache',
+                        action='store',
+                        required=False,
+                        default=None,
+                        metavar='DBFILE',
+                        help='Cache results in DBFILE (sqlite3) for reuse')
+
+    parser.add_argument('--sidecar',
+                        action='store_true',
+                        required=False,
+                        help=('Keep a section crc index next to each file\n'
+                              '(FILE%s) and recompute only changed sections'
+                              % index.SIDECAR_EXT))
+
+    parser.add_argument('--jobs', '-j',
+                        action='store',
+                        type=job_count,
+                        required=False,
+                        default=1,
+                        metavar='N',
+                        help=('Process the inputs with N processes\n'
+                              '(0: number of cpus)'))
+
+    parser.add_argument('--crc-jobs',
+                        action='store',
+                        type=job_count,
+                        required=False,
+                        default=None,
+                        metavar='N',
+                        help=('Threads for the crc of large payloads\n'
+                              '(0: number of cpus, 1: off, default: 0\n'
+                              'unless --jobs is used)'))
+
+    parser.add_argument('--format', '-f',
+                        action='store',
+                        required=False,
+                        default='text',
+                        choices=REPORT_FORMATS,
+                        help='Format of the per file report')
+
+    parser.add_argument('--unordered',
+                        action='store_true',
+                        required=False,
+                        help=('Report files as they finish instead of in\n'
+                              'the order of the inputs'))
+
     parser.add_argument('input',
                         action='store',
-                        help='Write input to output with new CRC')
+                        nargs='+',
+                        help=('Files, directories (recursive) or globs.\n'
+                              'Use - to read a list of paths from stdin'))
 
     if pargs:
         return parser.parse_args(pargs.split())
@@ -56,32 +189,636 @@ def parse_args(pargs=''):
     return parser.parse_args()
 
 
+def expand_inputs(inputs, stdin=None, unmatched=None):
+    '''
+    Expands the ``inputs`` into a list of file paths: directories are walked
+    recursively, globs are expanded and ``-`` is replaced by the paths read
+    (one per line) from ``stdin``. Anything else is taken as a path
+
+    Sidecar index files found in directories and globs are skipped. The
+    directories and globs which give no file are appended to the list
+    ``unmatched`` if one is given
+
+    Duplicates are removed keeping the first appearance
+    '''
+    paths = []
+    for inp in inputs:
+        if inp == '-':
+            stdin = stdin or sys.stdin
+            paths.extend(l.strip() for l in stdin if l.strip())
+
+        elif os.path.isdir(inp):
+            found = []
+            for root, dirs, files in os.walk(inp):
+                dirs.sort()
+                found.extend(os.path.join(root, f) for f in sorted(files)
+                             if not f.endswith(index.SIDECAR_EXT))
+            if not found and unmatched is not None:
+                unmatched.append(inp)
+            paths.extend(found)
+
+        elif not os.path.exists(inp) and glob.has_magic(inp):
+            try:
+                matches = glob.glob(inp, recursive=True)
+            except TypeError:  # Python 2 has no recursive globbing
+                matches = glob.glob(inp)
+            found = sorted(p for p in matches if not os.path.isdir(p) and
+                           not p.endswith(index.SIDECAR_EXT))
+            if not found and unmatched is not None:
+                unmatched.append(inp)
+            paths.extend(found)
+
+        else:
+            paths.append(inp)
+
+    seen = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
+
+
+_cache = None  # per process ResultCache for process_file
+
+
+def _init_worker(cachepath):
+    global _cache
+    if cachepath is not None:
+        _cache = cache.ResultCache(cachepath)
+        # flush pending entries when the worker process exits
+        multiprocessing.util.Finalize(_cache, _cache.close, exitpriority=10)
+
+
+def process_file(task):
+    '''
+    Processes a single file. ``task`` is a tuple ``(num, path, output,
+    change, trace, sidecar, crcjobs, probe)``
+
+    Returns a dictionary with the result of the operation
+    '''
+    num, path, output, change, trace, sidecar, crcjobs, probe = task
+    tstart = _timer()
+
+    export = checksum.ExportFile()
+    export.cache = _cache
+    export.sidecar = sidecar
+    export.crcjobs = crcjobs
+    if trace > 0:
+        tracer = events.RingSink(trace)
+        export.hooks = events.Hooks()
+        export.hooks.subscribe(tracer, events.LEVEL_TRACE)
+
+    rootvars = None
+    try:
+        if probe:  # root variables only
+            rootvars = checksum.probe(path)
+            ret, error = True, None
+        elif change:  # overwrite the crc in place
+            ret, error = export.patch(path)
+        elif output is not None:  # stream input to output
+            ret, error = export.transform(path, output)
+        else:
+            ret, error = export.load(path, False)
+    except ValueError as e:  # malformed hex/base64 content
+        ret, error = False, e
+    except EnvironmentError as e:  # probe does not catch it
+        ret, error = False, e
+    except archive.ERRORS as e:  # broken compressed file/archive in probe
+        ret, error = False, e
+
+    saved = None
+    if ret:
+        if change and export.oldcrc != export.newcrc:
+            saved = path
+        elif output is not None:
+            saved = output
+
+    return make_result(num, path, export, ret, error, saved, tstart,
+                       tracer.lines() if trace > 0 else [], rootvars)
+
+
+def make_result(num, path, export, ret, error, saved, tstart, trace,
+                rootvars=None):
+    '''Returns the result dictionary of the operation on ``path`` done by
+    the ``ExportFile`` ``export``'''
+    sections = export.sections or {}
+    return dict(
+        index=num,
+        path=path,
+        status=bool(ret),
+        error=None if ret else str(error),
+        oldcrc=export.oldcrc if ret else None,
+        newcrc=export.newcrc if ret else None,
+        saved=saved,
+        cached=export.cached,
+        bytes=export.nbytes,
+        cfgfiles=sections.get('CFGFILE'),
+        binfiles=sections.get('BINFILE'),
+        b64files=sections.get('B64FILE'),
+        wall=round(_timer() - tstart, 6),
+        procmaxrss=maxrss(),
+        trace=trace,
+        rootvars=rootvars,
+    )
+
+
+def process_archive(num, path, trace=0, probe=False):
+    '''
+    Generator which goes over the members of the tar/zip archive in
+    ``path`` in a single sequential pass (``archive.iter_members``) and
+    yields a result (as ``process_file`` does) for each of them, with
+    ``archive::member`` as path. Nothing is written
+
+    A failure to read the archive itself is reported as a result for
+    ``path``
+    '''
+    tstart = _timer()
+    export = checksum.ExportFile()
+    try:
+        for name, f in archive.iter_members(path):
+            mpath = path + archive.MEMBER_SEP + name
+            export = checksum.ExportFile()
+            if trace > 0:
+                tracer = events.RingSink(trace)
+                export.hooks = events.Hooks()
+                export.hooks.subscribe(tracer, events.LEVEL_TRACE)
+
+            rootvars = None
+            try:
+                if probe:
+                    rootvars = checksum.probe(f)
+                    ret, error = True, None
+                else:
+                    fin = io.TextIOWrapper(f, encoding='utf-8')
+                    try:
+                        ret, error = export.load_file(fin, False)
+                    finally:
+                        fin.detach()  # the archive closes the member
+            except (ValueError, UnicodeDecodeError) as e:
+                ret, error = False, e
+
+            yield make_result(num, mpath, export, ret, error, None, tstart,
+                              tracer.lines() if trace > 0 else [], rootvars)
+            tstart = _timer()
+
+    except archive.ERRORS as e:
+        yield make_result(num, path, export, False, e, None, tstart, [])
+
+
+def process_members(paths, trace=0, probe=False, cachepath=None):
+    '''
+    Generator which yields the results of ``process_archive`` for the
+    archives in ``paths`` and of ``process_file`` for anything else, in a
+    single process
+    '''
+    global _cache
+
+    _init_worker(cachepath)
+    try:
+        for num, path in enumerate(paths):
+            if archive.is_archive(path):
+                for result in process_archive(num, path, trace, probe):
+                    yield result
+            else:
+                yield process_file(
+                    (num, path, None, False, trace, False, 0, probe))
+    finally:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+
+def maxrss():
+    '''Returns the peak resident memory of the process in KiB (or None)'''
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # reported in bytes
+        rss //= 1024
+    return rss
+
+
+def process_files(paths, output=None, change=False, trace=0, cachepath=None,
+                  jobs=1, ordered=True, sidecar=False, crcjobs=None,
+                  probe=False):
+    '''
+    Generator which processes ``paths`` with ``process_file`` and yields the
+    results in the order of ``paths``
+
+    With ``jobs`` > 1 a process pool is used. The largest files are handed
+    out first to avoid a big file being a straggler at the end and results
+    are yielded as soon as all preceding ones are available (or as soon as
+    they are available if ``ordered`` is ``False``)
+
+    ``crcjobs`` is set as ``crcjobs`` of each ``ExportFile``. If ``None``
+    all cpus are used with a single process and no threads with several
+    '''
+    global _cache
+
+    if crcjobs is None:  # do not multiply threads by processes
+        crcjobs = 0 if jobs == 1 else 1
+
+    tasks = [(i, p, output, change, trace, sidecar, crcjobs, probe)
+             for i, p in enumerate(paths)]
+
+    if jobs == 1 or len(tasks) < 2:
+        _init_worker(cachepath)
+        try:
+            for task in tasks:
+                yield process_file(task)
+        finally:
+            if _cache is not None:
+                _cache.close()
+                _cache = None
+        return
+
+    def size(task):
+        try:
+            return os.path.getsize(task[1])
+        except EnvironmentError:
+            return 0
+
+    tasks.sort(key=size, reverse=True)
+
+    pool = multiprocessing.Pool(jobs or None, _init_worker, (cachepath,))
+    try:
+        pending, nxt = {}, 0
+        for result in pool.imap_unordered(process_file, tasks):
+            if not ordered:
+                yield result
+                continue
+
+            pending[result['index']] = result
+            while nxt in pending:
+                yield pending.pop(nxt)
+                nxt += 1
+
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class Reporter(object):
+    '''Writes the results of ``process_file`` to ``out`` as soon as they are
+    handed over to ``report``, in one of the ``REPORT_FORMATS``
+
+    ``fields`` are those of the jsonl/csv records (``PROBE_FIELDS`` for the
+    results of a probe)'''
+
+    def __init__(self, fmt='text', out=None, prefix=True,
+                 fields=REPORT_FIELDS):
+        self.fmt = fmt
+        self.out = out or sys.stdout
+        self.prefix = prefix  # text: prefix lines with the path
+        self.fields = fields
+        self.errors = 0
+
+        if fmt == 'csv':
+            self.csv = csv.writer(self.out, lineterminator='\n')
+            self.csv.writerow(fields)
+
+    def report(self, result):
+        if not result['status']:
+            self.errors += 1
+
+        getattr(self, 'report_' + self.fmt)(result)
+        self.out.flush()
+
+    def report_text(self, result):
+        if result['trace']:
+            print('\n'.join(result['trace']), file=self.out)
+
+        prefix = '{}: '.format(result['path']) if self.prefix else ''
+        if not result['status']:
+            print('{}An error has ocurred: {}'.format(prefix, result['error']),
+                  file=self.out)
+            return
+
+        if result['rootvars'] is not None:  # probe
+            for name, value in sorted(result['rootvars'].items()):
+                print('{}{}={}'.format(prefix, name, value), file=self.out)
+            return
+
+        # Print oldcrc and newcrc
+        print('{}{} -> {}'.format(prefix, result['oldcrc'], result['newcrc']),
+              file=self.out)
+        if result['saved'] is not None:
+            print('{}Saved to {}'.format(prefix, result['saved']),
+                  file=self.out)
+
+    def report_jsonl(self, result):
+        record = dict((k, result[k]) for k in self.fields)
+        if result['trace']:
+            record['trace'] = result['trace']
+        print(json.dumps(record, sort_keys=True), file=self.out)
+
+    def report_csv(self, result):
+        row = ['' if result[k] is None else result[k] for k in self.fields]
+        if 'rootvars' in self.fields and result['rootvars'] is not None:
+            i = self.fields.index('rootvars')
+            row[i] = json.dumps(result['rootvars'], sort_keys=True)
+        self.csv.writerow(row)
+
+
+def parse_extract_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        prog='fritzchecksum extract',
+        description='Extract the payload of an embedded file',
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+
+    parser.add_argument('--output', '-o',
+                        action='store',
+                        required=False,
+                        default='-',
+                        help='Output file (default: - for stdout)')
+
+    parser.add_argument('export',
+                        action='store',
+                        help='Export file')
+
+    parser.add_argument('name',
+                        action='store',
+                        help='Name of the CFGFILE/BINFILE/B64FILE section')
+
+    return parser.parse_args(pargs)
+
+
+def run_extract(pargs=None):
+    args = parse_extract_args(pargs)
+
+    dst = args.output
+    if dst == '-':
+        dst = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    try:
+        extract.extract(args.export, args.name, dst)
+        if args.output == '-':
+            dst.flush()
+    except KeyError:
+        print('Section not found: {}'.format(args.name), file=sys.stderr)
+        sys.exit(1)
+    except archive.ERRORS + (ValueError,) as e:
+        if not broken_pipe(e):
+            print('An error has ocurred:', e, file=sys.stderr)
+        sys.exit(1)
+
+
+def parse_diff_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        prog='fritzchecksum diff',
+        description=('Compare two exports section by section. Exit code\n'
+                     '0: no differences, 1: differences, 2: error'),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+
+    parser.add_argument('--format', '-f',
+                        action='store',
+                        required=False,
+                        default='text',
+                        choices=('text', 'json'),
+                        help='Output format')
+
+    parser.add_argument('--context', '-U',
+                        action='store',
+                        type=int,
+                        required=False,
+                        default=3,
+                        metavar='N',
+                        help='Lines of context in CFGFILE diffs')
+
+    parser.add_argument('a',
+                        action='store',
+                        help='First export file')
+
+    parser.add_argument('b',
+                        action='store',
+                        help='Second export file')
+
+    return parser.parse_args(pargs)
+
+
+def run_diff(pargs=None):
+    args = parse_diff_args(pargs)
+
+    try:
+        result = diff.diff_exports(args.a, args.b, args.context)
+    except archive.ERRORS + (ValueError,) as e:
+        print('An error has ocurred:', e, file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        if args.format == 'json':
+            print(json.dumps(result, sort_keys=True, indent=2))
+        else:
+            for line in diff.format_text(result, args.a, args.b):
+                print(line)
+        sys.stdout.flush()
+    except EnvironmentError as e:
+        if not broken_pipe(e):
+            raise
+
+    sys.exit(1 if diff.has_differences(result) else 0)
+
+
+def parse_synth_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        prog='fritzchecksum synth',
+        description=('Generate synthetic exports with valid CRCs (or broken\n'
+                     'on purpose). The same options give the same bytes'),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+
+    parser.add_argument('--output', '-o',
+                        action='store',
+                        required=False,
+                        default='-',
+                        help=('Output file (default: - for stdout). A\n'
+                              'directory with --count'))
+
+    parser.add_argument('--seed', '-s',
+                        action='store',
+                        required=False,
+                        type=int,
+                        default=0,
+                        help='Seed of the generated content')
+
+    parser.add_argument('--count', '-n',
+                        action='store',
+                        required=False,
+                        type=int,
+                        default=1,
+                        help=('Number of exports (seeds SEED, SEED + 1, ...)\n'
+                              'written to the --output directory'))
+
+    parser.add_argument('--size',
+                        action='store',
+                        required=False,
+                        type=synth.parse_size,
+                        default=None,
+                        help='Approximate size (10K, 1M, 1G, ...)')
+
+    parser.add_argument('--sections',
+                        action='store',
+                        required=False,
+                        type=int,
+                        default=None,
+                        help='Number of sections (default: {} without --size)'
+                             .format(synth.SECTIONS))
+
+    parser.add_argument('--mix',
+                        action='store',
+                        required=False,
+                        default='mixed',
+                        help=('Kinds of sections: {} or the weights\n'
+                              'CFG,BIN,B64 (i.e.: 1,0,1)').format(
+                                  ', '.join(sorted(synth.MIXES))))
+
+    parser.add_argument('--payload',
+                        action='store',
+                        required=False,
+                        default=None,
+                        help='Payload size of the sections: MIN[-MAX]')
+
+    parser.add_argument('--hex-width',
+                        action='store',
+                        required=False,
+                        type=int,
+                        default=synth.HEX_LINESIZE,
+                        help='Characters per line of BINFILE payloads')
+
+    parser.add_argument('--b64-width',
+                        action='store',
+                        required=False,
+                        type=int,
+                        default=synth.B64_LINESIZE,
+                        help='Characters per line of B64FILE payloads')
+
+    parser.add_argument('--crlf',
+                        action='store_true',
+                        required=False,
+                        help='Use \\r\\n as end of line')
+
+    parser.add_argument('--escapes',
+                        action='store_true',
+                        required=False,
+                        help='Escaped backslashes in the CFGFILE sections')
+
+    parser.add_argument('--broken',
+                        action='store',
+                        required=False,
+                        default=None,
+                        choices=synth.BROKEN,
+                        help='Generate an invalid export')
+
+    return parser.parse_args(pargs)
+
+
+def run_synth(pargs=None):
+    args = parse_synth_args(pargs)
+
+    kwargs = dict(size=args.size, sections=args.sections,
+                  hexwidth=args.hex_width, b64width=args.b64_width,
+                  crlf=args.crlf, escapes=args.escapes, broken=args.broken)
+    try:
+        if args.mix in synth.MIXES:
+            kwargs['mix'] = args.mix
+        else:
+            try:
+                kwargs['mix'] = tuple(int(x) for x in args.mix.split(','))
+            except ValueError:
+                raise ValueError('Invalid mix: {}'.format(args.mix))
+
+        if args.payload is not None:
+            sizes = [synth.parse_size(x) for x in args.payload.split('-')]
+            kwargs['payload'] = (sizes[0], sizes[-1])
+
+        synth.check_options(kwargs['mix'], args.hex_width, args.b64_width,
+                            args.broken)
+    except ValueError as e:
+        print('An error has ocurred:', e, file=sys.stderr)
+        sys.exit(2)
+
+    if args.count > 1 and args.output == '-':
+        print('--count needs an --output directory', file=sys.stderr)
+        sys.exit(2)
+
+    # report to stderr if the export goes to stdout
+    report = sys.stderr if args.output == '-' else sys.stdout
+    try:
+        for seed in range(args.seed, args.seed + args.count):
+            if args.output == '-':
+                dst = getattr(sys.stdout, 'buffer', sys.stdout)
+                written, crc = synth.generate(dst, seed=seed, **kwargs)
+                dst.flush()
+                path = '-'
+            else:
+                path = args.output
+                if args.count > 1:
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                    path = os.path.join(path, 'synth-{}.export'.format(seed))
+
+                with archive.open_output(path) as dst:
+                    written, crc = synth.generate(dst, seed=seed, **kwargs)
+
+            print('{}: {} bytes, CRC {}'.format(path, written, crc),
+                  file=report)
+    except (EnvironmentError, ValueError) as e:
+        if not broken_pipe(e):
+            print('An error has ocurred:', e, file=sys.stderr)
+        sys.exit(1)
+
+
+# Subcommands given as first argument, else the checksum tool is run
+SUBCOMMANDS = {
+    'diff': run_diff,
+    'extract': run_extract,
+    'synth': run_synth,
+}
+
+
 def run():
+    if sys.argv[1:2] and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
     args = parse_args()
 
-    # Check if saving to a file has been requested
-    ofile = None
-    if args.change:
-        ofile = args.input
-    elif args.output is not None:
-        ofile = args.output
+    unmatched = []
+    paths = expand_inputs(args.input, unmatched=unmatched)
+    for inp in unmatched:
+        print('No files found for: {}'.format(inp), file=sys.stderr)
 
-    # Do the thing
-    export = checksum.ExportFile()
-    # Use ofile as flag to request load buffering input
-    ret, error = export.load(args.input, ofile is not None)
-    if not ret:
-        print('An error has ocurred:', error)
+    if not paths:
+        print('No input files', file=sys.stderr)
         sys.exit(1)
 
-    # Print oldcrc and newcrc
-    print('{} -> {}'.format(export.oldcrc, export.newcrc))
+    if args.output is not None and len(paths) != 1:
+        print('--output needs exactly one input file', file=sys.stderr)
+        sys.exit(2)
 
-    if ofile is not None:
-        # Save to a file
-        print('Saving to {}'.format(ofile))
-        ret, error = export.save(ofile)
+    if args.members and (args.output is not None or args.change):
+        print('--members cannot be used with --output/--change',
+              file=sys.stderr)
+        sys.exit(2)
 
-        if not ret:
-            print('An error has ocurred:', error)
-            sys.exit(1)
+    fields = PROBE_FIELDS if args.probe else REPORT_FIELDS
+    if args.members:
+        reporter = Reporter(args.format, fields=fields)
+        results = process_members(paths, args.trace, args.probe, args.cache)
+    else:
+        reporter = Reporter(args.format, prefix=len(paths) != 1,
+                            fields=fields)
+        results = process_files(paths, args.output, args.change, args.trace,
+                                args.cache, args.jobs, not args.unordered,
+                                args.sidecar, args.crc_jobs, args.probe)
+    for result in results:  # all are processed, even if nobody reads
+        try:
+            reporter.report(result)
+        except EnvironmentError as e:
+            if not broken_pipe(e):
+                raise
+
+    if reporter.errors or unmatched:
+        sys.exit(1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+
+
+# CRCs are handled as polynomials modulo the CRC-32 polynomial (bit reflected:
+# the top bit is the coefficient of x^0). Appending n zero bytes multiplies
+# the crc register by x^(8n), computed in O(log n) with a table of x^(2^k)
+# as done by zlib
+
+# Reversed CRC-32 polynomial used by zlib/binascii
+CRC32_POLY = 0xedb88320
+
+_X0 = 1 << 31  # x^0 (the polynomial 1)
+
+
+def multmodp(a, b):
+    '''Returns ``a`` times ``b`` modulo the CRC-32 polynomial'''
+    p = 0
+    m = _X0
+    while a:
+        if a & m:
+            p ^= b
+            a ^= m
+        m >>= 1
+        b = (b >> 1) ^ CRC32_POLY if b & 1 else b >> 1
+
+    return p
+
+
+def _x2n_table():
+    '''Returns the table of x^(2^k) modulo the polynomial for k in 0..31'''
+    table = []
+    p = _X0 >> 1  # x^1
+    for _ in range(32):
+        table.append(p)
+        p = multmodp(p, p)
+
+    return table
+
+
+X2N_TABLE = _x2n_table()
+
+
+def x2nmodp(n, k=0):
+    '''Returns x^(n * 2^k) modulo the polynomial'''
+    p = _X0
+    while n:
+        if n & 1:
+            p = multmodp(X2N_TABLE[k & 31], p)
+        n >>= 1
+        k += 1
+
+    return p
+
+
+def crc32_combine_gen(len2):
+    '''
+    Returns the operator to pass to ``crc32_combine_op`` for a second piece
+    of ``len2`` bytes. Worth it when combining many pieces of the same length
+    '''
+    return x2nmodp(len2, 3)
+
+
+def crc32_combine_op(crc1, crc2, op):
+    '''``crc32_combine`` with the operator from ``crc32_combine_gen``'''
+    return multmodp(op, crc1 & 0xffffffff) ^ (crc2 & 0xffffffff)
+
+
+def crc32_combine(crc1, crc2, len2):
+    '''
+    Returns the crc32 of the concatenation ``A + B`` given ``crc1`` (crc32
+    of ``A``), ``crc2`` (crc32 of ``B``) and ``len2`` (length of ``B``)
+
+    Equivalent to ``zlib``'s ``crc32_combine``
+    '''
+    if len2 <= 0:
+        return crc1 & 0xffffffff
+
+    return crc32_combine_op(crc1, crc2, x2nmodp(len2, 3))
+
+
+def crc32_shift(crc, length):
+    '''
+    Returns ``crc`` shifted over ``length`` bytes: the value which xor-ed
+    with the crc32 of any ``length`` bytes ``B`` gives the crc32 of
+    ``A + B`` (``crc`` being the crc32 of ``A``)
+    '''
+    if length <= 0:
+        return crc & 0xffffffff
+
+    return multmodp(x2nmodp(length, 3), crc & 0xffffffff)
+
+
+def crc32_zeros(length):
+    '''Returns the crc32 of ``length`` zero bytes'''
+    return crc32_shift(0xffffffff, length) ^ 0xffffffff
+
+
+def crc32_delta(crc, delta, after=0):
+    '''
+    Returns the crc32 of a message with crc32 ``crc`` once the bytes
+    ``delta`` have been xor-ed into it, with ``after`` bytes following the
+    changed ones up to the end of the message
+    '''
+    if not delta:
+        return crc & 0xffffffff
+
+    # crc of the delta without the pre/post conditioning of crc32
+    lin = binascii.crc32(delta) & 0xffffffff ^ crc32_zeros(len(delta))
+    return (crc & 0xffffffff) ^ crc32_shift(lin, after)
+
+
+def crc32_patch(crc, size, offset, old, new):
+    '''
+    Returns the crc32 of a message of ``size`` bytes with crc32 ``crc`` once
+    the bytes ``old`` at ``offset`` are replaced by ``new`` (same length)
+    '''
+    if len(old) != len(new):
+        raise ValueError('Patched bytes must keep the same length')
+
+    if not old:
+        return crc & 0xffffffff
+
+    delta = int(binascii.hexlify(old), 16) ^ int(binascii.hexlify(new), 16)
+    delta = binascii.unhexlify(format(delta, '0%dx' % (2 * len(old))))
+    return crc32_delta(crc, delta, size - offset - len(old))
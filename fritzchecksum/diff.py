@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+import collections
+import difflib
+
+from . import model
+
+
+# Status of a section in a diff
+SAME = 'same'  # identical raw bytes, never decoded
+REENCODED = 'reencoded'  # different bytes, same payload
+CHANGED = 'changed'
+ADDED = 'added'
+REMOVED = 'removed'
+
+
+def _sections(export):
+    '''Returns an ``OrderedDict`` of the sections of ``export`` keyed by
+    name (``name#n`` for the n-th repetition of a name)'''
+    sections = collections.OrderedDict()
+    seen = collections.Counter()
+    for section in export:
+        seen[section.name] += 1
+        key = section.name
+        if seen[key] > 1:
+            key = '{}#{}'.format(key, seen[key])
+        sections[key] = section
+
+    return sections
+
+
+def _rawkey(section):
+    '''Returns ``(length, crc32)`` of the raw body of ``section``'''
+    raw = section.raw
+    try:
+        return len(raw), binascii.crc32(raw) & 0xffffffff
+    finally:
+        raw.release()
+
+
+def _summary(section):
+    '''Returns ``(size, crc)`` of the payload of ``section``, decoding it
+    without keeping it'''
+    size, crc = 0, 0
+    for block in section.iter_payload():
+        crc = binascii.crc32(block, crc)
+        size += len(block)
+
+    return size, crc & 0xffffffff
+
+
+def _first_difference(sa, sb):
+    '''Returns the offset of the first differing payload byte'''
+    pos = 0
+    ita, itb = sa.iter_payload(), sb.iter_payload()
+    ba = bb = b''
+    while True:
+        if not ba:
+            ba = next(ita, b'')
+        if not bb:
+            bb = next(itb, b'')
+        if not ba or not bb:
+            return pos if ba or bb else -1
+
+        n = min(len(ba), len(bb))
+        if ba[:n] != bb[:n]:
+            i = 0
+            while ba[i:i + 1] == bb[i:i + 1]:
+                i += 1
+            return pos + i
+
+        pos += n
+        ba, bb = ba[n:], bb[n:]
+
+
+def diff_exports(a, b, context=3):
+    '''
+    Compares the exports ``a`` and ``b`` (paths or binary file-likes),
+    aligning their sections by name
+
+    Sections are first compared by length and crc32 of their raw bytes, so
+    identical sections are never decoded. For the others the payloads are
+    decoded: CFGFILE sections get a unified line diff with ``context``
+    lines, binary sections a summary (sizes, crcs and offset of the first
+    differing byte)
+
+    Returns a ``dict`` with ``oldcrc`` (trailer crcs of ``a`` and ``b``),
+    ``rootvars`` (``added``, ``removed`` and ``changed`` root variables) and
+    ``sections``: one ``dict`` per section with ``name``, ``type``,
+    ``status`` (``same``, ``reencoded``, ``changed``, ``added`` or
+    ``removed``) and, if decoded, ``size`` and ``crc`` (pairs for ``a`` and
+    ``b``) plus ``diff`` (CFGFILE) or ``offset`` (binary sections)
+    '''
+    with model.Export.open(a) as ea:
+        with model.Export.open(b) as eb:
+            return _diff(ea, eb, context)
+
+
+def _diff(ea, eb, context):
+    va, vb = ea.rootvars, eb.rootvars
+    rootvars = dict(
+        added=dict((k, vb[k]) for k in vb if k not in va),
+        removed=dict((k, va[k]) for k in va if k not in vb),
+        changed=dict((k, [va[k], vb[k]]) for k in va
+                     if k in vb and va[k] != vb[k]),
+    )
+
+    secsa, secsb = _sections(ea), _sections(eb)
+    keys = list(secsa) + [k for k in secsb if k not in secsa]
+
+    sections = []
+    for key in keys:
+        sa, sb = secsa.get(key), secsb.get(key)
+        ref = sa or sb
+        entry = dict(name=key, type=ref.typename)
+        sections.append(entry)
+
+        if sa is None or sb is None:
+            entry['status'] = REMOVED if sb is None else ADDED
+            continue
+
+        if type(sa) is type(sb) and _rawkey(sa) == _rawkey(sb):
+            entry['status'] = SAME
+            continue
+
+        if type(sa) is not type(sb):
+            entry['type'] = [sa.typename, sb.typename]
+
+        (sizea, crca), (sizeb, crcb) = _summary(sa), _summary(sb)
+        entry['size'] = [sizea, sizeb]
+        entry['crc'] = [format(crca, '08X'), format(crcb, '08X')]
+        if (sizea, crca) == (sizeb, crcb):
+            entry['status'] = REENCODED
+            continue
+
+        entry['status'] = CHANGED
+        if isinstance(sa, model.CfgFile) and isinstance(sb, model.CfgFile):
+            lines = difflib.unified_diff(
+                sa.payload.decode('utf-8', 'replace').splitlines(),
+                sb.payload.decode('utf-8', 'replace').splitlines(),
+                lineterm='', n=context)
+            entry['diff'] = list(lines)[2:]  # skip the ---/+++ header
+            sa.release()
+            sb.release()
+        else:
+            entry['offset'] = _first_difference(sa, sb)
+
+    return dict(oldcrc=[ea.oldcrc, eb.oldcrc], rootvars=rootvars,
+                sections=sections)
+
+
+def has_differences(result):
+    '''Returns ``True`` if the result of ``diff_exports`` shows any change
+    in the root variables or the payload of the sections'''
+    return any(result['rootvars'].values()) or \
+        any(s['status'] not in (SAME, REENCODED) for s in result['sections'])
+
+
+def format_text(result, namea='a', nameb='b'):
+    '''Yields the lines of a text rendering of the result of
+    ``diff_exports``. Unchanged sections are only counted'''
+    yield '--- {}'.format(namea)
+    yield '+++ {}'.format(nameb)
+
+    rv = result['rootvars']
+    for name, (old, new) in sorted(rv['changed'].items()):
+        yield 'rootvar {}: {} -> {}'.format(name, old, new)
+    for name, value in sorted(rv['removed'].items()):
+        yield 'rootvar {}: removed ({})'.format(name, value)
+    for name, value in sorted(rv['added'].items()):
+        yield 'rootvar {}: added ({})'.format(name, value)
+
+    same = 0
+    for s in result['sections']:
+        status = s['status']
+        if status == SAME:
+            same += 1
+            continue
+
+        stype = s['type'] if not isinstance(s['type'], list) else \
+            '->'.join(s['type'])
+        line = '{} {}: {}'.format(stype, s['name'], status)
+        if 'size' in s:
+            line += ' ({} -> {} bytes, crc {} -> {}'.format(
+                s['size'][0], s['size'][1], s['crc'][0], s['crc'][1])
+            if s.get('offset', -1) != -1:
+                line += ', first difference at {}'.format(s['offset'])
+            line += ')'
+        yield line
+
+        for dline in s.get('diff', []):
+            yield '  ' + dline
+
+    yield '{} sections unchanged'.format(same)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import base64
+import binascii
+import io
+import mmap
+import os
+import tempfile
+
+from . import checksum
+from . import crcmath
+from . import index as fcindex
+from . import py3
+
+
+HEX_LINESIZE = 80  # characters per line of re-encoded BINFILE payloads
+B64_LINESIZE = 76  # characters per line of re-encoded B64FILE payloads
+
+
+def encode_payload(kind, payload, eol=b'\n', linesize=None):
+    '''
+    Returns the body of a section of type ``kind`` carrying ``payload``:
+    hex (BINFILE) or base64 (B64FILE) lines of ``linesize`` characters, or
+    the text with ``\\`` escaped (CFGFILE). Every line ends with ``eol``
+    '''
+    if not payload:
+        return b''
+
+    if kind == checksum.TK_CFGFILE:
+        body = payload.replace(b'\\', b'\\\\')
+        if eol != b'\n':
+            body = body.replace(b'\n', eol)
+        return body + eol
+
+    if kind == checksum.TK_B64FILE:
+        enc = base64.b64encode(payload)
+        linesize = linesize or B64_LINESIZE
+    else:
+        enc = binascii.hexlify(payload).upper()
+        linesize = linesize or HEX_LINESIZE
+
+    return b''.join(enc[i:i + linesize] + eol
+                    for i in py3.range(0, len(enc), linesize))
+
+
+class _Output(object):
+    '''Binary file-like wrapper keeping count of the bytes written'''
+
+    def __init__(self, f):
+        self.f = f
+        self.pos = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+
+
+class EditSession(object):
+    '''
+    Stages section level changes to an export and streams out the edited
+    export with a valid crc. Returned by ``ExportFile.edit``
+
+    Changes are staged with ``set_var`` (root variables), ``replace`` and
+    ``remove`` (sections) and written with ``save``. Everything which is not
+    changed is copied through as raw bytes and its crc contribution, taken
+    from the ``index.ExportIndex`` of the source, is combined into the new
+    crc with ``crcmath.crc32_combine``. Only the replaced payloads are
+    hashed
+
+    Call ``close`` when done or use the session as a context manager
+    '''
+
+    def __init__(self, src, exportfile=None):
+        self.exportfile = exportfile
+        self.path = None
+        self._closing = []
+        self._vars = {}
+        self._payloads = {}
+        self._removed = set()
+
+        buf = src
+        if isinstance(src, py3.string_types):
+            self.path = src
+            src = io.open(src, 'rb')
+            self._closing.append(src)
+
+        if hasattr(src, 'read'):
+            buf = checksum.map_file(src)
+            if isinstance(buf, mmap.mmap):
+                self._closing.append(buf)
+
+        self.buf = buf
+        self.index = self._index()
+
+    def _index(self):
+        '''Returns the index of the source, from its sidecar if possible'''
+        sidecar = self.path is not None and \
+            getattr(self.exportfile, 'sidecar', False)
+
+        idx = None
+        if sidecar:
+            idx = fcindex.read_sidecar(self.path, fresh=True)
+
+        if idx is None:
+            old = fcindex.read_sidecar(self.path) if sidecar else None
+            idx = fcindex.ExportIndex()
+            res = checksum.scan_buffer(
+                self.buf, index=idx,
+                reuse=None if old is None else old.reuse_map())
+            idx.set_result(res, len(self.buf))
+            if sidecar:
+                idx.mtime = fcindex.file_stamp(self.path)[1]
+                fcindex.write_sidecar(self.path, idx)
+
+        return idx
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Releases the source'''
+        checksum.close_all(self._closing)
+
+        self._closing = []
+
+    def _entries(self, name, root):
+        '''Returns the indices of the root definitions (``root``) or the
+        sections named ``name``, raising ``KeyError`` if there are none'''
+        idx = self.index
+        found = [i for i, n in enumerate(idx.names)
+                 if n == name and
+                 (idx.kinds[i] == checksum.TK_DEFROOT) == root]
+        if not found:
+            raise KeyError(name)
+
+        return found
+
+    def set_var(self, name, value):
+        '''Stages a new ``value`` for the root variable ``name``'''
+        self._entries(name, root=True)
+        line = '{}={}'.format(name, value)
+        m = checksum.RE_DEFROOT.match(line)
+        if m is None or m.group(2) != value:
+            raise ValueError('Invalid value for {}: {!r}'.format(name, value))
+
+        self._vars[name] = value
+
+    def replace(self, name, payload):
+        '''
+        Stages ``payload`` (``bytes``, or text for a CFGFILE) as the new
+        content of the section ``name``. It is re-encoded like the section
+        (hex, base64 or escaped text)
+        '''
+        self._entries(name, root=False)
+        if isinstance(payload, py3.text_type):
+            payload = payload.encode('utf-8')
+
+        self._removed.discard(name)
+        self._payloads[name] = bytes(payload)
+
+    def remove(self, name):
+        '''Stages the removal of the section ``name``'''
+        self._entries(name, root=False)
+        self._payloads.pop(name, None)
+        self._removed.add(name)
+
+    def save(self, dst):
+        '''
+        Writes the edited export to ``dst`` (path or binary file-like). If
+        ``dst`` is the path of the source, the file is replaced once the
+        edited export has been completely written (and the session closed)
+
+        Updates ``status``, ``error``, ``oldcrc`` and ``newcrc`` of the
+        ``ExportFile`` which created the session
+
+        Returns:
+          tuple -> (status, error)
+
+          If status is ST_OK (True) error will be None
+          If status is ST_ERROR (False) error will be the raised exception
+        '''
+        ef = self.exportfile
+        tmp = None
+        try:
+            if isinstance(dst, py3.string_types):
+                path = dst
+                if self.path is not None and os.path.exists(path) and \
+                        os.path.samefile(path, self.path):
+                    fd, tmp = tempfile.mkstemp(
+                        dir=os.path.dirname(os.path.abspath(path)),
+                        suffix='.tmp')
+                    os.close(fd)
+                    path = tmp
+
+                with io.open(path, 'wb') as f:
+                    newidx = self._emit(f)
+
+                if tmp is not None:
+                    self.close()  # release the source before replacing it
+                    getattr(os, 'replace', os.rename)(tmp, dst)
+                    tmp = None
+
+                if getattr(ef, 'sidecar', False):
+                    newidx.filesize, newidx.mtime = fcindex.file_stamp(dst)
+                    fcindex.write_sidecar(dst, newidx)
+            else:
+                newidx = self._emit(dst)
+
+        except IOError as e:
+            if ef is not None:
+                ef.status, ef.error = ef.ST_ERROR, e
+            return False, e
+
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+
+        if ef is not None:
+            ef._spool(False)
+            ef._stats()
+            ef.sections = newidx.counts()
+            ef.oldcrc, ef.newcrc = self.index.oldcrc, newidx.newcrc
+            ef.status, ef.error = ef.ST_OK, None
+            ef.index = newidx
+            return ef.status, ef.error
+
+        return True, None
+
+    def _emit(self, f):
+        '''Writes the edited export to the binary file-like ``f`` and returns
+        the ``index.ExportIndex`` of what has been written'''
+        idx, mv = self.index, memoryview(self.buf)
+        if mv.format != 'B' or mv.ndim != 1:
+            mv = mv.cast('B')
+
+        out = _Output(f)
+        newidx = fcindex.ExportIndex()
+        crc = 0
+        pos = 0  # source copied up to here
+        for i in py3.range(len(idx)):
+            kind, name = idx.kinds[i], idx.names[i]
+            hoff, boff, eoff, xoff = \
+                idx.hoffs[i], idx.boffs[i], idx.eoffs[i], idx.xoffs[i]
+
+            out.write(mv[pos:hoff])  # lines between entries
+            pos = xoff
+            ohoff = out.pos
+
+            if kind == checksum.TK_DEFROOT and name in self._vars:
+                raw = mv[hoff:xoff].tobytes()
+                eol = raw[len(raw.rstrip(b'\r\n')):]
+                value = self._vars[name].encode('utf-8')
+                line = name.encode('utf-8') + b'=' + value + eol
+                tocrc = name.encode('utf-8') + value + b'\0'
+                out.write(line)
+                crc = binascii.crc32(tocrc, crc)
+                newidx.add(kind, name, ohoff, ohoff, out.pos, out.pos,
+                           len(value), len(tocrc), binascii.crc32(tocrc),
+                           binascii.crc32(line))
+
+            elif kind == checksum.TK_DEFROOT or \
+                    name not in self._payloads and name not in self._removed:
+                out.write(mv[hoff:xoff])  # unchanged: known contribution
+                crc = crcmath.crc32_combine(crc, idx.crcs[i], idx.clens[i])
+                delta = ohoff - hoff
+                newidx.add(kind, name, ohoff, boff + delta, eoff + delta,
+                           xoff + delta, idx.sizes[i], idx.clens[i],
+                           idx.crcs[i], idx.rawcrcs[i])
+
+            elif name in self._payloads:
+                payload = self._payloads[name]
+                header, endline = mv[hoff:boff].tobytes(), mv[eoff:xoff]
+                eol = header[len(header.rstrip(b'\r\n')):] or b'\n'
+                first = mv[boff:min(eoff, boff + 1024)].tobytes()
+                linesize = len(first.split(b'\n', 1)[0].rstrip(b'\r'))
+                body = encode_payload(kind, payload, eol, linesize or None)
+
+                out.write(header)
+                oboff = out.pos
+                out.write(body)
+                oeoff = out.pos
+                out.write(endline)
+
+                tocrc = name.encode('utf-8') + b'\0'
+                scrc = binascii.crc32(payload, binascii.crc32(tocrc))
+                clen = len(tocrc) + len(payload)
+                crc = crcmath.crc32_combine(crc, scrc, clen)
+                rawcrc = binascii.crc32(
+                    endline, binascii.crc32(body, binascii.crc32(header)))
+                newidx.add(kind, name, ohoff, oboff, oeoff, out.pos,
+                           len(payload), clen, scrc, rawcrc)
+
+            # removed sections are skipped
+
+        newcrc = format(crc & 0xffffffff, '08X')
+        tstart, tend = idx.tstart, idx.tend
+        out.write(mv[pos:tstart])
+        otstart = out.pos
+        oldcrc = idx.oldcrc.encode('ascii')
+        tline = mv[tstart:tend].tobytes()
+        out.write(tline.replace(oldcrc, newcrc.encode('ascii')))
+
+        newidx.filesize = out.pos
+        newidx.tstart, newidx.tend = otstart, out.pos
+        newidx.oldcrc, newidx.newcrc = idx.oldcrc, newcrc
+        if tline:  # the trailer now carries the new crc
+            newidx.oldcrc = newcrc
+            if len(oldcrc) == 8:
+                newidx.crcoff = otstart + tline.find(oldcrc)
+
+        return newidx
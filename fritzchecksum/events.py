@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+
+
+# Event types
+(EV_ROOT, EV_ROOTDEF, EV_SECTION_START, EV_SECTION_END, EV_TRAILER,
+ EV_LINE) = range(6)
+
+EV_NAMES = {
+    EV_ROOT: 'root',
+    EV_ROOTDEF: 'root-def',
+    EV_SECTION_START: 'section-start',
+    EV_SECTION_END: 'section-end',
+    EV_TRAILER: 'trailer',
+    EV_LINE: 'line',
+}
+
+# Levels: a subscriber receives the events with a level <= its own
+LEVEL_NONE, LEVEL_INFO, LEVEL_TRACE = range(3)
+
+EV_LEVELS = {
+    EV_ROOT: LEVEL_INFO,
+    EV_ROOTDEF: LEVEL_INFO,
+    EV_SECTION_START: LEVEL_INFO,
+    EV_SECTION_END: LEVEL_INFO,
+    EV_TRAILER: LEVEL_INFO,
+    EV_LINE: LEVEL_TRACE,
+}
+
+
+class Hooks(object):
+    '''Dispatches the parsing events of the crc engines to subscribers
+
+    A subscriber is a callable ``cb(event, *args)`` with the following args
+    per event:
+
+      - EV_ROOT: lineno
+      - EV_ROOTDEF: name, value
+      - EV_SECTION_START: section type ('CFGFILE', ...), name
+      - EV_SECTION_END: section type, name
+      - EV_TRAILER: oldcrc, newcrc
+      - EV_LINE: lineno, line
+
+    The engines check ``level`` once before starting: with no subscribers
+    (level ``LEVEL_NONE``) no event is ever generated. ``EV_LINE`` events are
+    only generated if a subscriber has asked for ``LEVEL_TRACE``
+    '''
+    level = LEVEL_NONE
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, cb, level=LEVEL_INFO):
+        '''Adds the callable ``cb`` to receive the events up to ``level``'''
+        self.subscribers.append((cb, level))
+        self.level = max(self.level, level)
+        return cb
+
+    def unsubscribe(self, cb):
+        '''Removes the callable ``cb`` from the subscribers'''
+        self.subscribers = [(c, l) for c, l in self.subscribers if c != cb]
+        self.level = max([l for c, l in self.subscribers] or [LEVEL_NONE])
+
+    def emit(self, event, *args):
+        '''Delivers ``event`` to the subscribers interested in it'''
+        evlevel = EV_LEVELS[event]
+        for cb, level in self.subscribers:
+            if evlevel <= level:
+                cb(event, *args)
+
+
+def format_event(event, *args):
+    '''Returns a text representation of an event'''
+    if event == EV_LINE:
+        return 'Processing: {}'.format(args[1].rstrip('\r\n'))
+    if event == EV_ROOT:
+        return 'ROOT DETECTED'
+    if event == EV_ROOTDEF:
+        return 'ROOT DEF: {}={}'.format(*args)
+    if event == EV_SECTION_START:
+        return '{}: {}'.format(*args)
+    if event == EV_SECTION_END:
+        return 'END {}'.format(args[0])
+    if event == EV_TRAILER:
+        return 'ROOT END: {} -> {}'.format(*args)
+
+    return '{}: {}'.format(EV_NAMES.get(event, event), args)
+
+
+class LogSink(object):
+    '''Subscriber which formats the events and hands them over to a
+    ``logcb(*args)`` callable (``print`` will work)'''
+
+    def __init__(self, logcb):
+        self.logcb = logcb
+
+    def __call__(self, event, *args):
+        self.logcb(format_event(event, *args))
+
+
+class RingSink(object):
+    '''Subscriber which keeps the last ``maxlen`` events in a ring buffer.
+    Nothing is formatted until the events are requested with ``lines``'''
+
+    def __init__(self, maxlen=1024):
+        self.events = collections.deque(maxlen=maxlen)
+
+    def __call__(self, event, *args):
+        self.events.append((event, args))
+
+    def __len__(self):
+        return len(self.events)
+
+    def clear(self):
+        self.events.clear()
+
+    def lines(self):
+        '''Returns the buffered events formatted as text lines'''
+        return [format_event(event, *args) for event, args in self.events]
+
+
+class SectionCounter(object):
+    '''Subscriber which counts the sections per type (``'CFGFILE'``, ...) in
+    the dictionary ``sections``'''
+
+    def __init__(self):
+        self.sections = collections.Counter()
+
+    def __call__(self, event, *args):
+        if event == EV_SECTION_START:
+            self.sections[args[0]] += 1
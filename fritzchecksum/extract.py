@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+import io
+import mmap
+import re
+
+from . import archive
+from . import checksum
+from . import py3
+
+
+# Section header lines, located without going through the root level lines
+BRE_HEADER = re.compile(
+    br'^\*+\s+(\w*BINFILE|\w*B64FILE|CFGFILE):\s*([\w\.]+)', re.MULTILINE)
+
+HEADER_KINDS = {
+    b'BINFILE': checksum.TK_BINFILE,
+    b'B64FILE': checksum.TK_B64FILE,
+    b'CFGFILE': checksum.TK_CFGFILE,
+}
+
+
+def iter_sections(buf, pos=0):
+    '''
+    Generator which jumps from section header to section header in ``buf``
+    (bytes, mmap, ...) starting at ``pos``, without decoding anything
+
+    Yields:
+      tuple -> (kind, name, hoff, boff, eoff, xoff) with the type and name
+      of the section and the offsets of its header, body, ``END OF FILE``
+      line and the end of that line
+    '''
+    find = checksum.finder(buf)
+    size = len(buf)
+
+    while True:
+        m = BRE_HEADER.search(buf, pos)
+        if m is None:
+            return
+
+        boff = find(b'\n', m.end())
+        boff = size if boff == -1 else boff + 1
+        eoff = checksum.find_endfile(buf, boff, find)
+        if eoff == -1:
+            eoff = xoff = size
+        else:
+            xoff = find(b'\n', eoff)
+            xoff = size if xoff == -1 else xoff + 1
+
+        name = m.group(2)
+        if bytes(buf[m.end():m.end() + 1]) > b'\x7f':  # non-ascii \w
+            name = checksum.classify_line(bytes(buf[m.start():boff]))[1]
+
+        yield (HEADER_KINDS[m.group(1)[-7:]], name.decode('utf-8'),
+               m.start(), boff, eoff, xoff)
+
+        pos = eoff  # skip the body
+
+
+def find_section(buf, name):
+    '''
+    Looks for the section ``name`` in ``buf`` (bytes, mmap, ...) with
+    ``iter_sections``
+
+    Returns:
+      tuple -> (kind, boff, eoff) with the type of the section and the
+      offsets of the start and end of its body, or ``None`` if not found
+    '''
+    for kind, sname, hoff, boff, eoff, xoff in iter_sections(buf):
+        if sname == name:
+            return kind, boff, eoff
+
+    return None
+
+
+def payload_size(buf, kind, boff, eoff):
+    '''
+    Returns the size of the payload (see ``iter_payload``) of the section
+    body ``buf[boff:eoff]`` of type ``kind`` from the layout of the body,
+    without decoding it, or ``None`` if it cannot be told that way
+
+    BINFILE/B64FILE bodies have to be made of lines of the same width (but
+    a shorter last one), with base64 padding only at the very end. Only the
+    line endings (one byte per line) are looked at. For CFGFILE bodies the
+    escaped ``\\`` and the ``\\r\\n`` are counted (if there are any)
+    '''
+    find = checksum.finder(buf)
+    if kind == checksum.TK_CFGFILE:
+        if eoff == boff:
+            return 0
+
+        eoff -= 1  # last eol, as in iter_payload
+        if eoff > boff and bytes(buf[eoff - 1:eoff]) == b'\r':
+            eoff -= 1
+
+        size = eoff - boff
+
+        if find(b'\\\\', boff, eoff) != -1 or find(b'\r', boff, eoff) != -1:
+            # lines are never split: escapes and \r\n do not span chunks
+            for bpos, bnxt in checksum.iter_blocks(buf, boff, eoff,
+                                                   checksum.CRC_FLUSHSIZE,
+                                                   find):
+                block = bytes(buf[bpos:bnxt])
+                size -= block.count(b'\r\n') + block.count(b'\\\\')
+
+        return size
+
+    nl = find(b'\n', boff, eoff)
+    if nl == -1:  # single line without eol
+        nl = eoff
+
+    crlf = nl > boff and bytes(buf[nl - 1:nl]) == b'\r'
+    width = nl - boff - crlf
+    stride = nl - boff + 1
+    n = (eoff - boff) // stride  # lines of full width
+    lend = boff + n * stride
+    if bytes(buf[nl:lend:stride]) != b'\n' * n or \
+            (crlf and bytes(buf[nl - 1:lend:stride]) != b'\r' * n):
+        return None
+
+    last = bytes(buf[lend:eoff])  # shorter last line
+    eol = b'\r\n' if crlf else b'\n'
+    if last.endswith(b'\n'):
+        if not last.endswith(eol):
+            return None
+        last = last[:-len(eol)]
+    if b'\n' in last or b'\r' in last:
+        return None
+
+    digits = n * width + len(last)
+    if kind != checksum.TK_B64FILE:
+        return None if width % 2 or len(last) % 2 else digits // 2
+
+    if width % 4 or len(last) % 4:
+        return None
+
+    if not last and n:  # the last line is a full one
+        n -= 1
+        last = bytes(buf[boff + n * stride:boff + n * stride + width])
+
+    # padding is only at the end of lines (one ends a block of 4)
+    if b'=' in bytes(buf[boff + width - 1:boff + n * stride:stride]):
+        return None
+
+    pad = len(last) - len(last.rstrip(b'='))
+    if pad > 2:
+        return None
+
+    return digits // 4 * 3 - pad
+
+
+def iter_payload(buf, kind, boff, eoff, blocksize=checksum.CRC_FLUSHSIZE,
+                 name=''):
+    '''
+    Generator which yields the payload of the section body ``buf[boff:eoff]``
+    of type ``kind`` in decoded blocks of roughly ``blocksize`` bytes
+
+    The payload is what contributes to the crc: decoded bytes for
+    BINFILE/B64FILE sections and the un-escaped text (without the final
+    end of line) for CFGFILE sections. Decoding errors report the line
+    number in ``buf``, as ``checksum.scan_buffer`` does
+    '''
+    mv = memoryview(buf)
+    find = checksum.finder(buf)
+    cfg = kind == checksum.TK_CFGFILE
+    b64 = kind == checksum.TK_B64FILE
+
+    if cfg and eoff > boff:  # last eol does not belong to the payload
+        eoff -= 1
+        if eoff > boff and mv[eoff - 1] == 0x0d:
+            eoff -= 1
+
+    pos = boff
+    while pos < eoff:
+        nxt = find(b'\n', min(pos + blocksize, eoff) - 1, eoff)
+        nxt = eoff if nxt == -1 else nxt + 1
+        block = mv[pos:nxt]
+        if cfg:
+            block = block.tobytes()
+            block = block.replace(b'\r\n', b'\n').replace(b'\\\\', b'\\')
+        else:
+            try:
+                block = checksum.decode_block(block, b64, name)
+            except binascii.Error:  # retry with the line number in buf
+                lineno = bytes(mv[:pos]).count(b'\n') + 1
+                block = checksum.decode_block(block, b64, name, lineno)
+
+        yield block
+        pos = nxt
+
+
+def extract(src, name, dst, index=None, blocksize=checksum.CRC_FLUSHSIZE):
+    '''
+    Writes the payload of the section ``name`` of the export ``src`` (path,
+    also of a compressed file or archive member, binary file-like or buffer)
+    to ``dst`` (path or binary file-like)
+
+    The section is located with ``index`` (an ``index.ExportIndex`` of
+    ``src``) if given or else with ``find_section``. The payload is decoded
+    and written in blocks, without going through the rest of the export
+
+    Returns the number of bytes written. Raises ``KeyError`` if there is no
+    section ``name``
+    '''
+    buf, closing = src, []
+    if isinstance(src, py3.string_types):
+        if archive.is_special(src):  # fileno is the compressed one
+            with archive.open_input(src) as f:
+                buf = src = f.read()
+        else:
+            src = io.open(src, 'rb')
+            closing.append(src)
+
+    try:
+        if hasattr(src, 'read'):
+            buf = checksum.map_file(src)
+            if isinstance(buf, mmap.mmap):
+                closing.append(buf)
+
+        if index is not None:
+            i = index.find(name)
+            loc = None if i == -1 else \
+                (index.kinds[i], index.boffs[i], index.eoffs[i])
+        else:
+            loc = find_section(buf, name)
+
+        if loc is None:
+            raise KeyError(name)
+
+        if isinstance(dst, py3.string_types):
+            dst = io.open(dst, 'wb')
+            closing.append(dst)
+
+        written = 0
+        for block in iter_payload(buf, loc[0], loc[1], loc[2], blocksize,
+                                  name):
+            dst.write(block)
+            written += len(block)
+
+        return written
+
+    finally:
+        checksum.close_all(closing)
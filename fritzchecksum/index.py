@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import array
+import collections
+import io
+import os
+import struct
+import sys
+
+from . import checksum
+from . import py3
+
+
+IndexEntry = collections.namedtuple(
+    'IndexEntry',
+    'kind name hoff boff eoff xoff size clen crc rawcrc')
+
+
+class ExportIndex(object):
+    '''Compact index of the root definitions and sections of an export file,
+    built in a single pass by ``checksum.scan_buffer``
+
+    Each entry is kept in a set of parallel arrays:
+
+      - kinds: ``checksum.TK_DEFROOT``, ``TK_CFGFILE``, ``TK_BINFILE`` or
+        ``TK_B64FILE``
+      - names: variable name (root definitions) or section name
+      - hoffs: offset of the header line (the definition line)
+      - boffs: offset of the body (first line after the header)
+      - eoffs: offset of the ``END OF FILE`` line (end of the body)
+      - xoffs: offset right after the ``END OF FILE`` line
+      - sizes: length of the payload (decoded for BINFILE/B64FILE, the
+        value for root definitions)
+      - clens: length of the crc contribution (name, null and payload)
+      - crcs: crc32 of the contribution on its own
+      - rawcrcs: crc32 of the raw bytes from ``hoff`` to ``xoff``
+
+    The export level data is kept in ``filesize``, ``mtime`` (nanoseconds,
+    0 if unknown), ``tstart``/``tend`` (trailer line), ``crcoff``, ``oldcrc``
+    and ``newcrc``
+
+    Indices can be serialized with ``dumps``/``dump`` and restored with
+    ``loads``/``load``
+    '''
+    __slots__ = ('kinds', 'names', 'hoffs', 'boffs', 'eoffs', 'xoffs',
+                 'sizes', 'clens', 'crcs', 'rawcrcs',
+                 'filesize', 'mtime', 'tstart', 'tend', 'crcoff', 'oldcrc',
+                 'newcrc')
+
+    MAGIC = b'FCIX'
+    VERSION = 2
+
+    # magic, version, count, filesize, mtime, tstart, tend, crcoff, oldcrc,
+    # newcrc
+    _HEADER = struct.Struct('<4sHIqqqqq8s8s')
+
+    _ARRAYS = (
+        ('kinds', 'b'), ('hoffs', 'q'), ('boffs', 'q'), ('eoffs', 'q'),
+        ('xoffs', 'q'), ('sizes', 'q'), ('clens', 'q'), ('crcs', 'I'),
+        ('rawcrcs', 'I'),
+    )
+
+    def __init__(self):
+        for name, typecode in self._ARRAYS:
+            setattr(self, name, array.array(typecode))
+
+        self.names = []
+        self.filesize = self.mtime = self.tstart = self.tend = 0
+        self.crcoff = -1
+        self.oldcrc = self.newcrc = None
+
+    def add(self, kind, name, hoff, boff, eoff, xoff, size, clen, crc,
+            rawcrc=0):
+        '''Adds an entry (called by ``checksum.scan_buffer``)'''
+        self.kinds.append(kind)
+        self.names.append(name)
+        self.hoffs.append(hoff)
+        self.boffs.append(boff)
+        self.eoffs.append(eoff)
+        self.xoffs.append(xoff)
+        self.sizes.append(size)
+        self.clens.append(clen)
+        self.crcs.append(crc & 0xffffffff)
+        self.rawcrcs.append(rawcrc & 0xffffffff)
+
+    def set_result(self, res, filesize, mtime=0):
+        '''Sets the export level data from a ``checksum.ScanResult`` and the
+        size and mtime of the scanned file'''
+        self.filesize, self.mtime = filesize, mtime
+        self.tstart, self.tend, self.crcoff = res.tstart, res.tend, res.crcoff
+        self.oldcrc, self.newcrc = res.oldcrc, res.newcrc
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return IndexEntry(
+            self.kinds[i], self.names[i], self.hoffs[i], self.boffs[i],
+            self.eoffs[i], self.xoffs[i], self.sizes[i], self.clens[i],
+            self.crcs[i], self.rawcrcs[i])
+
+    def __iter__(self):
+        for i in py3.range(len(self)):
+            yield self[i]
+
+    def sections(self):
+        '''Returns the indices of the entries which are sections'''
+        return [i for i, k in enumerate(self.kinds)
+                if k != checksum.TK_DEFROOT]
+
+    def find(self, name, kinds=None):
+        '''
+        Returns the index of the first section named ``name`` (and of one of
+        the ``kinds`` if given) or -1 if there is none
+        '''
+        for i, n in enumerate(self.names):
+            k = self.kinds[i]
+            if n == name and k != checksum.TK_DEFROOT and \
+                    (kinds is None or k in kinds):
+                return i
+
+        return -1
+
+    def counts(self):
+        '''Returns a dict with the number of sections per type'''
+        counts = dict.fromkeys(checksum.SECTION_NAMES.values(), 0)
+        for k in self.kinds:
+            if k != checksum.TK_DEFROOT:
+                counts[checksum.SECTION_NAMES[k]] += 1
+
+        return counts
+
+    def reuse_map(self):
+        '''
+        Returns a dict to pass as ``reuse`` to ``checksum.scan_buffer``,
+        which maps ``(kind, name, raw length, raw crc)`` of each section to
+        ``(size, clen, crc)``
+        '''
+        return dict(
+            ((self.kinds[i], self.names[i], self.xoffs[i] - self.hoffs[i],
+              self.rawcrcs[i]), (self.sizes[i], self.clens[i], self.crcs[i]))
+            for i in self.sections())
+
+    def dumps(self):
+        '''Returns the index serialized as ``bytes``'''
+        out = [self._HEADER.pack(
+            self.MAGIC, self.VERSION, len(self), self.filesize, self.mtime,
+            self.tstart, self.tend, self.crcoff,
+            (self.oldcrc or '').encode('ascii'),
+            (self.newcrc or '').encode('ascii'))]
+
+        for name, typecode in self._ARRAYS:
+            arr = getattr(self, name)
+            if sys.byteorder != 'little':
+                arr = array.array(arr.typecode, arr)
+                arr.byteswap()
+            out.append(arr.tostring() if py3.PY2 else arr.tobytes())
+
+        out.append(b'\0'.join(n.encode('utf-8') for n in self.names))
+        return b''.join(out)
+
+    def dump(self, f):
+        '''Writes the serialized index to a binary file-like/string ``f``'''
+        if isinstance(f, py3.string_types):
+            with io.open(f, 'wb') as fout:
+                fout.write(self.dumps())
+        else:
+            f.write(self.dumps())
+
+    @classmethod
+    def loads(cls, data):
+        '''Returns an index restored from the ``bytes`` in ``data``'''
+        hsize = cls._HEADER.size
+        if len(data) < hsize:
+            raise ValueError('Not a supported export index')
+
+        (magic, version, count, filesize, mtime, tstart, tend, crcoff,
+         oldcrc, newcrc) = cls._HEADER.unpack(data[:hsize])
+
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('Not a supported export index')
+
+        self = cls()
+        self.filesize, self.mtime = filesize, mtime
+        self.tstart, self.tend = tstart, tend
+        self.crcoff = crcoff
+        self.oldcrc = oldcrc.rstrip(b'\0').decode('ascii') or None
+        self.newcrc = newcrc.rstrip(b'\0').decode('ascii') or None
+
+        pos = hsize
+        for name, typecode in self._ARRAYS:
+            raw = array.array(typecode)
+            isize = raw.itemsize
+            if py3.PY2:
+                raw.fromstring(data[pos:pos + count * isize])
+            else:
+                raw.frombytes(data[pos:pos + count * isize])
+            if sys.byteorder != 'little':
+                raw.byteswap()
+            setattr(self, name, raw)
+            pos += count * isize
+
+        names = data[pos:]
+        self.names = [n.decode('utf-8') for n in names.split(b'\0')] \
+            if count else []
+        return self
+
+    @classmethod
+    def load(cls, f):
+        '''Returns an index restored from a binary file-like/string ``f``'''
+        if isinstance(f, py3.string_types):
+            with io.open(f, 'rb') as fin:
+                return cls.loads(fin.read())
+
+        return cls.loads(f.read())
+
+
+def build_index(src, hooks=None):
+    '''
+    Builds the ``ExportIndex`` of ``src``, which can be a path, a binary
+    file-like object or an object supporting the buffer protocol
+    '''
+    index = ExportIndex()
+    buf, close, mtime = src, None, 0
+
+    if isinstance(src, py3.string_types):
+        mtime = file_stamp(src)[1]
+        close = src = io.open(src, 'rb')
+
+    if hasattr(src, 'read'):
+        buf = checksum.map_file(src)
+
+    try:
+        filesize = len(buf)
+        res = checksum.scan_buffer(buf, hooks=hooks, index=index)
+    finally:
+        checksum.close_buffer(buf)
+        if close is not None:
+            close.close()
+
+    index.set_result(res, filesize, mtime)
+    return index
+
+
+SIDECAR_EXT = '.fcidx'
+
+
+def sidecar_path(path):
+    '''Returns the path of the sidecar index of the export in ``path``'''
+    return path + SIDECAR_EXT
+
+
+def file_stamp(path):
+    '''Returns ``(size, mtime)`` of ``path``, with mtime in nanoseconds'''
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1e9)
+
+    return st.st_size, mtime
+
+
+def read_sidecar(path, fresh=False):
+    '''
+    Returns the ``ExportIndex`` stored in the sidecar of the export in
+    ``path`` or ``None`` if there is none or it cannot be read
+
+    If ``fresh`` is ``True``, ``None`` is also returned if the size or mtime
+    of ``path`` do not match those stored in the index
+    '''
+    try:
+        index = ExportIndex.load(sidecar_path(path))
+        if fresh and file_stamp(path) != (index.filesize, index.mtime):
+            return None
+    except (EnvironmentError, ValueError, struct.error):
+        return None
+
+    return index
+
+
+def write_sidecar(path, index):
+    '''
+    Stores ``index`` in the sidecar of the export in ``path``. Returns
+    ``False`` if it could not be written (the sidecar is only a speed-up)
+    '''
+    try:
+        index.dump(sidecar_path(path))
+    except EnvironmentError:
+        return False
+
+    return True
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+import collections
+import io
+import mmap
+
+from . import archive
+from . import checksum
+from . import extract
+from . import py3
+
+
+class RootVars(collections.OrderedDict):
+    '''Root definitions (``a=b``) of an export, in file order'''
+    __slots__ = ()
+
+
+class Section(object):
+    '''
+    Embedded file of an ``Export``. It only holds its name and the offsets
+    of the header, body (``boff`` to ``eoff``) and end of the ``END OF
+    FILE`` line (``xoff``) in the buffer of the export
+
+    The payload (decoded for BINFILE/B64FILE, un-escaped for CFGFILE) is
+    only decoded when ``payload`` (or anything needing it) is accessed and
+    kept until ``release`` is called
+    '''
+    __slots__ = ('export', 'name', 'hoff', 'boff', 'eoff', 'xoff', '_payload')
+
+    kind = None  # checksum.TK_xxx of the section type
+    typename = None  # name of the section type
+
+    def __init__(self, export, name, hoff, boff, eoff, xoff):
+        self.export = export
+        self.name = name
+        self.hoff, self.boff, self.eoff, self.xoff = hoff, boff, eoff, xoff
+        self._payload = None
+
+    def __repr__(self):
+        return '<{} {} rawsize={}>'.format(
+            self.__class__.__name__, self.name, self.rawsize)
+
+    @property
+    def rawsize(self):
+        '''Size of the body as found in the export (nothing is decoded)'''
+        return self.eoff - self.boff
+
+    @property
+    def raw(self):
+        '''``memoryview`` of the body in the buffer of the export. It has to
+        be released before the export is closed'''
+        return memoryview(self.export.buf)[self.boff:self.eoff]
+
+    @property
+    def loaded(self):
+        '''``True`` if the payload has been decoded and is kept'''
+        return self._payload is not None
+
+    def iter_payload(self, blocksize=checksum.CRC_FLUSHSIZE):
+        '''Yields the payload in decoded blocks without keeping it'''
+        if self._payload is not None:
+            yield self._payload
+            return
+
+        for block in extract.iter_payload(self.export.buf, self.kind,
+                                          self.boff, self.eoff, blocksize,
+                                          self.name):
+            yield block
+
+    @property
+    def payload(self):
+        '''The payload as ``bytes``, decoded on first access'''
+        if self._payload is None:
+            self._payload = b''.join(self.iter_payload())
+
+        return self._payload
+
+    @property
+    def size(self):
+        '''Size of the payload, told from the layout of the body if it is not
+        loaded (``extract.payload_size``). Only if it cannot be told that way
+        the payload is decoded in blocks, which are not kept'''
+        if self._payload is not None:
+            return len(self._payload)
+
+        size = extract.payload_size(self.export.buf, self.kind, self.boff,
+                                    self.eoff)
+        if size is None:
+            size = sum(len(block) for block in self.iter_payload())
+
+        return size
+
+    @property
+    def crc(self):
+        '''crc32 of the contribution of the section to the crc of the export
+        (name, null terminator and payload)'''
+        crc = binascii.crc32(self.name.encode('utf-8') + b'\0')
+        for block in self.iter_payload():
+            crc = binascii.crc32(block, crc)
+
+        return crc & 0xffffffff
+
+    def release(self):
+        '''Drops the decoded payload'''
+        self._payload = None
+
+
+class CfgFile(Section):
+    '''Embedded text file'''
+    __slots__ = ()
+
+    kind = checksum.TK_CFGFILE
+    typename = 'CFGFILE'
+
+    @property
+    def text(self):
+        '''The payload as text'''
+        return self.payload.decode('utf-8')
+
+
+class BinFile(Section):
+    '''Embedded binary file stored as hex lines'''
+    __slots__ = ()
+
+    kind = checksum.TK_BINFILE
+    typename = 'BINFILE'
+
+
+class B64File(Section):
+    '''Embedded binary file stored as base64 lines'''
+    __slots__ = ()
+
+    kind = checksum.TK_B64FILE
+    typename = 'B64FILE'
+
+
+SECTION_CLASSES = {
+    checksum.TK_CFGFILE: CfgFile,
+    checksum.TK_BINFILE: BinFile,
+    checksum.TK_B64FILE: B64File,
+}
+
+
+class Export(object):
+    '''
+    Parsed model of an export held in ``buf`` (bytes, mmap, ...): the
+    ``rootvars`` (a ``RootVars``), the ``sections`` (``CfgFile``,
+    ``BinFile`` and ``B64File`` instances) and the ``oldcrc`` of the
+    trailer (``None`` if there is none)
+
+    Building it only jumps from section header to section header: nothing
+    is decoded until the payload of a section is accessed. Iterating over
+    the names and raw sizes of the sections is therefore cheap, and memory
+    only grows with the sections whose payload is kept
+
+    Use ``Export.open(path)`` to memory map a file and ``close`` (or the
+    export as a context manager) to release it
+    '''
+    __slots__ = ('buf', 'rootvars', 'sections', 'oldcrc', 'tstart', 'tend',
+                 '_closing')
+
+    def __init__(self, buf):
+        self.buf = buf
+        self._closing = []
+
+        self.sections = [
+            SECTION_CLASSES[kind](self, name, hoff, boff, eoff, xoff)
+            for kind, name, hoff, boff, eoff, xoff
+            in extract.iter_sections(buf)
+        ]
+
+        mv = memoryview(buf)
+        rootend = self.sections[0].hoff if self.sections else len(mv)
+        self.rootvars = RootVars(
+            checksum.probe(io.BytesIO(mv[:rootend].tobytes())))
+
+        self._find_trailer(self.sections[-1].xoff if self.sections else 0)
+
+    @classmethod
+    def open(cls, src):
+        '''Returns the ``Export`` of ``src``, a path or a binary file-like
+        object, memory mapped if possible. Compressed files and archive
+        members are read (decompressed) into memory'''
+        if isinstance(src, py3.string_types):
+            if archive.is_special(src):  # fileno is the compressed one
+                with archive.open_input(src) as f:
+                    return cls(f.read())
+
+            with io.open(src, 'rb') as f:
+                return cls.open(f)
+
+        buf = checksum.map_file(src)
+        export = cls(buf)
+        if isinstance(buf, mmap.mmap):
+            export._closing.append(buf)
+        return export
+
+    def _find_trailer(self, pos):
+        '''Locates the ``END OF EXPORT`` line looking from ``pos`` on'''
+        self.oldcrc = None
+        self.tstart = self.tend = len(self.buf)
+
+        mv = memoryview(self.buf)
+        find = checksum.finder(self.buf)
+        size = len(mv)
+        while pos < size:
+            nxt = find(b'\n', pos)
+            nxt = size if nxt == -1 else nxt + 1
+            if mv[pos] == 0x2a:  # b'*'
+                kind, value = checksum.classify_line(mv[pos:nxt].tobytes())
+                if kind == checksum.TK_ENDROOT:
+                    self.oldcrc = value.decode('ascii')
+                    self.tstart, self.tend = pos, nxt
+                    return
+
+            pos = nxt
+
+    def close(self):
+        '''Releases the buffer if it was mapped by ``open``'''
+        checksum.close_all(self._closing)
+
+        self._closing = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def __getitem__(self, key):
+        '''Returns a section by position or by name (``KeyError`` if there
+        is no such section)'''
+        if isinstance(key, py3.string_types):
+            section = self.find(key)
+            if section is None:
+                raise KeyError(key)
+            return section
+
+        return self.sections[key]
+
+    def names(self):
+        '''Returns the names of the sections'''
+        return [s.name for s in self.sections]
+
+    def find(self, name):
+        '''Returns the first section named ``name`` or ``None``'''
+        for section in self.sections:
+            if section.name == name:
+                return section
+
+        return None
+
+    def calc_crc(self):
+        '''Returns ``(oldcrc, newcrc)`` calculated over the buffer, without
+        keeping any payload'''
+        return checksum.calc_crc32_buffer(self.buf)
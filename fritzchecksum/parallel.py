@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+import collections
+import multiprocessing
+import multiprocessing.pool
+
+from . import checksum
+from . import crcmath
+
+
+PAR_CHUNKSIZE = 4 << 20  # bytes of (encoded) payload per task
+PAR_MINSIZE = 16 << 20  # smaller payloads are not worth distributing
+
+
+def crc_chunk(task):
+    '''
+    Computes the crc of a chunk of payload. ``task`` is a tuple ``(chunk,
+    b64, name)``: ``b64`` is ``None`` for raw chunks and otherwise tells how
+    the whole lines in ``chunk`` are decoded (see ``checksum.decode_block``)
+
+    Returns the tuple ``(crc, size)`` of the (decoded) chunk
+    '''
+    chunk, b64, name = task
+    if b64 is not None:
+        chunk = checksum.decode_block(chunk, b64, name)
+
+    return binascii.crc32(chunk) & 0xffffffff, len(chunk)
+
+
+class ParallelCRC(object):
+    '''
+    Computes the crc of large payloads by splitting them in chunks, whose
+    crcs are calculated in a pool of ``jobs`` threads (or processes if
+    ``processes`` is ``True``) and combined in order with
+    ``crcmath.crc32_combine``. The result is the same as that of a
+    sequential ``binascii.crc32``
+
+    ``binascii.crc32`` releases the GIL for large buffers. Decoding does not,
+    so a process pool scales better for BINFILE/B64FILE at the cost of
+    copying the chunks to the workers. Threads work on views of the chunks
+
+    Pass it as ``parallel`` to ``checksum.scan_buffer``, which only uses it
+    for payloads of at least ``minsize`` bytes. Call ``close`` when done or
+    use it as a context manager
+    '''
+    def __init__(self, jobs=0, processes=False, chunksize=PAR_CHUNKSIZE,
+                 minsize=PAR_MINSIZE):
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.processes = processes
+        self.chunksize = chunksize
+        self.minsize = minsize
+        if processes:
+            self.pool = multiprocessing.Pool(self.jobs)
+        else:
+            self.pool = multiprocessing.pool.ThreadPool(self.jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Stops the pool'''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def crc(self, chunks, b64=None, name=''):
+        '''
+        Returns the tuple ``(crc, size)`` of the concatenation of ``chunks``
+        (bytes-like objects) once decoded (see ``crc_chunk`` for ``b64`` and
+        ``name``). Decoding errors raised in the workers are re-raised
+
+        Only up to two chunks per job are in flight at any time and none is
+        once it returns, so that the buffer of the chunks can be closed
+        '''
+        crc, size = 0, 0
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                if self.processes:  # views cannot be pickled
+                    chunk = bytes(chunk)
+                task = (chunk, b64, name)
+                pending.append(self.pool.apply_async(crc_chunk, (task,)))
+                if len(pending) >= 2 * self.jobs:
+                    ccrc, csize = pending.popleft().get()
+                    crc = crcmath.crc32_combine(crc, ccrc, csize)
+                    size += csize
+
+            while pending:
+                ccrc, csize = pending.popleft().get()
+                crc = crcmath.crc32_combine(crc, ccrc, csize)
+                size += csize
+
+        finally:  # an error was raised: wait for the chunks in flight
+            for result in pending:
+                result.wait()
+
+        return crc, size
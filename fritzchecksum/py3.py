@@ -21,6 +21,7 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import binascii
 import sys
 
 PY2 = sys.version_info.major == 2
@@ -33,6 +34,7 @@ if PY2:
 
     string_types = str, unicode
     integer_types = int, long
+    text_type = unicode
 
     filter = itertools.ifilter
     map = itertools.imap
@@ -43,6 +45,8 @@ if PY2:
 
     bytes = bytes
 
+    def fromhex(s): return binascii.unhexlify(''.join(s.split()))
+
     from io import StringIO
 
     from urllib2 import urlopen
@@ -66,6 +70,7 @@ else:
 
     string_types = str,
     integer_types = int,
+    text_type = str
 
     filter = filter
     map = map
@@ -74,6 +79,8 @@ else:
 
     def cmp(a, b): return (a > b) - (a < b)
 
+    fromhex = bytes.fromhex
+
     def bytes(x): return x.encode('utf-8')
 
     from io import StringIO
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import base64
+import json
+
+
+class Manifest(object):
+    '''
+    Recipe to rebuild an export from pieces: ``parts`` is a list of
+    ``(digest, size)`` tuples where ``digest`` is ``None`` for literal
+    ``bytes`` kept in the manifest itself (root lines, section headers and
+    small bodies) in place of ``size``. Larger section bodies are referenced
+    by the digest of an object in the store
+
+    ``size`` is the size of the export and ``oldcrc`` the crc in its
+    trailer
+    '''
+    VERSION = 1
+
+    def __init__(self, name, parts=None, size=0, oldcrc=None):
+        self.name = name
+        self.parts = parts if parts is not None else []
+        self.size = size
+        self.oldcrc = oldcrc
+
+    def refs(self):
+        '''Returns the digests of the objects referenced by the manifest'''
+        return [digest for digest, size in self.parts if digest is not None]
+
+    def dumps(self):
+        '''Returns the manifest serialized as JSON text'''
+        parts = []
+        for digest, data in self.parts:
+            if digest is None:
+                parts.append(['=', base64.b64encode(data).decode('ascii')])
+            else:
+                parts.append([digest, data])
+
+        return json.dumps(dict(
+            version=self.VERSION, name=self.name, size=self.size,
+            oldcrc=self.oldcrc, parts=parts), sort_keys=True)
+
+    @classmethod
+    def loads(cls, text):
+        '''Returns a manifest restored from the JSON ``text``'''
+        d = json.loads(text)
+        if d.get('version') != cls.VERSION:
+            raise ValueError('Unsupported manifest version')
+
+        parts = []
+        for digest, data in d['parts']:
+            if digest == '=':
+                parts.append((None, base64.b64decode(data)))
+            else:
+                parts.append((digest, data))
+
+        return cls(d['name'], parts, d['size'], d['oldcrc'])
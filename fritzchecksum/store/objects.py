@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import io
+import os
+import tempfile
+
+
+class ObjectStore(object):
+    '''
+    Content addressed store of immutable blobs kept as files under ``root``
+    (``root/ab/cdef...``), named after the sha1 hex digest of their content.
+    Storing content which is already there costs only the hashing
+    '''
+    HASH = hashlib.sha1
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def digest(cls, data):
+        '''Returns the name under which ``data`` is stored'''
+        return cls.HASH(data).hexdigest()
+
+    def path(self, digest):
+        '''Returns the path of the object ``digest``'''
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data, digest=None):
+        '''
+        Stores ``data`` (a bytes-like object) if not yet present and returns
+        the tuple ``(digest, new)``. The object is written to a temporary
+        file and renamed, so that readers never see partial objects
+        '''
+        digest = digest or self.digest(data)
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest, False
+
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:  # created concurrently
+                if not os.path.isdir(dirname):
+                    raise
+
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with io.open(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, path)  # no-op race: same content
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return digest, True
+
+    def open(self, digest):
+        '''Returns a binary file-like object to read the object ``digest``'''
+        return io.open(self.path(digest), 'rb')
+
+    def get(self, digest):
+        '''Returns the content of the object ``digest``'''
+        with self.open(digest) as f:
+            return f.read()
+
+    def remove(self, digest):
+        os.remove(self.path(digest))
+
+    def __iter__(self):
+        '''Yields the digests of all the objects'''
+        if not os.path.isdir(self.root):
+            return
+
+        for prefix in sorted(os.listdir(self.root)):
+            subdir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(subdir):
+                continue
+            for name in sorted(os.listdir(subdir)):
+                if not name.endswith('.tmp'):
+                    yield prefix + name
+
+    def size(self, digest):
+        '''Returns the stored size of the object ``digest``'''
+        return os.path.getsize(self.path(digest))
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import mmap
+import os
+import random
+import re
+import tempfile
+
+from .. import archive
+from .. import checksum
+from .. import model
+from .. import py3
+from .manifest import Manifest
+from .objects import ObjectStore
+from . import zdict as fczdict
+
+
+SECTION_MINSIZE = 1024  # smaller bodies are kept in the manifest
+COPY_CHUNKSIZE = 1 << 16
+TRAIN_SAMPLES = 256  # objects sampled to train a dictionary
+
+# names of stored exports: path like, no up-level references
+RE_NAME = re.compile(r'^[\w\-.]+(?:/[\w\-.]+)*$')
+
+
+def split_export(buf, minsize=SECTION_MINSIZE):
+    '''
+    Generator which splits the export in ``buf`` (a buffer or a
+    ``model.Export``) at the section boundaries and yields
+    ``(body, start, end)``: ``body`` is ``True`` for section bodies of at
+    least ``minsize`` bytes and ``False`` for everything in between (root
+    lines, section headers and end markers, small bodies)
+    '''
+    export = buf if isinstance(buf, model.Export) else model.Export(buf)
+    pos, size = 0, len(export.buf)
+    for section in export:
+        if section.rawsize < minsize:
+            continue
+
+        if section.boff > pos:
+            yield False, pos, section.boff
+        yield True, section.boff, section.eoff
+        pos = section.eoff
+
+    if pos < size:
+        yield False, pos, size
+
+
+class SectionStore(object):
+    '''
+    Deduplicating store of exports under the directory ``root``
+
+    Exports are split at their section boundaries (``split_export``). Each
+    section body is stored once in an ``ObjectStore`` (``root/objects``)
+    under the hash of its content and each export gets a ``Manifest``
+    (``root/manifests/NAME.json``) listing its pieces. Sections shared
+    across days and devices are therefore stored only once and ingesting
+    them again costs only the hashing
+
+    Exports are rebuilt byte for byte, streaming, with ``get``
+
+    With ``compress`` new objects are deflated (``level``) with the current
+    preset dictionary of the store (see ``train``) if that makes them
+    smaller. Objects are always named after their uncompressed content and
+    compressed and plain objects can be mixed in a store
+    '''
+    def __init__(self, root, minsize=SECTION_MINSIZE, compress=False,
+                 level=fczdict.LEVEL):
+        self.root = root
+        self.minsize = minsize
+        self.compress = compress
+        self.level = level
+        self.objects = ObjectStore(os.path.join(root, 'objects'))
+        self.mroot = os.path.join(root, 'manifests')
+        self.droot = os.path.join(root, 'dicts')
+        self._zdicts = {}
+
+    def _mpath(self, name):
+        if not RE_NAME.match(name) or \
+                any(p in ('.', '..') for p in name.split('/')):
+            raise ValueError('Invalid export name: {!r}'.format(name))
+
+        return os.path.join(self.mroot, *name.split('/')) + '.json'
+
+    def put(self, name, src):
+        '''
+        Stores the export in ``src`` (a path, also of a compressed file or
+        archive member, a binary file-like object or a buffer) as ``name``,
+        replacing any previous export with that name
+
+        Returns the ``Manifest`` of the export. Its attributes ``newobjects``
+        and ``newbytes`` tell how much content was not yet in the store
+        '''
+        mpath = self._mpath(name)
+        buf, closing = src, []
+        try:
+            if isinstance(src, py3.string_types):
+                if archive.is_special(src):  # fileno is the compressed one
+                    with archive.open_input(src) as f:
+                        buf = src = f.read()
+                else:
+                    src = io.open(src, 'rb')
+                    closing.append(src)
+
+            if hasattr(src, 'read'):
+                buf = checksum.map_file(src)
+                if isinstance(buf, mmap.mmap):
+                    closing.append(buf)
+
+            manifest = self._split(name, buf)
+        finally:
+            checksum.close_all(closing)
+
+        self._write(mpath, manifest.dumps().encode('utf-8'))
+        return manifest
+
+    def _split(self, name, buf):
+        '''Stores the bodies of ``buf`` and returns its manifest'''
+        mv = memoryview(buf)
+        if mv.format != 'B' or mv.ndim != 1:
+            mv = mv.cast('B')
+
+        export = model.Export(buf)
+        manifest = Manifest(name, size=len(mv), oldcrc=export.oldcrc)
+        manifest.newobjects = manifest.newbytes = 0
+        zd = self.zdict() if self.compress else None
+        for body, start, end in split_export(export, self.minsize):
+            piece = mv[start:end]
+            if not body:
+                manifest.parts.append((None, piece.tobytes()))
+                continue
+
+            digest, new = self._put_object(piece, zd)
+            manifest.parts.append((digest, end - start))
+            if new:
+                manifest.newobjects += 1
+                manifest.newbytes += end - start
+
+        return manifest
+
+    def _put_object(self, data, zd=None):
+        '''Stores the section body ``data``, compressed (with the ``ZDict``
+        ``zd`` if not ``None``) if enabled. Returns ``(digest, new)``'''
+        digest = self.objects.digest(data)
+        if self.objects.has(digest):
+            return digest, False
+
+        if self.compress:
+            blob = fczdict.compress(data, zd, self.level)
+            if len(blob) < len(data):
+                data = blob
+
+        return self.objects.put(data, digest)
+
+    def _iter_object(self, digest):
+        '''Yields the uncompressed content of the object ``digest`` in
+        chunks'''
+        with self.objects.open(digest) as f:
+            chunks = iter(lambda: f.read(COPY_CHUNKSIZE), b'')
+            for chunk in fczdict.iter_decompress(chunks, self._load_zdict):
+                yield chunk
+
+    def read_object(self, digest):
+        '''Returns the uncompressed content of the object ``digest``'''
+        return b''.join(self._iter_object(digest))
+
+    def _dpath(self, version):
+        return os.path.join(self.droot, version + '.zdict')
+
+    def _load_zdict(self, dictid):
+        '''Returns the ``ZDict`` with the (binary) id ``dictid``'''
+        try:
+            return self._zdicts[dictid]
+        except KeyError:
+            pass
+
+        version = ''.join('{:02x}'.format(c) for c in bytearray(dictid))
+        try:
+            with io.open(self._dpath(version), 'rb') as f:
+                zd = fczdict.ZDict(f.read())
+        except EnvironmentError:
+            raise ValueError('Missing dictionary {}'.format(version))
+
+        self._zdicts[dictid] = zd
+        return zd
+
+    def zdict(self):
+        '''Returns the current ``ZDict`` of the store or ``None``'''
+        try:
+            with io.open(os.path.join(self.droot, 'CURRENT'), 'rb') as f:
+                version = f.read().decode('ascii').strip()
+        except EnvironmentError:
+            return None
+
+        return self._load_zdict(py3.fromhex(version))
+
+    def train(self, size=fczdict.ZDICT_SIZE, samples=TRAIN_SAMPLES, seed=0):
+        '''
+        Builds a preset dictionary of at most ``size`` bytes from a sample
+        of ``samples`` stored objects and makes it the current dictionary
+        for objects added from now on. Objects compressed with previous
+        dictionaries keep them (the dictionaries are never removed)
+
+        Returns the new ``ZDict`` (``None`` if nothing worth a dictionary
+        was found, leaving the current one in place)
+        '''
+        digests = list(self.objects)
+        if len(digests) > samples:
+            digests = random.Random(seed).sample(digests, samples)
+
+        data = fczdict.train((self.read_object(d) for d in digests), size)
+        if not data:
+            return None
+
+        zd = fczdict.ZDict(data)
+
+        self._write(self._dpath(zd.version), zd.data)
+        self._write(os.path.join(self.droot, 'CURRENT'),
+                    zd.version.encode('ascii'))
+        self._zdicts[zd.id] = zd
+        return zd
+
+    def _write(self, path, data):
+        '''Writes ``data`` to ``path`` atomically'''
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with io.open(fd, 'wb') as f:
+            f.write(data)
+        getattr(os, 'replace', os.rename)(tmp, path)
+
+    def manifest(self, name):
+        '''Returns the ``Manifest`` of the export ``name`` (``KeyError`` if
+        there is none)'''
+        try:
+            with io.open(self._mpath(name), 'rb') as f:
+                return Manifest.loads(f.read().decode('utf-8'))
+        except EnvironmentError:
+            raise KeyError(name)
+
+    def get(self, name, dst, verify=False):
+        '''
+        Rebuilds the export ``name`` into ``dst`` (path or binary file-like)
+        streaming its pieces. With ``verify`` the objects are hashed again
+        while copying and ``ValueError`` is raised on a mismatch
+
+        Returns the number of bytes written
+        '''
+        manifest = self.manifest(name)
+        if isinstance(dst, py3.string_types):
+            with archive.open_output(dst) as f:
+                return self._rebuild(manifest, f, verify)
+
+        return self._rebuild(manifest, dst, verify)
+
+    def _rebuild(self, manifest, dst, verify):
+        written = 0
+        for digest, data in manifest.parts:
+            if digest is None:
+                dst.write(data)
+                written += len(data)
+                continue
+
+            h = self.objects.HASH() if verify else None
+            for chunk in self._iter_object(digest):
+                dst.write(chunk)
+                written += len(chunk)
+                if h is not None:
+                    h.update(chunk)
+
+            if h is not None and h.hexdigest() != digest:
+                raise ValueError('Corrupted object {}'.format(digest))
+
+        return written
+
+    def __contains__(self, name):
+        return os.path.exists(self._mpath(name))
+
+    def names(self):
+        '''Returns the names of the stored exports'''
+        names = []
+        for dirpath, dirs, files in os.walk(self.mroot):
+            dirs.sort()
+            rel = os.path.relpath(dirpath, self.mroot)
+            for f in sorted(files):
+                if f.endswith('.json'):
+                    n = f[:-len('.json')]
+                    names.append(n if rel == '.' else
+                                 '/'.join(rel.split(os.sep) + [n]))
+
+        return names
+
+    def delete(self, name):
+        '''Removes the export ``name``. Its objects are only removed by
+        ``gc``'''
+        try:
+            os.remove(self._mpath(name))
+        except EnvironmentError:
+            raise KeyError(name)
+
+    def gc(self):
+        '''Removes the objects no export refers to and returns how many'''
+        refs = set()
+        for name in self.names():
+            refs.update(self.manifest(name).refs())
+
+        removed = 0
+        for digest in list(self.objects):
+            if digest not in refs:
+                self.objects.remove(digest)
+                removed += 1
+
+        return removed
+
+    def stats(self):
+        '''Returns a dict with the number of ``exports``, their total size
+        (``size``), the number of ``objects`` and their size on disk
+        (``stored``)'''
+        names = self.names()
+        size = sum(self.manifest(n).size for n in names)
+        digests = list(self.objects)
+        stored = sum(self.objects.size(d) for d in digests)
+        return dict(exports=len(names), size=size, objects=len(digests),
+                    stored=stored)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import hashlib
+import struct
+import zlib
+
+
+MAGIC = b'\x89FCZ'  # never the start of a section body (ascii/utf-8 text)
+FRAME_VERSION = 1
+_FRAME = struct.Struct(str('>4sB8s'))  # magic, version, dictionary id
+NODICT = b'\0' * 8
+
+ZDICT_SIZE = 32 * 1024  # deflate window: longer dictionaries are cut
+LEVEL = 6
+WBITS = -15  # raw deflate, the frame carries the rest
+
+
+def train(samples, size=ZDICT_SIZE):
+    '''
+    Returns a preset dictionary (``bytes``) of at most ``size`` bytes built
+    from ``samples`` (iterable of section bodies).
+
+    Lines are the unit of repetition in exports (cfg statements, hex and
+    base64 lines of common files) and so are the keys of cfg statements
+    with per box values. Those found in several samples are chosen by the
+    bytes they cover (``samples * len``) and placed with the most valuable
+    ones last, because deflate reaches the end of the dictionary with the
+    shortest distances
+    '''
+    counts = collections.Counter()
+    nsamples = 0
+    for sample in samples:
+        nsamples += 1
+        lines = set(bytes(sample).splitlines(True))
+        # the key of ``key = value;`` repeats even if the value does not
+        lines.update([line[:line.index(b'= ') + 2] for line in lines
+                      if b'= ' in line])
+        counts.update(lines)
+
+    mincount = 2 if nsamples > 1 else 1
+    scored = sorted(
+        ((n * len(line), line) for line, n in counts.items()
+         if n >= mincount and len(line) > 4),
+        reverse=True)
+
+    chosen, total = [], 0
+    for score, line in scored:
+        if total + len(line) > size:
+            continue
+        chosen.append(line)
+        total += len(line)
+
+    return b''.join(reversed(chosen))
+
+
+class ZDict(object):
+    '''
+    zlib preset dictionary identified (versioned) by ``id``, the first 8
+    bytes of the sha1 of its content. Compressed data records the ``id`` of
+    the dictionary it needs, so that a store can train new dictionaries
+    and keep reading what was compressed with the old ones
+
+    Requires Python >= 3.3 (``zdict`` support in zlib)
+    '''
+    def __init__(self, data):
+        self.data = bytes(data[-ZDICT_SIZE:])
+        self.id = hashlib.sha1(self.data).digest()[:8]
+
+    @property
+    def version(self):
+        '''Hex string of ``id``'''
+        return ''.join('{:02x}'.format(c) for c in bytearray(self.id))
+
+    def compressobj(self, level=LEVEL):
+        return zlib.compressobj(level, zlib.DEFLATED, WBITS, zdict=self.data)
+
+    def decompressobj(self):
+        return zlib.decompressobj(WBITS, zdict=self.data)
+
+
+def compress(data, zdict=None, level=LEVEL):
+    '''
+    Returns ``data`` compressed in a frame (``MAGIC``, ``FRAME_VERSION``,
+    dictionary id) with the preset dictionary ``zdict`` (a ``ZDict``) or
+    without one if ``None``
+    '''
+    if zdict is None:
+        c = zlib.compressobj(level, zlib.DEFLATED, WBITS)
+        dictid = NODICT
+    else:
+        c = zdict.compressobj(level)
+        dictid = zdict.id
+
+    return _FRAME.pack(MAGIC, FRAME_VERSION, dictid) + c.compress(data) + \
+        c.flush()
+
+
+def is_compressed(head):
+    '''Returns ``True`` if ``head`` (the first bytes of an object) is the
+    start of a compressed frame'''
+    return bytes(head[:len(MAGIC)]) == MAGIC
+
+
+def frame_dictid(head):
+    '''Returns the id of the dictionary needed by the frame starting in
+    ``head`` (``None`` if compressed without dictionary)'''
+    magic, version, dictid = _FRAME.unpack(bytes(head[:_FRAME.size]))
+    if magic != MAGIC or version != FRAME_VERSION:
+        raise ValueError('Not a compressed frame (version {})'.format(version))
+
+    return None if dictid == NODICT else dictid
+
+
+def iter_decompress(chunks, zdicts):
+    '''
+    Generator decompressing the frame delivered in ``chunks`` (iterable of
+    bytes) with the dictionary looked up in ``zdicts`` (mapping of id to
+    ``ZDict`` or a callable taking the id). Data which is not a compressed
+    frame is yielded unchanged
+    '''
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= _FRAME.size or not MAGIC.startswith(head[:4]):
+            break
+
+    if not is_compressed(head) or len(head) < _FRAME.size:
+        if head:
+            yield head
+        for chunk in chunks:
+            yield chunk
+        return
+
+    dictid = frame_dictid(head)
+    if dictid is None:
+        d = zlib.decompressobj(WBITS)
+    else:
+        getter = zdicts if callable(zdicts) else zdicts.__getitem__
+        d = getter(dictid).decompressobj()
+
+    out = d.decompress(head[_FRAME.size:])
+    if out:
+        yield out
+    for chunk in chunks:
+        out = d.decompress(chunk)
+        if out:
+            yield out
+
+    out = d.flush()
+    if out:
+        yield out
+    if not d.eof:
+        raise ValueError('Truncated compressed frame')
+
+
+def decompress(data, zdicts):
+    '''Returns ``data`` decompressed (see ``iter_decompress``)'''
+    return b''.join(iter_decompress([data], zdicts))
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+import bisect
+import random
+import re
+
+from .edit import B64_LINESIZE, HEX_LINESIZE
+
+
+ROOT_VARS = [
+    ('Password', '$$$$B3ZDKQ2PSLXMVH7EYR4NCUGWOT5JAF6I'),
+    ('FirmwareVersion', '113.07.29'),
+    ('CONFIG_INSTALL_TYPE', 'iks_16MB_xilinx'),
+    ('OEM', 'avm'),
+    ('Country', '049'),
+    ('Language', 'de'),
+    ('NoChecks', 'yes'),
+]
+
+# Section marker of each kind of payload
+SECTION_TAGS = {'cfg': 'CFGFILE', 'bin': 'CRYPTEDBINFILE', 'b64': 'B64FILE'}
+KINDS = ('cfg', 'bin', 'b64')
+
+# weights of each kind of section: cfg, bin, b64
+MIXES = {
+    'cfg': (1, 0, 0),
+    'bin': (0, 1, 0),
+    'b64': (0, 0, 1),
+    'mixed': (2, 5, 3),
+}
+
+# Broken variants: wrong crc in the trailer, trailer line cut in the middle,
+# no trailer at all, a non hex character in a BINFILE, a non base64
+# character in a B64FILE
+BROKEN = ('badcrc', 'truncated', 'notrailer', 'badhex', 'badb64')
+
+SECTIONS = 8  # default number of sections if no size is given
+PAYLOAD = (1024, 64 * 1024)  # default payload size range of a section
+CFG_SECTIONSIZE = 32 * 1024  # cfg files are small, binaries can be large
+MAX_SECTIONSIZE = 8 * 1024 * 1024
+POOL_SIZE = 1 << 20  # random bytes the binary payloads are cut from
+CFG_BLOCKS = 256  # cfg blocks the cfg payloads are made of
+CHUNKLINES = 4096  # lines written at once
+
+CFG_NAMES = ['ar7.cfg', 'voip.cfg', 'wlan.cfg', 'user.cfg', 'tr069.cfg',
+             'vpn.cfg']
+
+# cfg blocks: (block, [(key, kind)]). The kind tells how the value varies
+# from box to box (fixed values are the defaults)
+CFG_TEMPLATE = [
+    ('ar7cfg', [('mode', 'fixed'), ('igddenabled', 'bool'),
+                ('ethernet_ip', 'ip'), ('hostname', 'name'),
+                ('dhcpserver', 'fixed'), ('dhcpcstart', 'ip'),
+                ('dhcpcend', 'ip'), ('dnsserver1', 'ip')]),
+    ('landevices', [('mac', 'mac'), ('ip', 'ip'), ('name', 'name'),
+                    ('static_dhcp', 'bool'), ('online', 'bool')]),
+    ('forwardrules', [('protocol', 'fixed'), ('port', 'int'),
+                      ('fwip', 'ip'), ('enabled', 'bool')]),
+    ('voipcfg', [('enabled', 'bool'), ('name', 'name'),
+                 ('username', 'name'), ('registrar', 'name'),
+                 ('passwd', 'secret'), ('outboundproxy', 'name')]),
+    ('wlancfg', [('ap_enabled', 'bool'), ('ssid', 'name'),
+                 ('channel', 'int'), ('key_value', 'secret'),
+                 ('encryption', 'fixed'), ('tx_autopower', 'bool')]),
+    ('boxusers', [('name', 'name'), ('passwd', 'secret'),
+                  ('enabled', 'bool'), ('homedir', 'path'),
+                  ('box_admin_rights', 'fixed')]),
+]
+
+CFG_WORDS = ['fritz.box', 'office', 'home', 'laptop', 'printer', 'nas',
+             'sip.provider.example', 'tv', 'phone', 'guest']
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30,
+              'T': 1 << 40}
+
+
+def parse_size(s):
+    '''Returns the number of bytes of ``s`` (``10K``, ``1M``, ``1G``)'''
+    m = re.match(r'^(\d+)([KMGT]?)B?$', s.strip().upper())
+    if not m:
+        raise ValueError('Invalid size: {}'.format(s))
+    return int(m.group(1)) * SIZE_UNITS[m.group(2)]
+
+
+def format_size(n):
+    '''Returns ``n`` with the largest unit dividing it (``1M``)'''
+    for unit in ('T', 'G', 'M', 'K'):
+        if n >= SIZE_UNITS[unit] and not n % SIZE_UNITS[unit]:
+            return '{}{}'.format(n // SIZE_UNITS[unit], unit)
+    return str(n)
+
+
+def randbytes(rnd, n):
+    '''Returns ``n`` random bytes from the ``random.Random`` ``rnd``'''
+    if not n:
+        return b''
+    try:
+        return rnd.getrandbits(8 * n).to_bytes(n, 'little')
+    except AttributeError:  # py2
+        return bytes(bytearray(rnd.getrandbits(8) for _ in range(n)))
+
+
+def check_options(mix='mixed', hexwidth=HEX_LINESIZE, b64width=B64_LINESIZE,
+                  broken=None):
+    '''Raises ``ValueError`` if the options of ``generate`` are invalid.
+    Returns the weights of ``mix``'''
+    if broken is not None and broken not in BROKEN:
+        raise ValueError('Unknown broken variant: {}'.format(broken))
+
+    if hexwidth < 2 or hexwidth % 2 or b64width < 4 or b64width % 4:
+        raise ValueError('Line widths: hex must be even, base64 a multiple '
+                         'of 4')
+
+    weights = MIXES.get(mix) if not isinstance(mix, tuple) else mix
+    if weights is None or len(weights) != len(KINDS) or \
+            any(w < 0 for w in weights) or not any(weights):
+        raise ValueError('Invalid mix: {}'.format(mix))
+
+    return weights
+
+
+class _LinePool(object):
+    '''
+    Random bytes encoded once as lines (hex or base64) of ``width``
+    characters. Payloads are cut from it at line boundaries, which makes
+    the generation of the text and of the crc run at C speed
+    '''
+    def __init__(self, raw, width, b64):
+        self.b64 = b64
+        self.width = width
+        self.linebytes = width * 3 // 4 if b64 else width // 2
+        self.nlines = len(raw) // self.linebytes
+        self.raw = memoryview(raw)[:self.nlines * self.linebytes]
+        self.text = memoryview(b''.join(
+            self.encode(self.raw[i:i + self.linebytes])
+            for i in range(0, len(self.raw), self.linebytes)))
+        self.linesize = len(self.text) // self.nlines
+
+    def encode(self, raw):
+        '''Returns the line (with ``\\n``) of the bytes in ``raw``'''
+        if self.b64:
+            return binascii.b2a_base64(bytes(raw))
+        return binascii.hexlify(raw).upper() + b'\n'
+
+    def cut(self, rnd, nbytes):
+        '''Generator of ``(raw, text)`` pieces of a payload of ``nbytes``'''
+        lines, rest = divmod(nbytes, self.linebytes)
+        while lines:
+            n = min(lines, self.nlines, CHUNKLINES)
+            first = rnd.randrange(self.nlines - n + 1)
+            yield (self.raw[first * self.linebytes:
+                            (first + n) * self.linebytes],
+                   self.text[first * self.linesize:
+                             (first + n) * self.linesize])
+            lines -= n
+
+        if rest:
+            raw = self.raw[:rest]
+            yield raw, self.encode(raw)
+
+
+def _cfg_value(kind, rnd, escapes):
+    if kind == 'fixed':
+        return 'yes'
+    if kind == 'bool':
+        return rnd.choice(['yes', 'no'])
+    if kind == 'int':
+        return str(rnd.randrange(1, 65536))
+    if kind == 'ip':
+        return '192.168.{}.{}'.format(rnd.choice([178, 178, 0, 1]),
+                                      rnd.randrange(2, 255))
+    if kind == 'mac':
+        return ':'.join('{:02X}'.format(rnd.getrandbits(8)) for _ in range(6))
+    if kind == 'name':
+        return '"{}{}{}"'.format(rnd.choice(CFG_WORDS),
+                                 '\\\\' if escapes else '',
+                                 rnd.randrange(100))
+    if kind == 'path':
+        sep = '\\\\' if escapes else '/'  # escaped backslash in the export
+        return '"{}{}{}{}"'.format(sep, rnd.choice(CFG_WORDS), sep,
+                                   rnd.randrange(1000))
+    # secret: encrypted values differ on every box
+    return '"$$$${}"'.format(
+        ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567')
+                for _ in range(rnd.randrange(24, 72))))
+
+
+class _CfgPool(object):
+    '''
+    Random cfg blocks joined once, as found in the export (``text``) and as
+    they count for the crc (``crcdata``, un-escaped). Payloads are cut from
+    them at block boundaries
+    '''
+    def __init__(self, rnd, escapes):
+        texts = []
+        for _ in range(CFG_BLOCKS):
+            block, keys = rnd.choice(CFG_TEMPLATE)
+            out = ['{} {{\n'.format(block)]
+            for key, kind in keys:
+                out.append('        {} = {};\n'.format(
+                    key, _cfg_value(kind, rnd, escapes)))
+            out.append('}\n\n')
+            texts.append(''.join(out).encode('utf-8'))
+
+        crcs = [t.replace(b'\\\\', b'\\') for t in texts]
+        self.text = memoryview(b''.join(texts))
+        self.crcdata = memoryview(b''.join(crcs))
+        self.toffs, self.coffs = [0], [0]  # start of each block
+        for t, c in zip(texts, crcs):
+            self.toffs.append(self.toffs[-1] + len(t))
+            self.coffs.append(self.coffs[-1] + len(c))
+
+    def cut(self, rnd, nbytes):
+        '''Generator of ``(text, crcdata)`` runs of blocks making at least
+        ``nbytes`` of text'''
+        while nbytes > 0:
+            first = rnd.randrange(CFG_BLOCKS)
+            want = min(self.toffs[first] + nbytes, self.toffs[-1])
+            last = min(bisect.bisect_left(self.toffs, want), CFG_BLOCKS)
+            yield (self.text[self.toffs[first]:self.toffs[last]],
+                   self.crcdata[self.coffs[first]:self.coffs[last]])
+            nbytes -= self.toffs[last] - self.toffs[first]
+
+
+class _Writer(object):
+    '''Writes to ``fout`` (with ``eol``) keeping the count of bytes and the
+    crc of what the export contributes'''
+    def __init__(self, fout, crlf):
+        self.fout = fout
+        self.crlf = crlf
+        self.crc = 0
+        self.written = 0
+
+    def write(self, data):
+        if self.crlf:
+            data = bytes(data).replace(b'\n', b'\r\n')
+        self.fout.write(data)
+        self.written += len(data)
+
+    def tocrc(self, data):
+        self.crc = binascii.crc32(data, self.crc)
+
+
+def generate(fout, seed=0, size=None, sections=None, mix='mixed',
+             payload=None, hexwidth=HEX_LINESIZE, b64width=B64_LINESIZE,
+             crlf=False, escapes=False, broken=None):
+    '''
+    Writes a synthetic export to the binary file-like ``fout``. The same
+    arguments always give the same bytes
+
+      - seed: seed of all the random choices
+      - size: approximate size of the export. Sections are added until it is
+        reached (any size, the output is streamed)
+      - sections: number of sections (default ``SECTIONS`` if no ``size``)
+      - mix: a key of ``MIXES`` or a ``(cfg, bin, b64)`` tuple of weights
+        for the kind of each section
+      - payload: ``(min, max)`` bytes of payload of each section. By default
+        derived from ``size`` or ``PAYLOAD``
+      - hexwidth/b64width: characters per line of BINFILE/B64FILE payloads
+      - crlf: ``\\r\\n`` as end of line
+      - escapes: escaped backslashes (``\\\\``) in the cfg files
+      - broken: one of ``BROKEN`` to generate an invalid export
+
+    Returns ``(written, crc)``, ``crc`` being the hex string of the valid
+    crc of the content (also with ``badcrc``)
+    '''
+    weights = check_options(mix, hexwidth, b64width, broken)
+    kinds = [k for k, w in zip(KINDS, weights) for _ in range(w)]
+
+    # the broken payloads need their kind of section
+    first = sorted(set(kinds))  # every kind of the mix shows up
+    if broken in ('badhex', 'badb64'):
+        kind = 'bin' if broken == 'badhex' else 'b64'
+        first = [kind] + [k for k in first if k != kind]
+
+    if payload is None:
+        if size is None:
+            payload = PAYLOAD
+        else:
+            secsize = min(MAX_SECTIONSIZE,
+                          max(size // 16, min(CFG_SECTIONSIZE, size // 4)))
+            payload = (max(1, secsize // 4), max(1, secsize))
+
+    lo, hi = payload
+    if sections is None and size is None:
+        sections = SECTIONS
+
+    rnd = random.Random(seed)
+    raw = randbytes(rnd, POOL_SIZE)
+    pools = dict(bin=_LinePool(raw, hexwidth, False),
+                 b64=_LinePool(raw, b64width, True))
+    cfgpool = None  # made if needed
+    counters = dict(cfg=0, bin=0, b64=0)
+    w = _Writer(fout, crlf)
+
+    w.write(b'**** FRITZ!Box 7590 CONFIGURATION EXPORT\n')
+    for name, value in ROOT_VARS:
+        w.write('{}={}\n'.format(name, value).encode('ascii'))
+        w.tocrc('{}{}\0'.format(name, value).encode('ascii'))
+    w.write(b'\n')
+
+    trailer = 40
+    count = 0
+    while True:
+        if sections is not None and count >= sections:
+            break
+        if size is not None and w.written + trailer >= size:
+            break
+
+        kind = first.pop(0) if first else rnd.choice(kinds)
+        nbytes = rnd.randrange(lo, max(lo, hi) + 1)
+        if size is not None:  # do not overshoot (payload text is larger)
+            nbytes = max(1, min(nbytes, (size - w.written - trailer) // 2))
+
+        num = counters[kind]
+        counters[kind] += 1
+        count += 1
+
+        if kind == 'cfg':
+            name = CFG_NAMES[num] if num < len(CFG_NAMES) else \
+                'file{}.cfg'.format(num)
+        else:
+            name = 'file{}.{}'.format(num, 'bin' if kind == 'bin' else 'xml')
+
+        w.write('**** {}:{}\n'.format(SECTION_TAGS[kind], name).encode(
+            'ascii'))
+        w.tocrc(name.encode('ascii') + b'\0')
+
+        if kind == 'cfg':
+            if cfgpool is None:
+                cfgpool = _CfgPool(rnd, escapes)
+            _write_cfg(w, rnd, name, cfgpool, nbytes)
+        else:
+            bad = broken == ('badhex' if kind == 'bin' else 'badb64') and \
+                num == 0
+            _write_binary(w, rnd, pools[kind], nbytes, bad)
+
+        w.write(b'**** END OF FILE ****\n')
+
+    crc = format(w.crc & 0xffffffff, '08X')
+    if broken != 'notrailer':
+        trailer = crc if broken != 'badcrc' else \
+            format(~w.crc & 0xffffffff, '08X')
+        line = '**** END OF EXPORT {} ****\n'.format(trailer).encode('ascii')
+        if broken == 'truncated':
+            line = line[:len(line) // 2]
+        w.write(line)
+
+    return w.written, crc
+
+
+def _write_cfg(w, rnd, name, pool, nbytes):
+    '''Writes a cfg payload of about ``nbytes``'''
+    last = '/*\n * /var/flash/{}\n */\n\n'.format(name).encode('ascii')
+    w.write(last)
+    for text, crcdata in pool.cut(rnd, nbytes - len(last)):
+        w.write(text)
+        w.tocrc(last)
+        last = crcdata
+
+    w.tocrc(last[:-1])  # the last eol does not count
+
+
+def _write_binary(w, rnd, pool, nbytes, bad=False):
+    '''Writes a hex/base64 payload of ``nbytes``. With ``bad`` the second
+    line gets a character which is not part of the encoding'''
+    for raw, text in pool.cut(rnd, nbytes):
+        w.tocrc(raw)
+        if bad:
+            text = bytearray(text)
+            text[min(len(text) - 2, pool.linesize + 1)] = ord('!')
+            bad = False
+        w.write(text)
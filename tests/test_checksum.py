@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import base64
+import binascii
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from fritzchecksum import checksum
+
+
+def decode_lines(block, b64=False):
+    '''Reference decoder: one line at a time'''
+    decode = base64.b64decode if b64 else binascii.unhexlify
+    return b''.join(decode(l) for l in block.splitlines())
+
+
+class TestDecodeBlock(unittest.TestCase):
+
+    def test_short_last_line_fast_path(self):
+        for block, b64 in ((b'ABCD\nABCD\nEF\n', False),
+                           (b'ABCD\r\nABCD\r\nEF\r\n', False),
+                           (b'QUJD\nREVG\nRA==\n', True),
+                           (b'QUJDREVG\nQUI=\n', True)):
+            self.assertIsNotNone(
+                checksum.join_lines(block, 4 if b64 else 2), block)
+            self.assertEqual(checksum.decode_block(block, b64),
+                             decode_lines(block, b64))
+
+    def test_same_as_per_line(self):
+        for block, b64 in ((b'QQ==\nQUI=\n', True),
+                           (b'AB\nCDEF\n01\n', False)):
+            self.assertEqual(checksum.decode_block(block, b64),
+                             decode_lines(block, b64))
+
+    def test_rejected_as_per_line(self):
+        for block, b64 in ((b'QUJ\nDREVG\n', True),
+                           (b'AB CD\n', False),
+                           (b'ABC\nD\n', False)):
+            with self.assertRaises(binascii.Error):
+                checksum.decode_block(block, b64)
+
+
+HEADER = ('**** FRITZ!Box 7490 CONFIGURATION EXPORT\n'
+          'FirmwareVersion=113.06.30\n')
+ENDFILE = '**** END OF FILE ****\n'
+TRAILER = '**** END OF EXPORT 00000000 ****\n'
+
+EXPORTS = {
+    'plain': (HEADER + '**** CFGFILE:a.cfg\nab\ncd\n' + ENDFILE +
+              '**** BINFILE:b.bin\nABCD\nEF\n' + ENDFILE +
+              '**** B64FILE:c.bin\nQUJD\nRA==\n' + ENDFILE + TRAILER),
+    'non-ascii value': HEADER + 'Name=M\u00fcller\n' + TRAILER,
+    'non-ascii name': (HEADER + '**** CFGFILE:caf\u00e9.cfg\nabc\n' +
+                       ENDFILE + TRAILER),
+    'lone cr in cfg': (HEADER + '**** CFGFILE:a.cfg\nab\rcd\nef\n' +
+                       ENDFILE + TRAILER),
+    'lone cr at root': HEADER + 'A=b\rC=d\n' + TRAILER,
+    'lone cr before end': (HEADER + '**** CFGFILE:a.cfg\nab\r' + ENDFILE +
+                           TRAILER),
+    'lone cr in binfile': (HEADER + '**** BINFILE:b.bin\nABCD\rEF\n' +
+                           ENDFILE + TRAILER),
+    'cut cfg': HEADER + '**** CFGFILE:a.cfg\nab\ncd\n',
+    'cut cfg no eol': HEADER + '**** CFGFILE:a.cfg\nab\ncd',
+    'cut binfile': HEADER + '**** BINFILE:b.bin\nABCD\nEF\n',
+}
+
+
+class TestEngines(unittest.TestCase):
+    '''calc_crc32 (text mode) and calc_crc32_buffer give the same crcs'''
+
+    def check(self, name, data):
+        text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        expected = checksum.calc_crc32(text)
+        self.assertEqual(checksum.calc_crc32_buffer(data), expected, name)
+
+        out = io.BytesIO()  # looks for lone \r in advance
+        self.assertEqual(checksum.calc_crc32_buffer(data, fout=out),
+                         expected, name)
+
+    def test_lf(self):
+        for name, export in EXPORTS.items():
+            self.check(name, export.encode('utf-8'))
+
+    def test_crlf(self):
+        for name, export in EXPORTS.items():
+            self.check(name, export.replace('\n', '\r\n').encode('utf-8'))
+
+
+class TestTransform(unittest.TestCase):
+    '''A dst path is only replaced by a completely written export'''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, export):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(export.encode('utf-8'))
+        return path
+
+    def test_good(self):
+        src = self.write('good.export', EXPORTS['plain'])
+        dst = os.path.join(self.dir, 'out.export')
+        status, error = checksum.ExportFile().transform(src, dst)
+        self.assertTrue(status, error)
+        with open(dst, 'rb') as f:
+            self.assertTrue(f.read().endswith(b' ****\n'))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['good.export', 'out.export'])
+
+    def test_bad(self):
+        src = self.write('bad.export', EXPORTS['plain'].replace('EF', 'XY'))
+        dst = self.write('out.export', 'old')
+        with self.assertRaises(binascii.Error):
+            checksum.ExportFile().transform(src, dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['bad.export', 'out.export'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2016 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import binascii
+import unittest
+
+from fritzchecksum import checksum
+from fritzchecksum import extract
+
+
+class TestIterPayload(unittest.TestCase):
+
+    def test_error_line(self):
+        '''Decoding errors report the line number in the export'''
+        data = (b'**** FRITZ!Box 7490 CONFIGURATION EXPORT\n'
+                b'**** BINFILE:b.bin\n' + b'ABCD\n' * 8 + b'ABXY\n'
+                b'**** END OF FILE ****\n')
+        boff = data.index(b'ABCD')
+        eoff = data.index(b'**** END')
+        with self.assertRaises(binascii.Error) as cm:
+            for block in extract.iter_payload(data, checksum.TK_BINFILE,
+                                              boff, eoff, 16, 'b.bin'):
+                pass
+        self.assertIn('line 11', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()